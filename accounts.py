@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+
+log = logging.getLogger(__name__)
+
+
+class AccountDeletion:
+    """Deletes closed accounts in the background, a batch of books at a time.
+
+    `schedule` marks the user as pending deletion (sign-in and session
+    checks treat them as gone from then on) and queues a job, due once
+    other workers' cached copies of the user have expired. A worker
+    thread claims jobs, deletes the user's books in throttled batches, then
+    releases covers no other book uses and finally removes the stats, the
+    sync history and the user. Progress lives in the job document, so a job left behind by
+    a dead worker is picked up again once its lock expires.
+    """
+
+    def __init__(self, app=None, users=None, books=None, jobs=None, stats=None, covers=None, changes=None):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app, users, books, jobs, stats, covers, changes)
+
+    def init_app(self, app, users, books, jobs, stats, covers, changes):
+        self.app = app
+        self.users = users
+        self.books = books
+        self.jobs = jobs
+        self.stats = stats
+        self.covers = covers
+        self.changes = changes
+        app.config.setdefault('ACCOUNT_DELETE_BATCH_SIZE', 500)
+        # Pause between batches so one large library doesn't saturate the cluster.
+        app.config.setdefault('ACCOUNT_DELETE_BATCH_PAUSE', 0.2)
+        app.config.setdefault('ACCOUNT_DELETE_POLL_INTERVAL', 30)
+        app.config.setdefault('ACCOUNT_DELETE_LOCK_TIMEOUT', 300)
+        app.config.setdefault('ACCOUNT_DELETE_RETRY_DELAY', 60)
+        # Added to USER_CACHE_TTL for requests already in flight when the account was closed.
+        app.config.setdefault('ACCOUNT_DELETE_GRACE', 60)
+        app.before_request(self.start)
+
+    def create_indexes(self):
+        self.jobs.create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)])
+        self.jobs.create_index('finished_at', expireAfterSeconds=30 * 24 * 3600)
+
+    def schedule(self, user_id):
+        now = datetime.utcnow()
+        self.users.mark_for_deletion(user_id)
+        # Other workers may keep serving (and writing for) a cached copy of the user
+        # until it expires; purging before then would leave their writes orphaned.
+        delay = self.app.config.get('USER_CACHE_TTL', 0) + self.app.config['ACCOUNT_DELETE_GRACE']
+        self.jobs.update_one(
+            {'_id': user_id},
+            {'$setOnInsert': {'status': 'pending', 'created_at': now,
+                              'next_attempt_at': now + timedelta(seconds=delay),
+                              'books_deleted': 0, 'covers': [], 'legacy_covers': [], 'attempts': 0}},
+            upsert=True,
+        )
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='account-deletion', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            job = None
+            try:
+                job = self._claim()
+                if job:
+                    self._purge(job)
+                    continue
+            except Exception as e:
+                log.exception("Deleting account %s failed; retrying later.", job and job['_id'])
+                if job:
+                    self._failed(job, e)
+            self._wake.wait(self.app.config['ACCOUNT_DELETE_POLL_INTERVAL'])
+            self._wake.clear()
+
+    def _lock_until(self):
+        return datetime.utcnow() + timedelta(seconds=self.app.config['ACCOUNT_DELETE_LOCK_TIMEOUT'])
+
+    def _claim(self):
+        now = datetime.utcnow()
+        # A 'running' job whose lock expired belonged to a worker that died part-way through.
+        ready = {'$or': [
+            {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+            {'status': 'running', 'locked_until': {'$lte': now}},
+        ]}
+        return self.jobs.find_one_and_update(
+            ready,
+            {'$set': {'status': 'running', 'locked_until': self._lock_until()}},
+            sort=[('next_attempt_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _purge(self, job):
+        user_id = job['_id']
+        batch_size = self.app.config['ACCOUNT_DELETE_BATCH_SIZE']
+        while True:
+            batch = list(self.books.find({'user_id': user_id}, {'cover_hash': 1, 'cover_image': 1}).limit(batch_size))
+            if not batch:
+                break
+            # Record the covers before their books go, so a restart still knows to release them.
+            covers = list({book['cover_hash'] for book in batch if book.get('cover_hash')})
+            # Covers uploaded before hashing have only their URL to go by.
+            legacy = list({book['cover_image'] for book in batch if book.get('cover_image') and not book.get('cover_hash')})
+            self.jobs.update_one({'_id': user_id}, {'$addToSet': {'covers': {'$each': covers},
+                                                                  'legacy_covers': {'$each': legacy}}})
+            deleted = self.books.delete_many({'_id': {'$in': [book['_id'] for book in batch]}}).deleted_count
+            self.jobs.update_one(
+                {'_id': user_id},
+                {'$inc': {'books_deleted': deleted}, '$set': {'locked_until': self._lock_until()}},
+            )
+            time.sleep(self.app.config['ACCOUNT_DELETE_BATCH_PAUSE'])
+
+        job = self.jobs.find_one({'_id': user_id}, {'covers': 1, 'legacy_covers': 1})
+        for digest in job.get('covers', []):
+            self.covers.discard_if_unused(digest)
+            self.jobs.update_one({'_id': user_id}, {'$pull': {'covers': digest}})
+        for url in job.get('legacy_covers', []):
+            self.covers.discard_url_if_unused(url)
+            self.jobs.update_one({'_id': user_id}, {'$pull': {'legacy_covers': url}})
+
+        self.stats.delete(user_id)
+        self.changes.forget(user_id)
+        self.users.delete(user_id)
+        job = self.jobs.find_one_and_update(
+            {'_id': user_id},
+            {'$set': {'status': 'done', 'finished_at': datetime.utcnow()}, '$unset': {'locked_until': ''}},
+            return_document=ReturnDocument.AFTER,
+        )
+        log.info("Deleted account %s (%d books).", user_id, job['books_deleted'])
+
+    def _failed(self, job, error):
+        attempts = job.get('attempts', 0) + 1
+        delay = self.app.config['ACCOUNT_DELETE_RETRY_DELAY'] * 2 ** min(attempts - 1, 6)
+        self.jobs.update_one(
+            {'_id': job['_id']},
+            {'$set': {'status': 'pending', 'attempts': attempts, 'last_error': str(error),
+                      'next_attempt_at': datetime.utcnow() + timedelta(seconds=delay)},
+             '$unset': {'locked_until': ''}},
+        )
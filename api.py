@@ -0,0 +1,240 @@
+from flask import Blueprint, current_app, jsonify, request, session, url_for
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
+
+from book_io import EXPORT_FIELDS, book_to_json, parse_book_entry, parse_book_update
+from changes import ExpiredChangeToken, InvalidChangeToken
+from library import SORT_MODES, DEFAULT_SORT, InvalidCursor
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+API_FIELDS = EXPORT_FIELDS + ['updated_at', 'rev']
+CHANGE_PROJECTION = {field: 1 for field in API_FIELDS}
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+MAX_BULK_OPERATIONS = 1000
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+@api.errorhandler(ApiError)
+def api_error(e):
+    body = {'error': e.message}
+    if e.details:
+        body['details'] = e.details
+    return jsonify(body), e.status
+
+
+def library():
+    return current_app.extensions['library']
+
+
+@api.before_request
+def authenticate():
+    if not session.get('user_id'):
+        raise ApiError("Authentication required.", 401)
+    # The blueprint is exempt from CSRF tokens; browsers can't send a cross-site
+    # JSON body without a CORS preflight, so JSON-only writes are the protection.
+    if request.method in ('POST', 'PATCH') and not request.is_json:
+        raise ApiError("Expected a JSON request body.", 415)
+
+
+def current_user_id():
+    return ObjectId(session['user_id'])
+
+
+def parse_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ApiError(f"Invalid book id {value!r}.", 404)
+
+
+def get_limit():
+    try:
+        return max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        raise ApiError("limit must be a number.")
+
+
+def get_projection():
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = sorted(set(fields) - set(API_FIELDS))
+    if unknown:
+        raise ApiError(f"Unknown field {unknown[0]!r}.")
+    return {field: 1 for field in fields}
+
+
+def project(book, projection):
+    # Fields pulled in only for paging or ownership checks aren't part of the response.
+    if projection:
+        book = {field: value for field, value in book.items() if field in projection or field == '_id'}
+    return book_to_json(book)
+
+
+def get_json_body(kind):
+    body = request.get_json(silent=True)
+    if not isinstance(body, kind):
+        raise ApiError("Malformed JSON body.")
+    return body
+
+
+def parse_new_book(entry, user_id):
+    parse_book_update(entry)  # rejects unknown fields
+    return parse_book_entry(entry, user_id)
+
+
+def get_owned_book(book_id):
+    book = library().get(current_user_id(), parse_id(book_id))
+    if book is None:
+        raise ApiError("Book not found.", 404)
+    return book
+
+
+@api.get('/books')
+def list_books():
+    sort_mode = request.args.get('sort', DEFAULT_SORT)
+    if sort_mode not in SORT_MODES:
+        raise ApiError(f"Unknown sort {sort_mode!r}; use one of {', '.join(SORT_MODES)}.")
+    limit = get_limit()
+    projection = get_projection()
+
+    try:
+        books, next_cursor = library().page(current_user_id(), sort_mode, limit, request.args.get('after'), projection)
+    except InvalidCursor:
+        raise ApiError("Invalid or expired cursor.")
+    return jsonify(books=[project(book, projection) for book in books], next_cursor=next_cursor)
+
+
+@api.get('/changes')
+def list_changes():
+    """Books written or deleted since `since`, the `next` token of an earlier response.
+
+    Without `since` every book is listed, as a full sync. Keep requesting
+    with `next` while `more` is true, then store it for the next sync.
+    Deleted books appear as {"_id": ..., "rev": ..., "deleted": true}.
+    Books written in the last few seconds may be sent again on the next
+    sync, so apply entries as upserts by `_id`.
+    """
+    try:
+        entries, next_token, more = library().changes.changes(
+            current_user_id(), request.args.get('since'), get_limit(), CHANGE_PROJECTION
+        )
+    except ExpiredChangeToken as e:
+        raise ApiError(str(e), 410)
+    except InvalidChangeToken:
+        raise ApiError("Invalid change token.")
+    return jsonify(changes=[book_to_json(entry) for entry in entries], next=next_token, more=more)
+
+
+@api.get('/books/<book_id>')
+def get_book(book_id):
+    projection = get_projection()
+    book = library().get(current_user_id(), parse_id(book_id), projection)
+    if book is None:
+        raise ApiError("Book not found.", 404)
+    return jsonify(project(book, projection))
+
+
+@api.post('/books')
+def create_book():
+    try:
+        book = parse_new_book(get_json_body(dict), current_user_id())
+    except ValueError as e:
+        raise ApiError(str(e), 422)
+    book = library().add(book)
+    response = jsonify(book_to_json(book))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.get_book', book_id=str(book['_id']))
+    return response
+
+
+@api.patch('/books/<book_id>')
+def update_book(book_id):
+    book = get_owned_book(book_id)
+    try:
+        fields = parse_book_update(get_json_body(dict))
+    except ValueError as e:
+        raise ApiError(str(e), 422)
+    return jsonify(book_to_json(library().update(book, fields)))
+
+
+@api.delete('/books/<book_id>')
+def delete_book(book_id):
+    library().remove(get_owned_book(book_id))
+    return '', 204
+
+
+@api.post('/books/bulk')
+def bulk_books():
+    """Create, update and delete many books in one request.
+
+    Body: {"create": [book, ...], "update": [{"_id": ..., field: value}, ...], "delete": [id, ...]}.
+    Everything is validated first; if any entry is invalid nothing is written.
+    """
+    body = get_json_body(dict)
+    creates, updates, deletes = body.get('create', []), body.get('update', []), body.get('delete', [])
+    if not all(isinstance(part, list) for part in (creates, updates, deletes)):
+        raise ApiError("'create', 'update' and 'delete' must be lists.")
+    if len(creates) + len(updates) + len(deletes) > MAX_BULK_OPERATIONS:
+        raise ApiError(f"At most {MAX_BULK_OPERATIONS} operations per request.", 413)
+
+    user_id = current_user_id()
+    errors, new_books, changes, removals, seen = [], [], [], [], set()
+
+    def touched(op, index, book_id):
+        # One operation per book per request, so the stats bookkeeping stays exact.
+        if book_id in seen:
+            errors.append({'op': op, 'index': index, 'error': f"Book {book_id} appears more than once"})
+            return False
+        seen.add(book_id)
+        return True
+
+    for index, entry in enumerate(creates):
+        try:
+            new_books.append(parse_new_book(entry, user_id))
+        except ValueError as e:
+            errors.append({'op': 'create', 'index': index, 'error': str(e)})
+    for index, entry in enumerate(updates):
+        try:
+            if not isinstance(entry, dict) or '_id' not in entry:
+                raise ValueError("Missing _id")
+            book_id = parse_id(entry['_id'])
+            fields = parse_book_update({key: value for key, value in entry.items() if key != '_id'})
+        except (ValueError, ApiError) as e:
+            errors.append({'op': 'update', 'index': index, 'error': str(e)})
+            continue
+        if touched('update', index, book_id):
+            changes.append((book_id, fields))
+    for index, value in enumerate(deletes):
+        try:
+            book_id = parse_id(value)
+        except ApiError as e:
+            errors.append({'op': 'delete', 'index': index, 'error': str(e)})
+            continue
+        if touched('delete', index, book_id):
+            removals.append(book_id)
+
+    if errors:
+        raise ApiError("Some operations are invalid; nothing was changed.", 422, errors)
+
+    try:
+        result = library().bulk(user_id, new_books, changes, removals)
+    except BulkWriteError as e:
+        raise ApiError("The bulk write partially failed.", 500, {'write_errors': len(e.details.get('writeErrors', []))})
+    return jsonify(
+        created=[str(book['_id']) for book in result['created']],
+        updated=[str(book['_id']) for book in result['updated']],
+        deleted=[str(book_id) for book_id in result['deleted']],
+        missing=[str(book_id) for book_id in result['missing']],
+    )
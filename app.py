@@ -1,22 +1,43 @@
 import os
+import io
+import csv
 import json
-from datetime import datetime, timedelta
+import time
+import threading
+import hashlib
+from datetime import datetime, timedelta, timezone
 from itsdangerous import URLSafeTimedSerializer as Serializer
 from dotenv import load_dotenv
+import click
 
-from flask import Flask, request, session, flash, redirect, render_template, url_for, make_response
-from flask_wtf.csrf import CSRFProtect
-from flask_mail import Mail, Message
+from flask import Flask, request, session, flash, redirect, render_template, url_for, make_response, g, jsonify, stream_with_context
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+from flask_mail import Mail
 from markupsafe import Markup
+from jinja2 import FileSystemBytecodeCache
 
-from werkzeug.security import check_password_hash, generate_password_hash
-from pymongo import MongoClient
 from bson.objectid import ObjectId
-import certifi
-import cloudinary
-import cloudinary.uploader
-from cloudinary.exceptions import Error as CloudinaryError
 
+from cache import TTLCache
+from instrumentation import Instrumentation
+from passwords import PasswordHasher, HashingBusy
+from ratelimit import Limiter, RateLimited, form_value
+from storage import Storage, BookSummary, UserSummary
+from book_io import (
+    EXPORT_FORMATS, EXPORT_PROJECTION, EXPORTERS, READERS, ImportFormatError,
+    encode_chunks, gzip_chunks, read_json_array, parse_book_entry, parse_change_entry, duplicate_keys, book_to_json,
+    normalize_isbn,
+)
+from library import Library, SORT_MODES, DEFAULT_SORT, InvalidCursor
+from accounts import AccountDeletion
+from api import api
+from catalog import Catalog, build_catalog
+from changes import ChangeLog
+from events import EventBroker, TooManyStreams
+from recommend import Recommender
+from mailer import Outbox
+from stats import LibraryStats, STATS_PROJECTION
+from covers import CoverPipeline, CloudinaryCoverStore, LocalCoverStore, InvalidCover
 from forms import Book, Login, SignUp, Data, RequestReset, ResetPassword, ResendVerification, EditProfile
 
 load_dotenv('.env')
@@ -34,66 +55,321 @@ CLOUDINARY_CLOUD_NAME = os.environ.get('CLOUDINARY_CLOUD_NAME')
 CLOUDINARY_API_KEY = os.environ.get('CLOUDINARY_API_KEY')
 CLOUDINARY_API_SECRET = os.environ.get('CLOUDINARY_API_SECRET')
 
-if not MONGO_URI:
-    raise ValueError("MONGO_URI environment variable is not set!")
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
 
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+# Point MAIL_SERVER/MAIL_PORT at a local SMTP stand-in (or set MAIL_SUPPRESS_SEND) when developing or testing.
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
+app.config['MAIL_SUPPRESS_SEND'] = os.environ.get('MAIL_SUPPRESS_SEND', 'false').lower() == 'true'
 app.config['MAIL_USERNAME'] = EMAIL
 app.config['MAIL_PASSWORD'] = PASSWORD
 app.config['MAIL_DEFAULT_SENDER'] = EMAIL
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Changing the method rehashes each user's password the next time they log in.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))
+# Each open /events stream holds a worker thread; keep this well under GUNICORN_THREADS.
+# Off under sync workers, where one stream would tie up the whole process for EVENTS_STREAM_TIMEOUT.
+_threaded_workers = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread') != 'sync' and int(os.environ.get('GUNICORN_THREADS', 32)) > 1
+app.config['EVENTS_ENABLED'] = os.environ.get('EVENTS_ENABLED', str(_threaded_workers)).lower() == 'true'
+app.config['EVENTS_MAX_STREAMS'] = int(os.environ.get('EVENTS_MAX_STREAMS', 16))
+app.config['EVENTS_CHANGE_STREAM'] = os.environ.get('EVENTS_CHANGE_STREAM', 'false').lower() == 'true'
+# 'mongo' shares rate-limit counters across workers at the cost of a round trip per limited request.
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
+app.config['RATELIMIT_STORAGE'] = os.environ.get('RATELIMIT_STORAGE', 'memory')
+app.config['MONGO_URI'] = MONGO_URI
+# 'memory' runs against an in-process mongomock database (benchmarks, local load tests).
+app.config['STORAGE_BACKEND'] = STORAGE_BACKEND
+app.config['MONGO_MAX_POOL_SIZE'] = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+app.config['MONGO_MIN_POOL_SIZE'] = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+app.config['MONGO_MAX_IDLE_TIME_MS'] = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 60000))
+app.config['MONGO_CONNECT_TIMEOUT_MS'] = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'] = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+app.config['MONGO_SOCKET_TIMEOUT_MS'] = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 20000))
+# Built by `flask import-catalog`; without it the add-book autocomplete stays empty.
+app.config['CATALOG_DIR'] = os.environ.get('CATALOG_DIR') or os.path.join(app.instance_path, 'catalog')
+# Production indexes are built once with `flask init-db`; the in-memory backend builds its own per process.
+app.config['AUTO_CREATE_INDEXES'] = os.environ.get('AUTO_CREATE_INDEXES', str(STORAGE_BACKEND == 'memory')).lower() == 'true'
+
+# --- Bookshelf Pagination ---
+DEFAULT_PAGE_SIZE = 48
+MAX_PAGE_SIZE = 200
+EXPORT_BATCH_SIZE = 500
+IMPORT_BATCH_SIZE = 500
+MAX_REPORTED_IMPORT_ERRORS = 5
+
+# How long a cached library page may be revalidated with a 304 before it is re-rendered.
+ETAG_WINDOW = 1800
+
+# --- Instrumentation ---
+# Server-Timing headers, slow request log and /metrics.
+instrumentation = Instrumentation(app)
+
+# --- Password Hashing ---
+passwords = PasswordHasher(app)
+hash_password = instrumentation.timed('hash')(passwords.hash)
+verify_password = instrumentation.timed('hash')(passwords.verify)
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    return "The server is busy signing other people in. Please try again in a moment.", 503, {'Retry-After': '2'}
+
+
+# --- Database ---
+# Nothing connects here; the client is created on first use so workers boot without waiting on MongoDB.
+storage = Storage.from_config(app.config, event_listeners=[instrumentation.command_listener])
+user_repo = storage.users
+book_repo = storage.books
+
+# --- Rate Limiting ---
+limiter = Limiter(app, storage.collection('rate_limits'))
+
+
+@app.errorhandler(RateLimited)
+def rate_limited(e):
+    return "Too many attempts. Please wait a little and try again.", 429, {'Retry-After': str(e.retry_after)}
+
+
+
+if os.environ.get('COVER_STORE', 'cloudinary' if CLOUDINARY_CLOUD_NAME else 'local') == 'cloudinary':
+    cover_store = CloudinaryCoverStore(CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET)
+else:
+    cover_store = LocalCoverStore(os.path.join(app.static_folder, 'uploads', 'covers'), f"{app.static_url_path}/uploads/covers")
+library_stats = LibraryStats(storage.collection('stats'), book_repo.collection)
+change_log = ChangeLog(app, storage.collection('sync_counters'), storage.collection('tombstones'), book_repo)
+library = Library(book_repo, library_stats, app.config['SECRET_KEY'], change_log)
+app.extensions['library'] = library
+events = EventBroker(app, library, book_repo.collection)
+cover_pipeline = CoverPipeline(app, cover_store, book_repo.collection, storage.collection('covers'),
+                               on_change=library.touched, timer=instrumentation.timer)
+
+account_deletion = AccountDeletion(app, user_repo, book_repo.collection, storage.collection('deletion_jobs'),
+                                   library_stats, cover_pipeline, change_log)
+catalog = Catalog(app.config['CATALOG_DIR'])
+recommender = Recommender(app, library, catalog)
+mail = Mail(app)
+outbox = Outbox(app, mail, storage.collection('outbox'), timer=instrumentation.timer)
+csrf = CSRFProtect(app)
+csrf.exempt(api)
+app.register_blueprint(api)
+s = Serializer(app.config['SECRET_KEY'])
 
-# --- Cloudinary Setup ---
-cloudinary.config(
-    cloud_name=CLOUDINARY_CLOUD_NAME,
-    api_key=CLOUDINARY_API_KEY,
-    api_secret=CLOUDINARY_API_SECRET
-)
+# Process-wide cache of UserSummary records, keyed by the string form of the user's _id.
+user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
 
-# --- Database Connection ---
-try:
-    client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
-    db = client.myreadingjourney
-    users_collection = db.users
-    books_collection = db.books
-    users_collection.create_index("email", unique=True)
-    users_collection.create_index("userid", unique=True)
-    client.admin.command('ping')
-    print("Successfully connected to MongoDB Atlas!")
-except Exception as e:
-    print(f"Error: Could not connect to MongoDB Atlas. Check your MONGO_URI. \n{e}")
-    client = None
-    db = None
-    users_collection = None
-    books_collection = None
 
+def load_user(user_id):
+    user_id = str(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = user_repo.get(ObjectId(user_id), UserSummary.projection())
+        if user:
+            user = UserSummary(user)
+            user_cache.set(user_id, user)
+    return user
 
-mail = Mail(app)
-csrf = CSRFProtect(app)
-s = Serializer(app.config['SECRET_KEY'])
+
+def invalidate_user(user_id):
+    user_cache.pop(str(user_id))
+    g.pop('current_user', None)
+
+
+def get_current_user():
+    # Loaded at most once per request; views, hooks and templates all share it.
+    if 'current_user' not in g:
+        g.current_user = None
+        if 'user_id' in session:
+            try:
+                g.current_user = load_user(session['user_id'])
+            except Exception:
+                g.current_user = None
+    return g.current_user
 
 
 def send_verification_email(user):
     token = s.dumps(user['email'], salt='email-confirm-salt')
     confirm_url = url_for('verify_email', token=token, _external=True)
     
-    msg = Message(
+    outbox.enqueue(
         "Confirm Your Email Address - My Reading Journey",
-        sender=app.config['MAIL_DEFAULT_SENDER'],
-        recipients=[user['email']]
+        recipients=[user['email']],
+        html=render_template('verify_email.html', confirm_url=confirm_url, user=user)
     )
-    msg.html = render_template('verify_email.html', confirm_url=confirm_url, user=user)
-    mail.send(msg)
+
+
+# --- Templates ---
+# Compiled templates are kept on disk so a fresh worker doesn't recompile every one on its first requests.
+# The directory is private to the app: bytecode loaded from a path others can write to would run as ours.
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+os.makedirs(JINJA_CACHE_DIR, mode=0o700, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Rendered book cards: book _id -> (updated_at, html). Mutations here evict their cards; the
+# updated_at check also catches edits made by other worker processes.
+app.config['CARD_CACHE_SIZE'] = int(os.environ.get('CARD_CACHE_SIZE', 5000))
+app.config['CARD_CACHE_TTL'] = int(os.environ.get('CARD_CACHE_TTL', 3600))
+card_cache = TTLCache(maxsize=app.config['CARD_CACHE_SIZE'], ttl=app.config['CARD_CACHE_TTL'])
+
+
+def evict_cards(user_id, changed, deleted):
+    for book in changed:
+        card_cache.pop(str(book['_id']))
+    for book_id in deleted:
+        card_cache.pop(str(book_id))
+
+
+library.subscribe(evict_cards)
+
+
+@app.template_global()
+def render_book_card(book):
+    book_id, updated_at = str(book['_id']), book.get('updated_at')
+    cached = card_cache.get(book_id)
+    if cached and cached[0] == updated_at:
+        return cached[1]
+    # The card only needs the book and url_for, so skip render_template's context processors and signals.
+    html = Markup(app.jinja_env.get_template('book_card.html').render(book=book))
+    card_cache.set(book_id, (updated_at, html))
+    return html
+
+
+@app.template_global()
+def render_book_cards(books):
+    return Markup(''.join(render_book_card(book) for book in books))
+
+
+def library_validators(user_oid, *parts):
+    # Everything a library page depends on besides the books themselves: the user's
+    # library version, their name/email in the navbar, the URL, the session's CSRF
+    # token (a new sign-in gets a new one) and a time bucket that keeps the page's
+    # signed token from going stale behind a 304.
+    doc = library_stats.get(user_oid)
+    user = get_current_user() or {}
+    bucket = int(time.time() // ETAG_WINDOW)
+    generate_csrf()  # Creates the session's token on a first visit, so the page rendered now matches.
+    csrf_secret = session.get(app.config['WTF_CSRF_FIELD_NAME'])
+    raw = '|'.join(str(part) for part in (
+        user_oid, doc.get('version', 0), user.get('name'), user.get('email'), bucket, request.full_path,
+        csrf_secret, *parts
+    ))
+    etag = hashlib.sha1(raw.encode()).hexdigest()
+
+    last_modified = datetime.fromtimestamp(bucket * ETAG_WINDOW, tz=timezone.utc)
+    if doc.get('updated_at'):
+        last_modified = max(last_modified, doc['updated_at'].replace(tzinfo=timezone.utc))
+    return doc, etag, last_modified.replace(microsecond=0)
+
+
+def not_modified(etag, last_modified):
+    if session.get('_flashes'):
+        # Pending flash messages must be rendered into a fresh page.
+        return None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    if not fresh:
+        return None
+    response = app.response_class(status=304)
+    return with_validators(response, etag, last_modified)
+
+
+def with_validators(response, etag, last_modified):
+    response = make_response(response)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+_static_hashes = {}
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    # Static URLs carry a content hash so they can be cached for a year and still change on deploy.
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    filename = values['filename']
+    digest = None if app.debug else _static_hashes.get(filename)
+    if digest is None:
+        try:
+            with open(os.path.join(app.static_folder, filename), 'rb') as f:
+                digest = hashlib.md5(f.read()).hexdigest()[:12]
+        except OSError:
+            return
+        _static_hashes[filename] = digest
+    values.setdefault('v', digest)
+
+
+@app.after_request
+def cache_static(response):
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
+def create_app(config=None):
+    """Return the app with `config` applied over the environment settings.
+
+    Usable as `gunicorn "app:create_app()"` or from tests. Nothing here talks
+    to the network: MongoDB, SMTP, Cloudinary and the catalog files are only
+    reached on first use, and the caches are resized here, so overrides take
+    effect as long as no request has been served yet.
+    """
+    if config:
+        app.config.update(config)
+        storage.configure(app.config)
+        passwords.init_app(app)
+        limiter.init_app(app, storage.collection('rate_limits'))
+        change_log.init_app(app, storage.collection('sync_counters'), storage.collection('tombstones'), book_repo)
+        mail.init_app(app)
+        catalog.configure(app.config['CATALOG_DIR'])
+        recommender.configure(app.config)
+        user_cache.resize(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+        card_cache.resize(app.config['CARD_CACHE_SIZE'], app.config['CARD_CACHE_TTL'])
+    return app
+
+
+def create_indexes():
+    storage.create_indexes()
+    outbox.create_indexes()
+    limiter.create_indexes()
+    account_deletion.create_indexes()
+    change_log.create_indexes()
+
+
+_indexes_ready = False
+
+
+@app.before_request
+def ensure_indexes():
+    # Only with AUTO_CREATE_INDEXES; otherwise `flask init-db` has already built them.
+    global _indexes_ready
+    if not _indexes_ready:
+        if app.config['AUTO_CREATE_INDEXES']:
+            create_indexes()
+        _indexes_ready = True
 
 
 @app.before_request
 def check_user_session():
-    if 'user_id' in session and users_collection is not None:
+    if 'user_id' in session:
         try:
-            user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
+            user = load_user(session['user_id'])
+            g.current_user = user
             if not user:
                 session.clear()
                 flash("Your session was invalid and has been cleared. Please log in again.", "warning")
@@ -103,13 +379,20 @@ def check_user_session():
 
 @app.context_processor
 def inject_user():
-    current_user = None
-    if 'user_id' in session and users_collection is not None:
-        try:
-            current_user = users_collection.find_one({'_id': ObjectId(session['user_id'])})
-        except Exception:
-            current_user = None
-    return dict(current_user=current_user)
+    return dict(current_user=get_current_user())
+
+
+def get_page_size():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def search_books_page(user_oid, query, limit, page, projection=None):
+    books = book_repo.search(user_oid, query, (page - 1) * limit, limit + 1, projection)
+    return books[:limit], len(books) > limit
 
 
 @app.route("/")
@@ -119,35 +402,82 @@ def home():
         flash("Please log in to view your bookshelf.", "warning")
         return redirect(url_for('login'))
 
-    user_id = session['user_id']
-    books = []
-    if users_collection is not None:
-        books = list(books_collection.find({'user_id': ObjectId(user_id)}).sort('reading_started', 1))
+    sort_mode = request.args.get('sort', DEFAULT_SORT)
+    if sort_mode not in SORT_MODES:
+        sort_mode = DEFAULT_SORT
+    limit = get_page_size()
+    after = request.args.get('after')
+
+    user_oid = ObjectId(session['user_id'])
+    stats_doc, etag, last_modified = library_validators(user_oid)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    try:
+        books, next_cursor = library.page(user_oid, sort_mode, limit, after, BookSummary.projection())
+    except InvalidCursor:
+        return redirect(url_for('home', sort=sort_mode, limit=limit))
+    books = [BookSummary(book) for book in books]
+    summary = library_stats.summary(user_oid, stats_doc)
 
     json_form = Data()
-    return render_template("index.html", title="Home - My Reading Journey", books=books, json_form=json_form)
+    page = render_template("index.html", title="Home - My Reading Journey", books=books, summary=summary,
+                           sort_mode=sort_mode, limit=limit, after=after, next_cursor=next_cursor, json_form=json_form)
+    return with_validators(page, etag, last_modified)
+
+
+@app.route("/search")
+def search_books():
+    wants_json = request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+    if not session.get('user_id'):
+        if wants_json:
+            return jsonify(error="Authentication required."), 401
+        return redirect(url_for('login'))
+
+    query = request.args.get('q', '').strip()
+    limit = get_page_size()
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        page = 1
+
+    books, has_more = [], False
+    if query:
+        # JSON results carry whole books; the HTML cards only need their summaries.
+        projection = None if wants_json else BookSummary.projection()
+        books, has_more = search_books_page(ObjectId(session['user_id']), query, limit, page, projection)
+    next_page = page + 1 if has_more else None
+
+    if wants_json:
+        return jsonify(query=query, page=page, next_page=next_page, results=[book_to_json(book) for book in books])
+
+    response = make_response(render_template('search_results.html', books=[BookSummary(book) for book in books]))
+    if next_page:
+        response.headers['X-Next-Page'] = str(next_page)
+    return response
 
 
 @app.route("/sign_up", methods=['GET', 'POST'])
+@limiter.limit('10/hour')
+@limiter.limit('3/hour', key=form_value('email'))
 def sign_up():
     form = SignUp()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data)
-
-        if users_collection.find_one({"email": form.email.data}):
+        if user_repo.is_taken('email', form.email.data):
             flash("Email already taken. Please choose another.", "danger")
-        elif users_collection.find_one({"userid": form.userid.data}):
+        elif user_repo.is_taken('userid', form.userid.data):
             flash("User ID already taken. Please choose another.", "danger")
         else:
             new_user = {
                 "name": form.name.data,
                 "userid": form.userid.data,
                 "email": form.email.data,
-                "password": hashed_password,
+                "password": hash_password(form.password.data),
                 "theme": "light",
                 "is_verified": False
             }
-            users_collection.insert_one(new_user)
+            user_repo.insert(new_user)
             send_verification_email(new_user)
             flash("Account created successfully! Please check your email to verify your account.", "success")
             return redirect(url_for('login'))
@@ -163,7 +493,7 @@ def verify_email(token):
         flash('The confirmation link is invalid or has expired.', 'danger')
         return redirect(url_for('login'))
 
-    user = users_collection.find_one({"email": email})
+    user = user_repo.by_email(email)
     if not user:
         flash('User not found.', 'danger')
         return redirect(url_for('login'))
@@ -171,20 +501,23 @@ def verify_email(token):
     if user.get('is_verified'):
         flash('Account already verified. Please log in.', 'info')
     else:
-        users_collection.update_one({'_id': user['_id']}, {'$set': {'is_verified': True}})
+        user_repo.update(user['_id'], {'is_verified': True})
+        invalidate_user(user['_id'])
         flash('Your account has been verified! You can now log in.', 'success')
         
     return redirect(url_for('login'))
 
 
 @app.route("/resend_verification", methods=['GET', 'POST'])
+@limiter.limit('10/hour')
+@limiter.limit('3/hour', key=form_value('email'))
 def resend_verification():
     if 'user_id' in session:
         return redirect(url_for('home'))
 
     form = ResendVerification()
     if form.validate_on_submit():
-        user = users_collection.find_one({"email": form.email.data})
+        user = user_repo.by_email(form.email.data)
         if user:
             if user.get('is_verified'):
                 flash('This account has already been verified. Please log in.', 'info')
@@ -199,21 +532,27 @@ def resend_verification():
 
 
 @app.route("/login", methods=['GET', 'POST'])
+@limiter.limit('20/minute')
+@limiter.limit('5/minute', key=form_value('email', 'userid'))
 def login():
     form = Login()
     if form.validate_on_submit():
         user = None
         if form.email.data:
-            user = users_collection.find_one({"email": form.email.data})
+            user = user_repo.by_email(form.email.data)
         elif form.userid.data:
-            user = users_collection.find_one({"userid": form.userid.data})
+            user = user_repo.by_userid(form.userid.data)
 
-        if user and check_password_hash(user["password"], form.password.data):
+        if user and verify_password(user["password"], form.password.data):
             if not user.get('is_verified'):
                 message = Markup(f"Your account is not verified. <a href='{url_for('resend_verification')}' class='auth-link'>Resend verification email?</a>")
                 flash(message, 'warning')
                 return redirect(url_for('login'))
-            
+
+            if passwords.needs_rehash(user["password"]):
+                user_repo.update(user["_id"], {'password': hash_password(form.password.data)})
+                invalidate_user(user["_id"])
+
             session['user_id'] = str(user["_id"])
             session.permanent = True
             flash(f"Welcome {user['name']}", "success")
@@ -239,7 +578,7 @@ def settings():
 
     try:
         user_oid = ObjectId(session.get('user_id'))
-        user = users_collection.find_one({'_id': user_oid})
+        user = get_current_user()
     except Exception:
         user = None
 
@@ -253,9 +592,9 @@ def settings():
         email_changed = form.email.data != user['email']
         userid_changed = form.userid.data != user['userid']
 
-        if email_changed and users_collection.find_one({'email': form.email.data, '_id': {'$ne': user_oid}}):
+        if email_changed and user_repo.is_taken('email', form.email.data, exclude_id=user_oid):
             flash('This Email Address is already taken. Please choose another one.', 'danger')
-        elif userid_changed and users_collection.find_one({'userid': form.userid.data, '_id': {'$ne': user_oid}}):
+        elif userid_changed and user_repo.is_taken('userid', form.userid.data, exclude_id=user_oid):
             flash('This User ID is already taken. Please choose another one.', 'danger')
         else:
             update_data = {
@@ -264,9 +603,11 @@ def settings():
                 'email': form.email.data,
             }
             if form.password.data:
-                update_data['password'] = generate_password_hash(form.password.data)
+                update_data['password'] = hash_password(form.password.data)
             
-            users_collection.update_one({'_id': user_oid}, {'$set': update_data})
+            user_repo.update(user_oid, update_data)
+            # Enough for cached library pages too: their ETag covers the name and email they show.
+            invalidate_user(user_oid)
             flash("Profile updated successfully!", "success")
             return redirect(url_for('home'))
 
@@ -284,32 +625,38 @@ def delete_account():
     if not user_id:
         return redirect(url_for('login'))
 
+    # The account disappears now; its books and covers are removed in the background.
     user_oid = ObjectId(user_id)
-    books_collection.delete_many({'user_id': user_oid})
-    users_collection.delete_one({'_id': user_oid})
+    account_deletion.schedule(user_oid)
+    invalidate_user(user_oid)
 
     session.clear()
-    flash("Your account and all associated data have been permanently deleted.", "success")
+    flash("Your account has been deleted. All associated data will be permanently removed shortly.", "success")
     return redirect(url_for('home'))
 
 
 @app.route("/forgot_password", methods=['GET', 'POST'])
+@limiter.limit('10/hour')
+@limiter.limit('3/hour', key=form_value('email'))
 def forgot_password():
     form = RequestReset()
     if form.validate_on_submit():
-        user = users_collection.find_one({"email": form.email.data})
+        user = user_repo.by_email(form.email.data)
         if user:
             token = s.dumps(user['email'], salt='password-reset-salt')
             reset_url = url_for('reset_password', token=token, _external=True)
-            msg = Message("Password Reset Request", recipients=[user['email']])
-            msg.body = f"To reset your password, visit the following link:\n{reset_url}\n\nIf you did not make this request, ignore this email."
-            mail.send(msg)
+            outbox.enqueue(
+                "Password Reset Request",
+                recipients=[user['email']],
+                body=f"To reset your password, visit the following link:\n{reset_url}\n\nIf you did not make this request, ignore this email."
+            )
         flash(f"A password reset link has been sent to {form.email.data}.", "info")
         return redirect(url_for('login'))
     return render_template('forgot_password.html', title='Forgot Password', form=form, json_form=Data())
 
 
 @app.route("/reset_password/<token>", methods=['GET', 'POST'])
+@limiter.limit('10/hour')
 def reset_password(token):
     try:
         email = s.loads(token, salt='password-reset-salt', max_age=1800)
@@ -317,36 +664,54 @@ def reset_password(token):
         flash('The password reset link is invalid or has expired.', 'warning')
         return redirect(url_for('forgot_password'))
         
-    user = users_collection.find_one({"email": email})
+    user = user_repo.by_email(email)
     if not user:
         flash('User not found.', 'danger')
         return redirect(url_for('login'))
 
     form = ResetPassword()
     if form.validate_on_submit():
-        hashed_password = generate_password_hash(form.password.data)
-        users_collection.update_one({'_id': user['_id']}, {'$set': {'password': hashed_password}})
+        hashed_password = hash_password(form.password.data)
+        user_repo.update(user['_id'], {'password': hashed_password})
+        invalidate_user(user['_id'])
         flash('Your password has been updated! You can now log in.', 'success')
         return redirect(url_for('login'))
 
     return render_template('reset_password.html', title='Reset Password', form=form, json_form=Data())
 
 
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+
+def summary_json(user_oid):
+    summary = library_stats.summary(user_oid)
+    return {key: summary[key] for key in ('total', 'finished', 'avg_rating')}
+
+
+def book_change_response(book, status=200):
+    # Script callers get the changed card to patch into the grid instead of a redirect.
+    return jsonify(book=book_to_json(book), html=render_book_card(book), summary=summary_json(book['user_id'])), status
+
+
 @app.route("/add_book", methods=['GET', 'POST'])
 def add_book():
     if not session.get('user_id'):
         flash("Please log in to add a book.", "warning")
         return redirect(url_for('login'))
 
-    form = Book()
+    # "Add to shelf" links from catalog recommendations arrive with an ISBN to prefill from.
+    prefill = catalog.lookup(request.args.get('isbn')) if request.method == 'GET' else None
+    form = Book(**(prefill or {}))
     if form.validate_on_submit():
-        cover_image_url = None
+        pending_cover = None
         if form.cover_image.data:
             try:
-                upload_result = cloudinary.uploader.upload(form.cover_image.data)
-                cover_image_url = upload_result['secure_url']
-            except CloudinaryError as e:
-                flash(f"Image upload failed: {e.message}", "danger")
+                pending_cover = cover_pipeline.stage(form.cover_image.data)
+            except InvalidCover as e:
+                if wants_json():
+                    return jsonify(errors={'cover_image': [str(e)]}), 422
+                flash(f"Image upload failed: {e}", "danger")
                 return render_template("add_book.html", title="Add Book", form=form, json_form=Data())
 
         new_book = {
@@ -356,14 +721,23 @@ def add_book():
             "genre": form.genre.data,
             "rating": float(form.rating.data) if form.rating.data else 0.0,
             "description": form.description.data,
-            "cover_image": cover_image_url,
+            "cover_image": None,
             "reading_started": datetime.combine(form.reading_started.data, datetime.min.time()) if form.reading_started.data else None,
             "reading_finished": datetime.combine(form.reading_finished.data, datetime.min.time()) if form.reading_finished.data else None,
             "user_id": ObjectId(session.get('user_id')),
         }
-        books_collection.insert_one(new_book)
+        if pending_cover:
+            new_book["cover_pending"] = pending_cover.token
+        library.add(new_book)
+        if pending_cover:
+            # Resizing and uploading happen in the background; the card shows a placeholder until then.
+            cover_pipeline.submit(pending_cover, new_book["_id"])
+        if wants_json():
+            return book_change_response(new_book, 201)
         flash("Book added successfully!", "success")
         return redirect(url_for('home'))
+    if form.is_submitted() and wants_json():
+        return jsonify(errors=form.errors), 422
     
     return render_template("add_book.html", title="Add Book", form=form, json_form=Data())
 
@@ -375,7 +749,7 @@ def edit_book(book_id):
     except:
         return "Invalid Book ID", 404
 
-    book = books_collection.find_one({'_id': book_oid})
+    book = book_repo.get(book_oid)
     if not book or str(book.get('user_id')) != session.get('user_id'):
         flash("Book not found or you don't have permission to edit it.", "danger")
         return redirect(url_for('home'))
@@ -392,17 +766,26 @@ def edit_book(book_id):
             "reading_started": datetime.combine(form.reading_started.data, datetime.min.time()) if form.reading_started.data else None,
             "reading_finished": datetime.combine(form.reading_finished.data, datetime.min.time()) if form.reading_finished.data else None,
         }
+        pending_cover = None
         if form.cover_image.data:
             try:
-                upload_result = cloudinary.uploader.upload(form.cover_image.data)
-                update_data['cover_image'] = upload_result['secure_url']
-            except CloudinaryError as e:
-                flash(f"Image upload failed: {e.message}", "danger")
+                pending_cover = cover_pipeline.stage(form.cover_image.data)
+            except InvalidCover as e:
+                if wants_json():
+                    return jsonify(errors={'cover_image': [str(e)]}), 422
+                flash(f"Image upload failed: {e}", "danger")
                 return render_template("edit_book.html", title=f'Edit {book["title"]}', form=form, book=book, json_form=Data())
+            update_data['cover_pending'] = pending_cover.token
 
-        books_collection.update_one({'_id': book_oid}, {'$set': update_data})
+        updated = library.update(book, update_data)
+        if pending_cover:
+            cover_pipeline.submit(pending_cover, book_oid)
+        if wants_json():
+            return book_change_response(updated)
         flash("Book updated successfully!", "success")
         return redirect(url_for("home"))
+    if form.is_submitted() and wants_json():
+        return jsonify(errors=form.errors), 422
     
     if request.method == 'GET':
         form.title.data = book.get('title')
@@ -424,16 +807,79 @@ def delete_book(book_id):
     except:
         return "Invalid Book ID", 404
         
-    book = books_collection.find_one({'_id': book_oid})
+    book = book_repo.get(book_oid, {'user_id': 1, 'title': 1, **STATS_PROJECTION})
     if not book or str(book.get('user_id')) != session.get('user_id'):
+        if wants_json():
+            return jsonify(error="Book not found."), 404
         flash("Book not found or you don't have permission to delete it.", "danger")
     else:
-        books_collection.delete_one({'_id': book_oid})
+        library.remove(book)
+        if wants_json():
+            return jsonify(deleted=book_id, summary=summary_json(book['user_id']))
         flash(f"Book '{book['title']}' deleted successfully!", "success")
 
     return redirect(url_for('home'))
 
 
+@app.route("/events")
+def book_events():
+    # Server-Sent Events: cards changed in other tabs, patched into the open shelf.
+    if not session.get('user_id'):
+        return "Authentication required.", 401
+    if not app.config['EVENTS_ENABLED']:
+        # 204 tells EventSource to stop reconnecting.
+        return "", 204
+    user_oid = ObjectId(session['user_id'])
+    try:
+        stream = events.listen(user_oid)
+    except TooManyStreams:
+        return "Too many open live-update streams.", 503, {'Retry-After': '30'}
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            for event in stream:
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                if event['type'] == 'upsert':
+                    data = {'id': str(event['book']['_id']), 'html': render_book_card(event['book'])}
+                elif event['type'] == 'delete':
+                    data = {'id': str(event['id'])}
+                else:
+                    data = {}
+                if event['type'] != 'reset':
+                    data['summary'] = summary_json(user_oid)
+                yield f"event: {event['type']}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            stream.close()
+
+    response = app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+    # A response closed before its body was read (client gone, server never started it) still frees the slot.
+    response.call_on_close(stream.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route("/catalog/suggest")
+def catalog_suggest():
+    # Prefill data for the add-book form: one ISBN match or title/author completions.
+    if not session.get('user_id'):
+        return jsonify(error="Authentication required."), 401
+    query = request.args.get('q', '').strip()[:100]
+    if normalize_isbn(query):
+        match = catalog.lookup(query)
+        results = [match] if match else []
+    elif len(query) >= 2:
+        results = catalog.suggest(query)
+    else:
+        results = []
+    response = jsonify(results=results)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+
 @app.route('/book/<book_id>')
 def view_book(book_id):
     try:
@@ -441,40 +887,180 @@ def view_book(book_id):
     except:
         return "Invalid Book ID", 404
 
-    book = books_collection.find_one({'_id': book_oid})
+    if not session.get('user_id'):
+        flash("Book not found or you don't have permission to view it.", "danger")
+        return redirect(url_for('home'))
+
+    user_oid = ObjectId(session['user_id'])
+    stats_doc, etag, last_modified = library_validators(user_oid)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    # The detail page is the only view that loads a book's long fields, such as the description.
+    book = book_repo.get(book_oid)
     if not book or str(book.get('user_id')) != session.get('user_id'):
         flash("Book not found or you don't have permission to view it.", "danger")
         return redirect(url_for('home'))
 
-    return render_template('book_details.html', title=book['title'], book=book, json_form=Data())
+    version = stats_doc.get('version', 0)
+    with instrumentation.timer('recommend'):
+        similar_ids = recommender.similar(user_oid, book_oid, version)
+        found = {b['_id']: b for b in book_repo.find_by_ids(user_oid, similar_ids, BookSummary.projection())}
+        similar_books = [BookSummary(found[book_id]) for book_id in similar_ids if book_id in found]
+        catalog_picks = recommender.from_catalog(user_oid, book, version)
+
+    page = render_template('book_details.html', title=book['title'], book=book, json_form=Data(),
+                           similar_books=similar_books, catalog_picks=catalog_picks)
+    return with_validators(page, etag, last_modified)
 
 
 @app.route("/download")
 def download_books():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    
-    user_id = session["user_id"]
-    books = list(books_collection.find({'user_id': ObjectId(user_id)}))
 
-    if not books:
+    export_format = request.args.get('format', 'json')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'json'
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    user_oid = ObjectId(session["user_id"])
+    if not book_repo.has_books(user_oid):
         flash("You have no books to download", "info")
         return redirect(url_for('home'))
 
-    for book in books:
-        book['_id'] = str(book['_id'])
-        book['user_id'] = str(book['user_id'])
-        if book.get('reading_started'):
-            book['reading_started'] = book['reading_started'].isoformat()
-        if book.get('reading_finished'):
-            book['reading_finished'] = book['reading_finished'].isoformat()
-
-    response = make_response(json.dumps(books, indent=4))
-    response.headers["Content-Disposition"] = "attachment; filename=books_backup.json"
-    response.headers["Content-Type"] = "application/json"
+    # Stream straight from the cursor so memory stays flat however big the library is.
+    cursor = book_repo.iter_for_user(user_oid, EXPORT_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
+    chunks = encode_chunks(EXPORTERS[export_format](cursor))
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"books_backup.{extension}"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+
+    response = app.response_class(chunks, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
     return response
 
 
+def find_duplicates(user_oid, books):
+    # One indexed lookup per batch for books already on the shelf with the same ISBN or title+author.
+    isbns = {normalize_isbn(book.get('isbn')) for book in books} - {None}
+    titles = {book['title'] for book in books}
+
+    existing = set()
+    for book in book_repo.find_matches(user_oid, titles, isbns, {'title': 1, 'author': 1, 'isbn': 1}):
+        existing.update(duplicate_keys(book))
+    return existing
+
+
+def import_books(user_oid, rows, skip_duplicates=False):
+    result = {'inserted': 0, 'duplicates': 0, 'errors': [], 'error_count': 0, 'fatal': None}
+
+    def flush(batch):
+        if skip_duplicates:
+            existing = find_duplicates(user_oid, batch)
+            unique = []
+            for book in batch:
+                keys = duplicate_keys(book)
+                if existing.intersection(keys):
+                    result['duplicates'] += 1
+                else:
+                    existing.update(keys)
+                    unique.append(book)
+            batch = unique
+        if batch:
+            library.add_many(user_oid, batch)
+            result['inserted'] += len(batch)
+
+    batch = []
+    try:
+        for row in rows:
+            try:
+                if row.error:
+                    raise ValueError(row.error)
+                batch.append(parse_book_entry(row.entry, user_oid))
+            except ValueError as e:
+                result['error_count'] += 1
+                if len(result['errors']) < MAX_REPORTED_IMPORT_ERRORS:
+                    result['errors'].append(f"Row {row.number}: {e}")
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+    except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+        # Rows read before the file broke are still imported.
+        result['fatal'] = str(e)
+    if batch:
+        flush(batch)
+    return result
+
+
+def import_changes(user_oid, rows):
+    """Make the shelf match an export or change feed: upsert each book by `_id`, apply deletions.
+
+    Applying the same file twice changes nothing: identical books are left
+    alone (and keep their revision) and deleting a book that's gone is a no-op.
+    """
+    result = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'errors': [], 'error_count': 0, 'fatal': None}
+
+    def reject(number, message):
+        result['error_count'] += 1
+        if len(result['errors']) < MAX_REPORTED_IMPORT_ERRORS:
+            result['errors'].append(f"Row {number}: {message}")
+
+    def flush(batch):
+        taken = book_repo.taken_ids(user_oid, batch)
+        existing = {book['_id']: book for book in book_repo.find_by_ids(user_oid, batch)}
+        creates, updates, deletes = [], [], []
+        for book_id, (number, book) in batch.items():
+            current = existing.get(book_id)
+            if book is None:
+                if current:
+                    deletes.append(book_id)
+                else:
+                    result['unchanged'] += 1
+            elif book_id in taken:
+                reject(number, f"Book {book_id} belongs to another library")
+            elif current is None:
+                creates.append({**book, '_id': book_id})
+            else:
+                fields = {field: value for field, value in book.items() if field != 'user_id'}
+                if all(current.get(field) == value for field, value in fields.items()):
+                    result['unchanged'] += 1
+                else:
+                    updates.append((book_id, fields))
+        if creates or updates or deletes:
+            outcome = library.bulk(user_oid, creates, updates, deletes)
+            result['inserted'] += len(outcome['created'])
+            result['updated'] += len(outcome['updated'])
+            result['deleted'] += len(outcome['deleted'])
+
+    # book _id -> (row number, book or None for a deletion)
+    batch = {}
+    try:
+        for row in rows:
+            try:
+                if row.error:
+                    raise ValueError(row.error)
+                book_id, book = parse_change_entry(row.entry, user_oid)
+            except ValueError as e:
+                reject(row.number, e)
+                continue
+            if book_id in batch or len(batch) >= IMPORT_BATCH_SIZE:
+                # A later entry for the same book must be applied after the earlier one.
+                flush(batch)
+                batch = {}
+            batch[book_id] = (row.number, book)
+    except (ImportFormatError, csv.Error, UnicodeDecodeError) as e:
+        result['fatal'] = str(e)
+    if batch:
+        flush(batch)
+    return result
+
+
 @app.route("/upload", methods=["POST"])
 def upload_books():
     if 'user_id' not in session:
@@ -483,43 +1069,99 @@ def upload_books():
     form = Data()
     if form.validate_on_submit():
         file = form.json_file.data
-        try:
-            data = json.load(file.stream)
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            flash("Invalid JSON format. The file could not be read.", "danger")
+        extension = file.filename.rsplit('.', 1)[-1].lower()
+        reader = READERS.get(extension, read_json_array)
+        text = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+
+        if form.apply_changes.data:
+            result = import_changes(ObjectId(session["user_id"]), reader(text))
+            if result['fatal']:
+                flash(f"The file could not be fully read: {result['fatal']}", "danger")
+            flash(f"Synced: {result['inserted']} added, {result['updated']} updated, {result['deleted']} deleted, "
+                  f"{result['unchanged']} already up to date.", "success")
+            if result['error_count']:
+                flash(f"{result['error_count']} entr{'y' if result['error_count'] == 1 else 'ies'} could not be applied. "
+                      + "; ".join(result['errors']), "warning")
             return redirect(url_for("home"))
 
-        user_id = ObjectId(session["user_id"])
-        books_to_add = []
-        for entry in data:
-            if not entry.get("title"):
-                continue
+        result = import_books(ObjectId(session["user_id"]), reader(text), form.skip_duplicates.data)
 
-            books_to_add.append({
-                "title": entry.get("title"),
-                "author": entry.get("author"),
-                "isbn": entry.get("isbn"),
-                "genre": entry.get("genre"),
-                "rating": float(entry.get("rating", 0.0) or 0.0),
-                "description": entry.get("description"),
-                "cover_image": entry.get("cover_image"),
-                "reading_started": datetime.fromisoformat(entry["reading_started"]) if entry.get("reading_started") else None,
-                "reading_finished": datetime.fromisoformat(entry["reading_finished"]) if entry.get("reading_finished") else None,
-                "user_id": user_id
-            })
-        
-        if books_to_add:
-            books_collection.insert_many(books_to_add)
-            flash(f"{len(books_to_add)} book(s) uploaded successfully!", "success")
-        else:
+        if result['fatal']:
+            flash(f"The file could not be fully read: {result['fatal']}", "danger")
+        if result['inserted']:
+            flash(f"{result['inserted']} book(s) uploaded successfully!", "success")
+        elif not (result['error_count'] or result['duplicates'] or result['fatal']):
             flash("No valid book entries found in the file.", "warning")
+        if result['duplicates']:
+            flash(f"{result['duplicates']} book(s) were already in your library and were skipped.", "info")
+        if result['error_count']:
+            details = "; ".join(result['errors'])
+            more = result['error_count'] - len(result['errors'])
+            if more:
+                details += f" (and {more} more)"
+            flash(f"{result['error_count']} entr{'y' if result['error_count'] == 1 else 'ies'} could not be imported. {details}", "warning")
 
         return redirect(url_for("home"))
-    
-    flash("File upload failed. Please try again with a valid JSON file.", "danger")
+
+    flash("File upload failed. Please try again with a JSON, NDJSON or CSV file.", "danger")
     return redirect(url_for("home"))
 
 
+@app.route("/stats")
+def reading_stats():
+    if not session.get('user_id'):
+        flash("Please log in to view your reading stats.", "warning")
+        return redirect(url_for('login'))
+
+    stats = library_stats.summary(ObjectId(session['user_id']))
+    return render_template('stats.html', title='Reading Stats', stats=stats, json_form=Data())
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Create the MongoDB indexes. Safe to rerun; run it on every deploy."""
+    storage.ping()
+    create_indexes()
+    keyed = book_repo.backfill_isbn_keys()
+    click.echo(f"Indexes are up to date. Added ISBN keys to {keyed} existing books." if keyed else "Indexes are up to date.")
+
+
+@app.cli.command('import-catalog')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def import_catalog(paths):
+    """Build the book metadata catalog from Open Library author/edition dumps."""
+    meta = build_catalog(paths, app.config['CATALOG_DIR'])
+    click.echo(f"Indexed {meta['records']} editions ({meta['isbns']} ISBNs) into {app.config['CATALOG_DIR']}.")
+
+
+@app.cli.command('rebuild-stats')
+@click.option('--userid', help="Only rebuild the stats of this User ID.")
+def rebuild_stats(userid):
+    """Recompute reading stats from the books collection."""
+    user_ids = user_repo.ids(userid)
+    for user_id in user_ids:
+        library_stats.rebuild(user_id)
+    click.echo(f"Rebuilt stats for {len(user_ids)} user(s).")
+
+
+@app.cli.command('mail-sink')
+@click.option('--port', default=1025, show_default=True, help="Port to listen on.")
+def mail_sink(port):
+    """Run a local SMTP server that prints outgoing mail instead of delivering it."""
+    from mailsink import MailSink
+
+    def show(message):
+        click.echo(f"To {', '.join(message['recipients'])}: {message['message']['Subject']}")
+
+    with MailSink(port=port, on_message=show):
+        click.echo(f"Listening on 127.0.0.1:{port}; run the app with MAIL_SERVER=127.0.0.1 MAIL_PORT={port} "
+                   "MAIL_USE_TLS=false. Ctrl+C to stop.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
 @app.route("/about")
 def about():
     return render_template('about.html', title='About', json_form=Data())
@@ -0,0 +1,143 @@
+"""Compare gunicorn worker classes under concurrent load.
+
+Starts one gunicorn worker per mode serving benchmarks.serve:app (seeded
+in-memory data, BENCH_DB_LATENCY_MS of simulated latency per database call),
+then keeps --clients concurrent HTTP clients busy on home and view_book and
+reports throughput and latency percentiles for each mode.
+
+    python -m benchmarks.concurrency --modes sync,gthread --clients 64 --duration 15
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks.run import percentile
+from benchmarks.seed import PASSWORD
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(mode, args):
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f"127.0.0.1:{args.port}",
+        GUNICORN_WORKERS='1',
+        GUNICORN_WORKER_CLASS=mode,
+        GUNICORN_THREADS=str(args.threads),
+        MONGO_MAX_POOL_SIZE=str(args.threads),
+        BENCH_DB_LATENCY_MS=str(args.latency),
+        BENCH_USERS=str(args.users),
+        BENCH_BOOKS=str(args.books),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning', 'benchmarks.serve:app'],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/about", timeout=1)
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"gunicorn ({mode}) did not start.")
+
+
+def login(base, n):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'email': f"reader{n}@example.com", 'password': PASSWORD}).encode()
+    opener.open(f"{base}/login", data)
+    books = json.load(opener.open(f"{base}/api/v1/books?fields=_id&limit=500"))['books']
+    return jar, [book['_id'] for book in books]
+
+
+def run_mode(mode, args):
+    server = start_server(mode, args)
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        sessions = [login(base, n) for n in range(args.users)]
+        samples, errors = [], 0
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.duration
+
+        def client(index):
+            nonlocal errors
+            rng = random.Random(index)
+            jar, book_ids = sessions[index % len(sessions)]
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+            while time.perf_counter() < deadline:
+                path = '/' if rng.random() < 0.6 else f"/book/{rng.choice(book_ids)}"
+                t0 = time.perf_counter()
+                try:
+                    opener.open(base + path, timeout=30).read()
+                    failed = False
+                except (urllib.error.URLError, ConnectionError, TimeoutError):
+                    failed = True
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    if failed:
+                        errors += 1
+                    else:
+                        samples.append(elapsed * 1000)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'mode': mode,
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': len(samples) / wall,
+        'p50_ms': percentile(samples, 50),
+        'p95_ms': percentile(samples, 95),
+        'p99_ms': percentile(samples, 99),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modes', default='sync,gthread', help="Comma-separated gunicorn worker classes.")
+    parser.add_argument('--clients', type=int, default=64, help="Concurrent HTTP clients.")
+    parser.add_argument('--threads', type=int, default=32, help="Threads per worker for gthread.")
+    parser.add_argument('--duration', type=float, default=15, help="Seconds of load per mode.")
+    parser.add_argument('--latency', type=float, default=5, help="Simulated milliseconds per database call.")
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--books', type=int, default=200, help="Books per seeded user.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', metavar='PATH', help="Also write the results as JSON.")
+    args = parser.parse_args(argv)
+
+    results = [run_mode(mode, args) for mode in args.modes.split(',')]
+
+    print(f"\n{args.clients} clients, {args.latency:g} ms per database call, 1 worker")
+    print(f"{'mode':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['requests']:>10}{result['errors']:>8}{result['throughput_rps']:>10.1f}"
+              f"{result['p50_ms'] or 0:>10.1f}{result['p95_ms'] or 0:>10.1f}{result['p99_ms'] or 0:>10.1f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
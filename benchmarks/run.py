@@ -0,0 +1,322 @@
+"""Latency benchmark for the main routes.
+
+Runs the Flask app in-process against the in-memory storage backend, seeds
+synthetic users and libraries, replays a weighted traffic mix and reports
+p50/p95/p99 latency, throughput, database round trips per request and peak RSS.
+
+    python -m benchmarks.run --books 10,1000,100000 --requests 1000
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+Requires mongomock (pip install -r benchmarks/requirements.txt).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('MAIL_SUPPRESS_SEND', 'true')
+os.environ.setdefault('COVER_STORE', 'local')
+# The login scenario signs the same accounts in over and over.
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+
+import mongomock.collection
+
+import app as appmod
+from benchmarks.seed import PASSWORD, seed, synthetic_book
+
+DEFAULT_MIX = {
+    'home': 40,
+    'view_book': 25,
+    'add_book': 8,
+    'edit_book': 8,
+    'download_books': 4,
+    'upload_books': 3,
+    'login': 12,
+}
+UPLOAD_SIZE = 20
+SORTS = list(appmod.SORT_MODES)
+
+
+# --- Round-trip counting ---
+
+_calls = threading.local()
+# One database command each (getMore batches on large cursors are not counted).
+COUNTED_METHODS = (
+    'find', 'find_one', 'find_one_and_update', 'find_one_and_delete', 'insert_one', 'insert_many',
+    'update_one', 'update_many', 'delete_one', 'delete_many', 'aggregate', 'count_documents', 'bulk_write',
+)
+
+
+def _counting(method):
+    def wrapper(*args, **kwargs):
+        # mongomock implements some of these on top of the others (find_one_and_update calls
+        # find, update_one, ...); only the outermost call is a command the app sent.
+        depth = getattr(_calls, 'depth', 0)
+        if not depth:
+            _calls.count = getattr(_calls, 'count', 0) + 1
+        _calls.depth = depth + 1
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _calls.depth = depth
+    return wrapper
+
+
+def install_counters():
+    for name in COUNTED_METHODS:
+        method = getattr(mongomock.collection.Collection, name, None)
+        if method is not None:
+            setattr(mongomock.collection.Collection, name, _counting(method))
+
+
+# --- Scenarios ---
+
+def book_form(rng):
+    book = synthetic_book(rng)
+    return {
+        'title': book['title'],
+        'author': book['author'],
+        'isbn': book['isbn'] or '',
+        'genre': book['genre'],
+        'rating': str(book['rating']),
+        'description': book['description'],
+        'reading_started': book['reading_started'].strftime('%Y-%m-%d'),
+    }
+
+
+def upload_payload(rng):
+    books = []
+    for _ in range(UPLOAD_SIZE):
+        book = synthetic_book(rng)
+        for field in ('reading_started', 'reading_finished'):
+            book[field] = book[field].isoformat() if book[field] else None
+        books.append(book)
+    return json.dumps(books).encode()
+
+
+def home(client, account, rng):
+    return client.get(f"/?sort={rng.choice(SORTS)}")
+
+
+def view_book(client, account, rng):
+    return client.get(f"/book/{rng.choice(account['book_ids'])}")
+
+
+def add_book(client, account, rng):
+    return client.post('/add_book', data=book_form(rng))
+
+
+def edit_book(client, account, rng):
+    return client.post(f"/edit/{rng.choice(account['book_ids'])}", data=book_form(rng))
+
+
+def download_books(client, account, rng):
+    response = client.get(f"/download?format={rng.choice(['json', 'ndjson', 'csv'])}")
+    response.get_data()
+    return response
+
+
+def upload_books(client, account, rng):
+    data = {'json_file': (io.BytesIO(upload_payload(rng)), 'books.json')}
+    return client.post('/upload', data=data, content_type='multipart/form-data')
+
+
+def login(client, account, rng):
+    # A fresh client, so the measured request is a real login rather than an already-authenticated one.
+    return appmod.app.test_client().post('/login', data={'email': account['email'], 'password': PASSWORD})
+
+
+SCENARIOS = {
+    'home': home,
+    'view_book': view_book,
+    'add_book': add_book,
+    'edit_book': edit_book,
+    'download_books': download_books,
+    'upload_books': upload_books,
+    'login': login,
+}
+
+
+# --- Driver ---
+
+def reset_app():
+    appmod.storage.client.drop_database(appmod.storage.database)
+    appmod.user_cache.clear()
+    appmod.card_cache.clear()
+    appmod._indexes_ready = False
+
+
+def logged_in_client(account):
+    client = appmod.app.test_client()
+    client.post('/login', data={'email': account['email'], 'password': PASSWORD})
+    with client.session_transaction() as session:
+        if 'user_id' not in session:
+            raise RuntimeError(f"Could not log in as {account['email']}.")
+    return client
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown route {name!r}; choose from {', '.join(SCENARIOS)}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def run_size(books, args):
+    reset_app()
+    started = time.perf_counter()
+    accounts = seed(appmod.storage, appmod.library_stats, args.users, books, rng_seed=args.seed)
+    seed_seconds = time.perf_counter() - started
+
+    names, weights = zip(*args.mix.items())
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    per_worker = [args.requests // args.concurrency + (i < args.requests % args.concurrency) for i in range(args.concurrency)]
+
+    # Test clients keep a cookie jar, so each worker logs in its own.
+    clients = [[logged_in_client(account) for account in accounts] for _ in range(args.concurrency)]
+
+    def worker(index, count):
+        rng = random.Random(args.seed * 1000 + index)
+        for n in range(args.warmup + count):
+            name = rng.choices(names, weights)[0]
+            user = rng.randrange(len(accounts))
+            _calls.count = 0
+            t0 = time.perf_counter()
+            response = SCENARIOS[name](clients[index][user], accounts[user], rng)
+            t1 = time.perf_counter()
+            if n < args.warmup:
+                continue
+            with lock:
+                samples[name].append((t1 - t0, _calls.count, response.status_code >= 400, t0, t1))
+
+    threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(per_worker)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    routes = {}
+    for name, rows in sorted(samples.items()):
+        latencies = [row[0] * 1000 for row in rows]
+        routes[name] = {
+            'requests': len(rows),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'round_trips': sum(row[1] for row in rows) / len(rows),
+            'errors': sum(row[2] for row in rows),
+        }
+    rows = [row for route_rows in samples.values() for row in route_rows]
+    # Measured from the first to the last measured request, so logins and warmup don't count.
+    wall = max(row[4] for row in rows) - min(row[3] for row in rows) if rows else 0
+    return {
+        'books_per_user': books,
+        'users': args.users,
+        'seed_seconds': seed_seconds,
+        'throughput_rps': len(rows) / wall if wall else None,
+        # ru_maxrss is in KiB on Linux and bytes on macOS; it never goes down within a process.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 * 1024),
+        'routes': routes,
+    }
+
+
+def print_report(result):
+    print(f"\n== {result['users']} user(s) x {result['books_per_user']} books "
+          f"(seeded in {result['seed_seconds']:.1f}s)")
+    print(f"{'route':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'trips':>8}{'errors':>8}")
+    for name, route in result['routes'].items():
+        print(f"{name:<16}{route['requests']:>6}{route['p50_ms']:>10.2f}{route['p95_ms']:>10.2f}"
+              f"{route['p99_ms']:>10.2f}{route['mean_ms']:>10.2f}{route['round_trips']:>8.1f}{route['errors']:>8}")
+    print(f"throughput: {result['throughput_rps']:.1f} req/s   peak RSS: {result['peak_rss_mb']:.0f} MB")
+
+
+def compare(results, baseline, tolerance):
+    # A route regresses when its p95 grows beyond the tolerance or it makes more round trips than before.
+    regressions = []
+    for result in results:
+        base_run = baseline['runs'].get(str(result['books_per_user']))
+        if not base_run:
+            continue
+        for name, route in result['routes'].items():
+            base = base_run['routes'].get(name)
+            if not base:
+                continue
+            if route['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{result['books_per_user']} books / {name}: p95 {base['p95_ms']:.2f} -> {route['p95_ms']:.2f} ms")
+            if route['round_trips'] > base['round_trips'] + 0.5:
+                regressions.append(f"{result['books_per_user']} books / {name}: round trips {base['round_trips']:.1f} -> {route['round_trips']:.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--books', default='10,1000', help="Comma-separated library sizes to run, e.g. 10,1000,100000.")
+    parser.add_argument('--users', type=int, default=3, help="Seeded users per run.")
+    parser.add_argument('--requests', type=int, default=500, help="Measured requests per library size.")
+    parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests per worker before measuring.")
+    parser.add_argument('--concurrency', type=int, default=1, help="Worker threads issuing requests.")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="Weights, e.g. home=5,view_book=3,login=1.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the results as a JSON baseline.")
+    parser.add_argument('--compare', metavar='PATH', help="Compare against a baseline; exit 1 on regressions.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative p95 growth when comparing.")
+    args = parser.parse_args(argv)
+
+    appmod.app.config['WTF_CSRF_ENABLED'] = False
+    appmod.app.config['MAIL_SUPPRESS_SEND'] = True
+    install_counters()
+
+    results = []
+    for books in (int(size) for size in args.books.split(',')):
+        result = run_size(books, args)
+        print_report(result)
+        results.append(result)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: getattr(args, key) for key in ('users', 'requests', 'warmup', 'concurrency', 'mix', 'seed')},
+        'runs': {str(result['books_per_user']): result for result in results},
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import random
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'benchmark-password'
+GENRES = ['Fantasy', 'Science Fiction', 'Mystery', 'Romance', 'History', 'Biography', 'Horror', 'Poetry', 'Self-Help', 'Classics']
+WORDS = [
+    'night', 'river', 'empire', 'garden', 'shadow', 'winter', 'silver', 'house', 'letters', 'storm',
+    'kingdom', 'glass', 'memory', 'ocean', 'fire', 'stranger', 'city', 'mountain', 'secret', 'light',
+]
+NAMES = ['Ada', 'Ben', 'Chloe', 'Dev', 'Elena', 'Farid', 'Grace', 'Hiro', 'Iris', 'Jonas', 'Kofi', 'Lena']
+INSERT_BATCH_SIZE = 1000
+
+
+def synthetic_book(rng, user_id=None):
+    started = datetime(2015, 1, 1) + timedelta(days=rng.randrange(3650))
+    finished = started + timedelta(days=rng.randrange(1, 120)) if rng.random() < 0.8 else None
+    book = {
+        'title': ' '.join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4))),
+        'author': f"{rng.choice(NAMES)} {rng.choice(WORDS).title()}",
+        'isbn': ''.join(str(rng.randrange(10)) for _ in range(13)) if rng.random() < 0.7 else None,
+        'genre': rng.choice(GENRES),
+        'rating': float(rng.randint(0, 10)) / 2,
+        'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 60))),
+        'cover_image': None,
+        'reading_started': started,
+        'reading_finished': finished,
+    }
+    if user_id is not None:
+        book['user_id'] = user_id
+        book['updated_at'] = datetime.utcnow()
+    return book
+
+
+def seed(storage, library_stats, users, books_per_user, rng_seed=0):
+    """Create `users` verified accounts with `books_per_user` books each.
+
+    Returns one dict per user with the login email and the ids of their books.
+    """
+    rng = random.Random(rng_seed)
+    # Every account shares one password, so it is only hashed once.
+    password = generate_password_hash(PASSWORD)
+    accounts = []
+    for n in range(users):
+        user_id = storage.users.insert({
+            '_id': ObjectId(),
+            'name': f"Reader {n}",
+            'userid': f"reader{n}",
+            'email': f"reader{n}@example.com",
+            'password': password,
+            'theme': 'light',
+            'is_verified': True,
+        })
+        book_ids = []
+        for start in range(0, books_per_user, INSERT_BATCH_SIZE):
+            batch = [synthetic_book(rng, user_id) for _ in range(min(INSERT_BATCH_SIZE, books_per_user - start))]
+            storage.books.insert_many(batch)
+            book_ids.extend(book['_id'] for book in batch)
+        library_stats.rebuild(user_id)
+        accounts.append({'user_id': user_id, 'email': f"reader{n}@example.com", 'book_ids': book_ids})
+    return accounts
@@ -0,0 +1,42 @@
+"""The app with seeded in-memory data and simulated database latency, for serving under gunicorn.
+
+    BENCH_DB_LATENCY_MS=5 gunicorn -c gunicorn.conf.py benchmarks.serve:app
+"""
+import os
+import time
+
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('MAIL_SUPPRESS_SEND', 'true')
+os.environ.setdefault('COVER_STORE', 'local')
+# The login scenario signs the same accounts in over and over.
+os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+# Under deliberate overload nearly every request is "slow"; keep the log readable.
+os.environ.setdefault('SLOW_REQUEST_MS', '60000')
+
+import mongomock.collection
+
+import app as appmod
+from benchmarks.run import COUNTED_METHODS
+from benchmarks.seed import seed
+
+LATENCY = float(os.environ.get('BENCH_DB_LATENCY_MS', 5)) / 1000
+
+
+def _delayed(method):
+    # time.sleep releases the GIL like a socket read does, so this behaves like a network round trip.
+    def wrapper(*args, **kwargs):
+        time.sleep(LATENCY)
+        return method(*args, **kwargs)
+    return wrapper
+
+
+appmod.app.config['WTF_CSRF_ENABLED'] = False
+seed(appmod.storage, appmod.library_stats, int(os.environ.get('BENCH_USERS', 3)), int(os.environ.get('BENCH_BOOKS', 200)))
+if LATENCY:
+    for name in COUNTED_METHODS:
+        method = getattr(mongomock.collection.Collection, name, None)
+        if method is not None:
+            setattr(mongomock.collection.Collection, name, _delayed(method))
+
+app = appmod.app
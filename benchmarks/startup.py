@@ -0,0 +1,113 @@
+"""Measure how long a fresh process takes to import the app and serve its first request.
+
+Each run is a new interpreter pointed at an unreachable MongoDB, so anything
+that waits on the network during boot shows up as a blown budget rather
+than passing quietly.
+
+    python -m benchmarks.startup --runs 5 --budget-ms 800
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, time
+t0 = time.perf_counter()
+import app as appmod
+t1 = time.perf_counter()
+application = appmod.create_app()
+t2 = time.perf_counter()
+response = application.test_client().get('/about')
+t3 = time.perf_counter()
+print(json.dumps({'status': response.status_code, 'import_ms': (t1 - t0) * 1000,
+                  'create_app_ms': (t2 - t1) * 1000, 'first_request_ms': (t3 - t2) * 1000}))
+'''
+
+# TEST-NET-3: guaranteed not to answer, so a blocking connect would hang until its timeout.
+UNREACHABLE_MONGO = 'mongodb://203.0.113.1:27017/?serverSelectionTimeoutMS=5000'
+
+
+def child_env():
+    return dict(
+        os.environ,
+        STORAGE_BACKEND='mongo',
+        MONGO_URI=UNREACHABLE_MONGO,
+        SECRET_KEY='startup-benchmark',
+        MAIL_SUPPRESS_SEND='true',
+        CLOUDINARY_CLOUD_NAME='startup-benchmark',
+    )
+
+
+def run_once():
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(limit):
+    # -X importtime reports cumulative microseconds per module on stderr.
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if not match:
+            continue
+        depth, module = len(match.group(2)), match.group(3)
+        if depth == 0:
+            # Children are listed before their parent; keep only those that belong to `app`.
+            if module == 'app':
+                break
+            rows = []
+        elif depth == 2:
+            rows.append((int(match.group(1)) / 1000, module))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes to time.")
+    parser.add_argument('--budget-ms', type=float, default=800, help="Allowed median import + first request time.")
+    parser.add_argument('--top', type=int, default=10, help="Slowest direct imports to list (0 to skip).")
+    parser.add_argument('--output', metavar='PATH', help="Also write the results as JSON.")
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+    if any(run['status'] != 200 for run in runs):
+        print("First request failed:", [run['status'] for run in runs])
+        return 1
+
+    totals = [run['import_ms'] + run['create_app_ms'] + run['first_request_ms'] for run in runs]
+    summary = {key: statistics.median(run[key] for run in runs) for key in ('import_ms', 'create_app_ms', 'first_request_ms')}
+    summary['total_ms'] = statistics.median(totals)
+    summary['max_total_ms'] = max(totals)
+
+    print(f"{args.runs} cold starts (median)")
+    print(f"  import app      {summary['import_ms']:8.1f} ms")
+    print(f"  create_app()    {summary['create_app_ms']:8.1f} ms")
+    print(f"  first request   {summary['first_request_ms']:8.1f} ms")
+    print(f"  total           {summary['total_ms']:8.1f} ms (max {summary['max_total_ms']:.1f}, budget {args.budget_ms:g})")
+
+    if args.top:
+        print("\nSlowest direct imports (cumulative):")
+        for ms, module in slowest_imports(args.top):
+            print(f"  {ms:8.1f} ms  {module}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'summary': summary, 'runs': runs}, f, indent=2)
+
+    if summary['total_ms'] > args.budget_ms:
+        print(f"\nOver budget by {summary['total_ms'] - args.budget_ms:.1f} ms.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,353 @@
+import csv
+import io
+import json
+import re
+import textwrap
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+
+# Fields written to every export, in column order for CSV.
+EXPORT_FIELDS = [
+    '_id', 'title', 'author', 'isbn', 'genre', 'rating', 'description',
+    'cover_image', 'reading_started', 'reading_finished', 'user_id',
+]
+EXPORT_PROJECTION = {field: 1 for field in EXPORT_FIELDS}
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# Accepted upload formats, by file extension.
+IMPORT_FORMATS = ('json', 'ndjson', 'csv')
+
+CHUNK_SIZE = 64 * 1024
+# A single book entry larger than this is treated as a broken file rather than buffered.
+MAX_ENTRY_SIZE = 1024 * 1024
+
+
+def export_record(book):
+    record = {}
+    for field in EXPORT_FIELDS:
+        value = book.get(field)
+        if isinstance(value, ObjectId):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        record[field] = value
+    return record
+
+
+def book_to_json(book):
+    # Any subset of a book's fields, with ids and dates as strings.
+    record = {}
+    for field, value in book.items():
+        if isinstance(value, ObjectId):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        record[field] = value
+    return record
+
+
+def iter_json(books):
+    # Same layout as json.dumps(books, indent=4), one book at a time.
+    first = True
+    yield '['
+    for book in books:
+        body = textwrap.indent(json.dumps(export_record(book), indent=4), '    ')
+        yield ('\n' if first else ',\n') + body
+        first = False
+    yield ']' if first else '\n]'
+
+
+def iter_ndjson(books):
+    for book in books:
+        yield json.dumps(export_record(book)) + '\n'
+
+
+def iter_csv(books):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for book in books:
+        writer.writerow(export_record(book))
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+EXPORTERS = {
+    'json': iter_json,
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
+
+
+def encode_chunks(chunks, size=CHUNK_SIZE):
+    # Coalesce the many small per-book strings into reasonably sized byte chunks.
+    pending, pending_size = [], 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= size:
+            yield b''.join(pending)
+            pending, pending_size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# --- Import ---
+
+class ImportFormatError(ValueError):
+    """The upload is malformed in a way that stops the rest of it being read."""
+
+
+# One entry read from an upload; `error` is set instead of `entry` for rows that could not be decoded.
+ImportRow = namedtuple('ImportRow', ['number', 'entry', 'error'])
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+def read_json_array(text, chunk_size=CHUNK_SIZE, max_entry_size=MAX_ENTRY_SIZE):
+    # Incremental parser for a top-level JSON array: only the entry currently
+    # being decoded (plus one read chunk) is ever held in memory. A response
+    # from /api/v1/changes is read too: its entries are the `changes` array.
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    state = 'start'
+    number = 0
+    envelope, key, found = False, None, False
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ImportFormatError("Unexpected end of file.")
+            more = text.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + more, 0, not more
+            continue
+
+        char = buffer[pos]
+        if state == 'start':
+            if char == '{' and not envelope:
+                envelope = True
+                pos += 1
+                state = 'key'
+                continue
+            if char != '[':
+                raise ImportFormatError("Expected a JSON array of books.")
+            pos += 1
+            state = 'first'
+        elif state == 'separator' or (state == 'first' and char == ']'):
+            if char == ']':
+                if not envelope:
+                    return
+                pos += 1
+                state = 'object_separator'
+                continue
+            if char != ',':
+                raise ImportFormatError(f"Expected ',' or ']' after entry {number}.")
+            pos += 1
+            state = 'value'
+        elif state == 'colon':
+            if char != ':':
+                raise ImportFormatError(f"Expected ':' after {key!r}.")
+            pos += 1
+            if key == 'changes':
+                found, state = True, 'start'
+            else:
+                state = 'skip'
+        elif state == 'object_separator':
+            if char == '}':
+                if not found:
+                    raise ImportFormatError("Expected a JSON array of books.")
+                return
+            if char != ',':
+                raise ImportFormatError("Expected ',' or '}' in the change feed.")
+            pos += 1
+            state = 'key'
+        else:
+            if state == 'key' and char == '}':
+                raise ImportFormatError("Expected a JSON array of books.")
+            try:
+                entry, end = decoder.raw_decode(buffer, pos)
+                complete = eof or end < len(buffer)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ImportFormatError(f"Invalid JSON in entry {number + 1}: {e.msg}.")
+                complete = False
+            if not complete:
+                # The entry may continue in the next chunk (a value ending exactly at the
+                # end of the buffer could still be a truncated number or string).
+                if len(buffer) - pos > max_entry_size:
+                    raise ImportFormatError(f"Entry {number + 1} is too large.")
+                more = text.read(chunk_size)
+                buffer, pos, eof = buffer[pos:] + more, 0, not more
+                continue
+            pos = end
+            if state == 'key':
+                if not isinstance(entry, str):
+                    raise ImportFormatError("Expected a JSON array of books.")
+                key, state = entry, 'colon'
+            elif state == 'skip':
+                # `next`, `more` and anything else in the envelope.
+                state = 'object_separator'
+            else:
+                number += 1
+                yield ImportRow(number, entry, None)
+                state = 'separator'
+
+
+def read_ndjson(text):
+    for number, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield ImportRow(number, json.loads(line), None)
+        except json.JSONDecodeError as e:
+            yield ImportRow(number, None, f"Invalid JSON: {e.msg}")
+
+
+def read_csv(text):
+    reader = csv.DictReader(text)
+    for number, row in enumerate(reader, start=1):
+        yield ImportRow(number, {key: (value or None) for key, value in row.items() if key}, None)
+
+
+READERS = {
+    'json': read_json_array,
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def _optional_text(entry, field):
+    value = entry.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, (str, int, float)):
+        raise ValueError(f"Invalid {field}")
+    return str(value)
+
+
+def _parse_date(entry, field):
+    value = entry.get(field)
+    if not value:
+        return None
+    try:
+        value = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field.replace('_', ' ')} date {value!r}")
+    # Stored dates are naive UTC, like the form's; an offset would make them incomparable in stats.
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _parse_title(entry, field):
+    title = entry.get(field)
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("Missing title")
+    return title
+
+
+def _parse_rating(entry, field):
+    rating = entry.get(field) or 0.0
+    try:
+        rating = float(rating)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid rating {rating!r}")
+    if not 0 <= rating <= 5:
+        raise ValueError(f"Rating {rating} is outside 0-5")
+    return rating
+
+
+# Every field a user can set on a book, with its parser.
+FIELD_PARSERS = {
+    "title": _parse_title,
+    "author": _optional_text,
+    "isbn": _optional_text,
+    "genre": _optional_text,
+    "rating": _parse_rating,
+    "description": _optional_text,
+    "cover_image": _optional_text,
+    "reading_started": _parse_date,
+    "reading_finished": _parse_date,
+}
+
+
+def parse_book_entry(entry, user_id):
+    if not isinstance(entry, dict):
+        raise ValueError("Entry is not an object")
+
+    book = {field: parse(entry, field) for field, parse in FIELD_PARSERS.items()}
+    book["user_id"] = user_id
+    return book
+
+
+def parse_change_entry(entry, user_id):
+    """One entry of a change feed or export -> (book_id, book), with book None for a deletion."""
+    if not isinstance(entry, dict):
+        raise ValueError("Entry is not an object")
+    book_id = entry.get('_id')
+    # ObjectId(None) would mint a fresh id, turning every re-apply of the row into another copy.
+    if not isinstance(book_id, (str, ObjectId)):
+        raise ValueError(f"Missing or invalid _id {book_id!r}")
+    try:
+        book_id = ObjectId(book_id)
+    except InvalidId:
+        raise ValueError(f"Missing or invalid _id {book_id!r}")
+    if str(entry.get('deleted')).lower() in ('true', '1'):
+        return book_id, None
+    return book_id, parse_book_entry(entry, user_id)
+
+
+def parse_book_update(entry):
+    # A partial update: only the fields present are validated and returned.
+    if not isinstance(entry, dict):
+        raise ValueError("Entry is not an object")
+    unknown = sorted(set(entry) - set(FIELD_PARSERS))
+    if unknown:
+        raise ValueError(f"Unknown field {unknown[0]!r}")
+    return {field: FIELD_PARSERS[field](entry, field) for field in entry}
+
+
+def normalize_isbn(value):
+    """ISBN-10 or ISBN-13 in any punctuation -> the 13-digit form, or None."""
+    digits = re.sub(r'[^0-9X]', '', (value or '').upper())
+    if len(digits) == 13 and digits.isdigit():
+        return digits
+    if len(digits) == 10 and digits[:9].isdigit():
+        core = '978' + digits[:9]
+        check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(core)) % 10) % 10
+        return core + str(check)
+    return None
+
+
+def duplicate_keys(book):
+    keys = [('title', book['title'].strip().lower(), (book.get('author') or '').strip().lower())]
+    isbn = normalize_isbn(book.get('isbn'))
+    if isbn:
+        keys.append(('isbn', isbn))
+    return keys
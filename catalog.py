@@ -0,0 +1,358 @@
+import gzip
+import heapq
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+import threading
+import unicodedata
+from bisect import insort
+from datetime import datetime
+
+from book_io import normalize_isbn
+
+# Fixed-width, sorted index entries: a key and the offset of its record in records.bin.
+ISBN_ENTRY = struct.Struct('<13sQ')
+TOKEN_ENTRY = struct.Struct('<16sQ')
+RECORD_HEADER = struct.Struct('<I')
+TOKEN_WIDTH = 16
+# Index entries are sorted in runs of this many, spilled to disk and merged, so a build's memory stays flat.
+SORT_RUN_SIZE = 1_000_000
+
+FILES = ('records.bin', 'isbn.idx', 'prefix.idx')
+MAX_DESCRIPTION = 2000
+# Words too common to narrow a search; they're neither indexed nor required to match.
+STOPWORDS = frozenset({'a', 'an', 'and', 'de', 'for', 'in', 'la', 'le', 'of', 'on', 'the', 'to'})
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower()
+    return [word for word in re.findall(r'[a-z0-9]+', text) if word not in STOPWORDS]
+
+
+# --- Building ---
+
+def read_dump(path):
+    """Yield the lines of an Open Library dump (tab-separated, JSON last) or a JSON-lines file, gzipped or not."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                yield line
+
+
+def _document(line, wanted):
+    # Cheap type check before paying for json.loads on every line of a multi-gigabyte dump.
+    if wanted not in line:
+        return None
+    try:
+        doc = json.loads(line.rsplit('\t', 1)[-1])
+    except ValueError:
+        return None
+    return doc if doc.get('type', {}).get('key') == wanted else None
+
+
+def _edition_record(doc, authors):
+    isbns = {normalize_isbn(value) for value in doc.get('isbn_13', []) + doc.get('isbn_10', [])} - {None}
+    title = (doc.get('title') or '').strip()
+    if not isbns or not title:
+        return None, ()
+    if doc.get('subtitle'):
+        title = f"{title}: {doc['subtitle'].strip()}"
+    names = [name for name in (authors.get(ref.get('key')) for ref in doc.get('authors', [])) if name]
+    author = ', '.join(names) or (doc.get('by_statement') or '').strip().rstrip('.')
+    description = doc.get('description') or ''
+    if isinstance(description, dict):
+        description = description.get('value', '')
+    subjects = doc.get('subjects') or []
+    record = {
+        'title': title,
+        'author': author or None,
+        'genre': subjects[0] if subjects else None,
+        'description': description.strip()[:MAX_DESCRIPTION] or None,
+        'isbn': sorted(isbns)[0],
+    }
+    return record, isbns
+
+
+class _AuthorNames:
+    # Author key -> name, kept in a scratch SQLite file; the dumps hold millions of authors.
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE authors (key TEXT PRIMARY KEY, name TEXT) WITHOUT ROWID')
+
+    def add_all(self, pairs):
+        self.db.executemany('INSERT OR REPLACE INTO authors VALUES (?, ?)', pairs)
+        self.db.commit()
+
+    def get(self, key):
+        row = self.db.execute('SELECT name FROM authors WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.db.close()
+
+
+class _ExternalSort:
+    """Fixed-width (key, offset) entries sorted through run files on disk.
+
+    Entries are packed big-endian so plain byte order is (key, offset) order;
+    each full run is sorted in memory and written out, and `merged` streams
+    the runs back through a heap merge.
+    """
+
+    def __init__(self, key_width, directory):
+        self.entry = struct.Struct(f'>{key_width}sQ')
+        self.directory = directory
+        self.runs = []
+        self.pending = []
+
+    def add(self, key, offset):
+        self.pending.append(self.entry.pack(key, offset))
+        if len(self.pending) >= SORT_RUN_SIZE:
+            self._spill()
+
+    def _spill(self):
+        self.pending.sort()
+        with tempfile.NamedTemporaryFile('wb', dir=self.directory, suffix='.run', delete=False) as f:
+            f.write(b''.join(self.pending))
+        self.runs.append(f.name)
+        self.pending = []
+
+    def _read_run(self, path):
+        size = self.entry.size
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(size * 8192)
+                if not block:
+                    return
+                for start in range(0, len(block), size):
+                    yield block[start:start + size]
+
+    def merged(self):
+        """Yield (key, offset) in order."""
+        self.pending.sort()
+        for packed in heapq.merge(self.pending, *(self._read_run(path) for path in self.runs)):
+            yield self.entry.unpack(packed)
+
+    def close(self):
+        for path in self.runs:
+            os.remove(path)
+
+
+def build_catalog(paths, directory):
+    """Build the index files in `directory` from Open Library author and edition dumps.
+
+    Only editions with an ISBN and a title are kept. Author names are
+    resolved from any author records among `paths`. Files are written
+    beside the old ones and swapped in at the end, so a running app keeps
+    serving the previous catalog until it reloads. Authors and index entries
+    go through scratch files rather than memory, so a full dump builds on a
+    small machine.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=directory, prefix='build-') as scratch:
+        authors = _AuthorNames(os.path.join(scratch, 'authors.db'))
+        isbn_entries, token_entries = _ExternalSort(13, scratch), _ExternalSort(TOKEN_WIDTH, scratch)
+        try:
+            for path in paths:
+                batch = []
+                for line in read_dump(path):
+                    doc = _document(line, '/type/author')
+                    if doc and doc.get('name'):
+                        batch.append((doc['key'], doc['name'].strip()))
+                        if len(batch) == 10000:
+                            authors.add_all(batch)
+                            batch = []
+                authors.add_all(batch)
+
+            count = 0
+            with open(os.path.join(directory, 'records.bin.tmp'), 'wb') as records:
+                for path in paths:
+                    for line in read_dump(path):
+                        doc = _document(line, '/type/edition')
+                        if doc is None:
+                            continue
+                        record, isbns = _edition_record(doc, authors)
+                        if record is None:
+                            continue
+                        offset = records.tell()
+                        data = json.dumps(record, separators=(',', ':')).encode()
+                        records.write(RECORD_HEADER.pack(len(data)) + data)
+                        count += 1
+                        for isbn in isbns:
+                            isbn_entries.add(isbn.encode(), offset)
+                        for token in set(tokenize(record['title']) + tokenize(record['author'])):
+                            token_entries.add(token.encode()[:TOKEN_WIDTH], offset)
+
+            isbn_count = 0
+            with open(os.path.join(directory, 'isbn.idx.tmp'), 'wb') as f:
+                previous = None
+                for isbn, offset in isbn_entries.merged():
+                    # An ISBN listed by several editions points at the first one read.
+                    if isbn != previous:
+                        f.write(ISBN_ENTRY.pack(isbn, offset))
+                        previous = isbn
+                        isbn_count += 1
+            token_count = 0
+            with open(os.path.join(directory, 'prefix.idx.tmp'), 'wb') as f:
+                for token, offset in token_entries.merged():
+                    f.write(TOKEN_ENTRY.pack(token, offset))
+                    token_count += 1
+        finally:
+            authors.close()
+            isbn_entries.close()
+            token_entries.close()
+
+    for name in FILES:
+        os.replace(os.path.join(directory, f"{name}.tmp"), os.path.join(directory, name))
+    meta = {'records': count, 'isbns': isbn_count, 'tokens': token_count,
+            'built_at': datetime.utcnow().isoformat(timespec='seconds')}
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+# --- Lookups ---
+
+class Catalog:
+    """Read-only book metadata from a catalog built by `build_catalog`.
+
+    The index files are memory-mapped on first use, so workers share the
+    pages through the OS cache and nothing is loaded at import. ISBNs are
+    found by binary search over fixed-width entries; autocomplete does the
+    same over a sorted list of title and author words, which serves as a
+    compact prefix tree. A missing catalog simply returns no results.
+    Workers keep the files they opened, so restart them after a rebuild.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._maps = None
+        self._lock = threading.Lock()
+
+    def configure(self, directory):
+        # Before first use, like `Storage.configure`; files already mapped are simply dropped.
+        with self._lock:
+            self.directory = directory
+            self._maps = None
+
+    def _open(self):
+        if self._maps is None:
+            with self._lock:
+                if self._maps is None:
+                    maps = {}
+                    for name in FILES:
+                        path = os.path.join(self.directory, name)
+                        if not os.path.exists(path) or os.path.getsize(path) == 0:
+                            # Not built (yet); look again next time rather than caching the miss.
+                            return {}
+                        with open(path, 'rb') as f:
+                            maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._maps = maps
+        return self._maps
+
+    def _record(self, offset):
+        records = self._maps['records.bin']
+        (length,) = RECORD_HEADER.unpack_from(records, offset)
+        start = offset + RECORD_HEADER.size
+        return json.loads(records[start:start + length])
+
+    @staticmethod
+    def _lower_bound(index, entry, key):
+        low, high = 0, len(index) // entry.size
+        while low < high:
+            middle = (low + high) // 2
+            if entry.unpack_from(index, middle * entry.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, isbn):
+        isbn = normalize_isbn(isbn)
+        if not isbn or not self._open():
+            return None
+        index = self._maps['isbn.idx']
+        position = self._lower_bound(index, ISBN_ENTRY, isbn.encode())
+        if position * ISBN_ENTRY.size >= len(index):
+            return None
+        key, offset = ISBN_ENTRY.unpack_from(index, position * ISBN_ENTRY.size)
+        return self._record(offset) if key == isbn.encode() else None
+
+    def _token_range(self, prefix):
+        index = self._maps['prefix.idx']
+        prefix = prefix.encode()[:TOKEN_WIDTH]
+        first = self._lower_bound(index, TOKEN_ENTRY, prefix)
+        # Every key starting with `prefix` sorts below prefix + 0xff.
+        last = self._lower_bound(index, TOKEN_ENTRY, prefix + b'\xff')
+        return first, last
+
+    def suggest(self, query, limit=8, scan_limit=500):
+        """Books whose title/author words start with every word of `query`, best matches first."""
+        words = tokenize(query)
+        if not words or not self._open():
+            return []
+        # Walk the narrowest word's range and check the other words against each record.
+        ranges = {word: self._token_range(word) for word in words}
+        first, last = min(ranges.values(), key=lambda bounds: bounds[1] - bounds[0])
+        index = self._maps['prefix.idx']
+
+        best, seen = [], set()
+        normalized_query = ' '.join(words)
+        for position in range(first, min(last, first + scan_limit)):
+            _, offset = TOKEN_ENTRY.unpack_from(index, position * TOKEN_ENTRY.size)
+            if offset in seen:
+                continue
+            seen.add(offset)
+            record = self._record(offset)
+            title_words = tokenize(record['title'])
+            record_words = title_words + tokenize(record['author'])
+            if not all(any(word.startswith(part) for word in record_words) for part in words):
+                continue
+            rank = (not ' '.join(title_words).startswith(normalized_query), len(record['title']), record['title'])
+            insort(best, (rank, offset, record))
+            del best[limit * 4:]
+
+        return self._distinct((record for _, _, record in best), limit)
+
+    def related(self, words, limit=300):
+        """Records indexed under any of `words` (whole words, not prefixes), earlier words first."""
+        if not words or not self._open():
+            return []
+        index = self._maps['prefix.idx']
+        offsets = {}
+        words = list(dict.fromkeys(words))
+        per_word = max(1, limit // len(words))
+        for word in words:
+            key = word.encode()[:TOKEN_WIDTH].ljust(TOKEN_WIDTH, b'\0')
+            first, last = self._token_range(word)
+            taken = 0
+            for position in range(first, last):
+                token, offset = TOKEN_ENTRY.unpack_from(index, position * TOKEN_ENTRY.size)
+                if token != key:
+                    # Longer words sharing the prefix sort after the exact word; past them there's nothing more.
+                    break
+                if offset not in offsets:
+                    offsets[offset] = None
+                    taken += 1
+                    if taken == per_word:
+                        break
+        return [self._record(offset) for offset in offsets]
+
+    @staticmethod
+    def _distinct(records, limit):
+        results, titles = [], set()
+        for record in records:
+            # Editions of the same book differ only by ISBN; show each title/author once.
+            key = (record['title'].lower(), (record['author'] or '').lower())
+            if key not in titles:
+                titles.add(key)
+                results.append(record)
+            if len(results) == limit:
+                break
+        return results
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+
+from itsdangerous import BadData, SignatureExpired, URLSafeTimedSerializer
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+class InvalidChangeToken(ValueError):
+    pass
+
+
+class ExpiredChangeToken(InvalidChangeToken):
+    """The token predates the tombstones still kept; the client has to start over with a full sync."""
+
+
+class ChangeLog:
+    """Revision numbers for every book write, and tombstones for deleted books.
+
+    Each user has a counter; every insert, update or delete through the
+    Library takes the next value(s) and stores it on the book as `rev` (or on
+    its tombstone), so "what changed since revision N" is one range scan on
+    an index. Tombstones are kept for `SYNC_RETENTION_DAYS`; feed tokens are
+    signed with their issue time and refused once older than that, because
+    deletions made since may already have been forgotten.
+
+    Revisions are taken before the write lands, so a slow write can show up
+    behind revisions a client has already read past. A token therefore holds
+    two revisions: `high`, where the next page starts, and `low`, below which
+    every write had settled when the token was issued. Revisions allocated
+    within the last `SYNC_SETTLE_SECONDS` count as unsettled, and each page
+    re-sends what has landed between `low` and `high`, i.e. at most those
+    few seconds' writes. Deltas are applied as idempotent upserts, so the
+    repeats cost clients nothing.
+    """
+
+    def __init__(self, app=None, counters=None, tombstones=None, books=None):
+        if app is not None:
+            self.init_app(app, counters, tombstones, books)
+
+    def init_app(self, app, counters, tombstones, books):
+        self.counters = counters
+        self.tombstones = tombstones
+        self.books = books
+        app.config.setdefault('SYNC_RETENTION_DAYS', 90)
+        # How long a write may take to land after taking its revision.
+        app.config.setdefault('SYNC_SETTLE_SECONDS', 10)
+        self.settle = timedelta(seconds=app.config['SYNC_SETTLE_SECONDS'])
+        self.retention = app.config['SYNC_RETENTION_DAYS'] * 24 * 3600
+        self._tokens = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='book-changes')
+
+    def create_indexes(self):
+        self.tombstones.create_index([('user_id', ASCENDING), ('rev', ASCENDING)])
+        self.tombstones.create_index('deleted_at', expireAfterSeconds=self.retention)
+
+    # --- Writing ---
+
+    def allocate(self, user_id, count=1):
+        """Reserve `count` consecutive revisions for this user; returns the first."""
+        doc = self.counters.find_one_and_update(
+            {'_id': user_id}, {'$inc': {'rev': count}}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        return doc['rev'] - count + 1
+
+    def settled(self, user_id, floor):
+        """A revision up to which every write has landed, assuming none takes over SYNC_SETTLE_SECONDS.
+
+        Revisions are handed out in time order, so everything below the newest
+        entry written before the margin was allocated earlier still, and has
+        landed. Finding it reads past only the last few seconds' writes.
+        """
+        cutoff = datetime.utcnow() - self.settle
+        book = self.books.last_written_before(user_id, cutoff, floor)
+        tombstone = self.tombstones.find_one({'user_id': user_id, 'rev': {'$gt': floor}, 'deleted_at': {'$lt': cutoff}},
+                                             {'rev': 1}, sort=[('rev', DESCENDING)])
+        return max([floor] + [doc['rev'] for doc in (book, tombstone) if doc])
+
+    def stamp(self, user_id, books):
+        if not books:
+            return
+        rev = self.allocate(user_id, len(books))
+        for offset, book in enumerate(books):
+            book['rev'] = rev + offset
+
+    def deleted(self, user_id, book_ids):
+        if not book_ids:
+            return
+        rev, now = self.allocate(user_id, len(book_ids)), datetime.utcnow()
+        # A book deleted, restored by a delta and deleted again keeps only its latest tombstone.
+        self.tombstones.delete_many({'_id': {'$in': list(book_ids)}})
+        self.tombstones.insert_many([
+            {'_id': book_id, 'user_id': user_id, 'rev': rev + offset, 'deleted_at': now}
+            for offset, book_id in enumerate(book_ids)
+        ])
+
+    def forget(self, user_id):
+        self.tombstones.delete_many({'user_id': user_id})
+        self.counters.delete_one({'_id': user_id})
+
+    # --- Reading ---
+
+    def encode_token(self, low, high):
+        return self._tokens.dumps([low, high])
+
+    def decode_token(self, token):
+        """-> (low, high); tokens from before the settle margin hold a single revision."""
+        try:
+            revs = self._tokens.loads(token, max_age=self.retention)
+        except SignatureExpired:
+            raise ExpiredChangeToken("Token is older than the deletion history; do a full sync.")
+        except BadData as e:
+            raise InvalidChangeToken(str(e))
+        if isinstance(revs, int):
+            revs = [revs, revs]
+        if (not isinstance(revs, list) or len(revs) != 2 or not all(isinstance(rev, int) for rev in revs)
+                or revs[0] > revs[1]):
+            raise InvalidChangeToken("Malformed token.")
+        return tuple(revs)
+
+    def backfill(self, user_id):
+        # Books written before revisions existed get theirs on the user's first sync.
+        while True:
+            ids = [book['_id'] for book in self.books.unstamped(user_id, BACKFILL_BATCH_SIZE)]
+            if not ids:
+                return
+            rev, now = self.allocate(user_id, len(ids)), datetime.utcnow()
+            # updated_at doubles as the revision's allocation time; see `settled`.
+            self.books.bulk_write(updates=[({'_id': book_id}, {'rev': rev + offset, 'updated_at': now})
+                                           for offset, book_id in enumerate(ids)])
+
+    def changes(self, user_id, token=None, limit=500, projection=None):
+        """One page of books written and books deleted after `token`, oldest revision first.
+
+        Returns (entries, next_token, more). Deleted books come back as
+        {'_id': ..., 'rev': ..., 'deleted': True}. Without a token the page
+        starts from the beginning, i.e. a full sync. Besides the page itself,
+        entries may repeat ones sent recently, in case a write landed late.
+        """
+        low, high = self.decode_token(token) if token else (0, 0)
+        self.backfill(user_id)
+        fresh = self._entries(user_id, high, None, limit + 1, projection)
+        more = len(fresh) > limit
+        fresh = fresh[:limit]
+        # Revisions read past while possibly in flight; whatever has landed there since goes out again.
+        overlap = self._entries(user_id, low, high, 0, projection) if low < high else []
+        entries = sorted(overlap + fresh, key=lambda entry: entry['rev'])
+
+        high = fresh[-1]['rev'] if fresh else high
+        low = min(high, self.settled(user_id, low))
+        # Reissued even when nothing changed, so a client syncing regularly never holds an expired token.
+        return entries, self.encode_token(low, high), more
+
+    def _entries(self, user_id, since, until, limit, projection):
+        books = self.books.changed_since(user_id, since, limit, projection, until)
+        revs = {'$gt': since} if until is None else {'$gt': since, '$lte': until}
+        tombstones = [
+            {'_id': doc['_id'], 'rev': doc['rev'], 'deleted': True}
+            for doc in self.tombstones.find({'user_id': user_id, 'rev': revs}, {'rev': 1})
+                                      .sort('rev', ASCENDING).limit(limit)
+        ]
+        entries = sorted(books + tombstones, key=lambda entry: entry['rev'])
+        return entries[:limit] if limit else entries
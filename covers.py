@@ -0,0 +1,249 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from pymongo import ReturnDocument
+
+log = logging.getLogger(__name__)
+
+# Largest box each stored variant is scaled down to fit in.
+COVER_SIZES = {
+    'thumb': (300, 450),
+    'detail': (600, 900),
+}
+JPEG_QUALITY = 85
+# A claim older than this belongs to a worker that died before releasing it.
+CLAIM_TIMEOUT = timedelta(hours=1)
+
+
+class InvalidCover(ValueError):
+    pass
+
+
+# An accepted upload waiting for a background worker; `token` guards against a newer upload being overwritten.
+PendingCover = namedtuple('PendingCover', ['token', 'path'])
+
+
+# --- Storage Backends ---
+
+class CloudinaryCoverStore:
+    # The SDK is imported and configured on the first upload, keeping it off the worker boot path.
+    def __init__(self, cloud_name=None, api_key=None, api_secret=None):
+        self.credentials = {'cloud_name': cloud_name, 'api_key': api_key, 'api_secret': api_secret}
+        self._uploader = None
+        self._lock = threading.Lock()
+
+    @property
+    def uploader(self):
+        if self._uploader is None:
+            with self._lock:
+                if self._uploader is None:
+                    import cloudinary
+                    import cloudinary.uploader
+                    cloudinary.config(**self.credentials)
+                    self._uploader = cloudinary.uploader
+        return self._uploader
+
+    def upload(self, data, key):
+        result = self.uploader.upload(io.BytesIO(data), public_id=f"covers/{key}", overwrite=False, resource_type='image')
+        return result['secure_url']
+
+    def delete(self, key):
+        self.uploader.destroy(f"covers/{key}", resource_type='image')
+
+    def delete_url(self, url):
+        """Destroy an image uploaded before covers were keyed by hash; False if `url` isn't one of ours."""
+        public_id = self.public_id(url)
+        if public_id is None:
+            return False
+        self.uploader.destroy(public_id, resource_type='image')
+        return True
+
+    def public_id(self, url):
+        # https://res.cloudinary.com/<cloud>/image/upload/[<transformations>/]v<version>/<public_id>.<ext>
+        prefix = f"https://res.cloudinary.com/{self.credentials['cloud_name']}/image/upload/"
+        if not self.credentials['cloud_name'] or not (url or '').startswith(prefix):
+            return None
+        match = re.match(r'(?:[^?]*?/)?v\d+/([^?]+)', url[len(prefix):])
+        return os.path.splitext(match.group(1))[0] if match else None
+
+
+class LocalCoverStore:
+    # Keeps covers under the app's static folder; handy for development, tests and benchmarks.
+    def __init__(self, root, url_prefix):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+        os.makedirs(root, exist_ok=True)
+
+    def upload(self, data, key):
+        with open(os.path.join(self.root, f"{key}.jpg"), 'wb') as f:
+            f.write(data)
+        return f"{self.url_prefix}/{key}.jpg"
+
+    def delete(self, key):
+        try:
+            os.remove(os.path.join(self.root, f"{key}.jpg"))
+        except FileNotFoundError:
+            pass
+
+    def delete_url(self, url):
+        name = (url or '')[len(self.url_prefix) + 1:]
+        if not (url or '').startswith(self.url_prefix + '/') or not name or '/' in name:
+            return False
+        try:
+            os.remove(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
+        return True
+
+
+# --- Pipeline ---
+
+class CoverPipeline:
+    def __init__(self, app=None, store=None, books=None, covers=None, on_change=None, timer=None):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, store, books, covers, on_change, timer)
+
+    def init_app(self, app, store, books, covers, on_change=None, timer=None):
+        self.app = app
+        self.store = store
+        self.books = books
+        self.covers = covers
+        # Called with the updated book document once its cover is in place.
+        self.on_change = on_change
+        # Context manager factory used to time resizing and storage uploads.
+        self.timer = timer or (lambda operation: nullcontext())
+        app.config.setdefault('COVER_WORKERS', 2)
+        # Private to the app: staged uploads shouldn't sit in a shared, guessable /tmp path.
+        app.config.setdefault('COVER_TMP_DIR', os.path.join(app.instance_path, 'cover-uploads'))
+        os.makedirs(app.config['COVER_TMP_DIR'], mode=0o700, exist_ok=True)
+
+    def stage(self, file_storage):
+        # Cheap synchronous check so a broken file can still be reported on the form.
+        try:
+            with Image.open(file_storage.stream) as image:
+                image.verify()
+        except Image.DecompressionBombError:
+            raise InvalidCover("Image is too large.")
+        except (UnidentifiedImageError, OSError, SyntaxError) as e:
+            raise InvalidCover(f"Not a valid image ({e}).")
+        file_storage.stream.seek(0)
+
+        token = uuid.uuid4().hex
+        path = os.path.join(self.app.config['COVER_TMP_DIR'], token)
+        file_storage.save(path)
+        return PendingCover(token, path)
+
+    def submit(self, pending, book_id):
+        self._get_executor().submit(self._process, pending, book_id)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(self.app.config['COVER_WORKERS'], thread_name_prefix='covers')
+            return self._executor
+
+    def _process(self, pending, book_id):
+        digest, claimed = None, False
+        try:
+            with open(pending.path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+
+            # The claim keeps discard_if_unused from removing the record until the book points at it.
+            known = self.covers.find_one_and_update(
+                {'_id': digest},
+                {'$inc': {'claims': 1}, '$set': {'claimed_at': datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER,
+            )
+            claimed = known is not None
+            if known:
+                urls = known['urls']
+            else:
+                # Fresh keys per upload, so a discard still deleting an older copy can't take these files.
+                key = f"{digest}-{uuid.uuid4().hex[:8]}"
+                with self.timer('cover_resize'):
+                    variants = self._resize(pending.path)
+                with self.timer('cover_store'):
+                    urls = {name: self.store.upload(data, f"{key}-{name}") for name, data in variants.items()}
+                known = self.covers.find_one_and_update(
+                    {'_id': digest},
+                    {'$setOnInsert': {'urls': urls, 'key': key, 'created_at': datetime.utcnow()},
+                     '$inc': {'claims': 1}, '$set': {'claimed_at': datetime.utcnow()}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                claimed = True
+                if known.get('key') != key:
+                    # Another worker stored the same image first; use theirs.
+                    for name in urls:
+                        self.store.delete(f"{key}-{name}")
+                    urls = known['urls']
+
+            book = self.books.find_one_and_update(
+                {'_id': book_id, 'cover_pending': pending.token},
+                {'$set': {'cover_image': urls['detail'], 'cover_thumb': urls['thumb'], 'cover_hash': digest,
+                          'updated_at': datetime.utcnow()},
+                 '$unset': {'cover_pending': ''}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if book and self.on_change:
+                self.on_change(book)
+        except Exception:
+            log.exception("Processing cover for book %s failed.", book_id)
+            self.books.update_one({'_id': book_id, 'cover_pending': pending.token}, {'$unset': {'cover_pending': ''}})
+        finally:
+            if claimed:
+                self.covers.update_one({'_id': digest, 'claims': {'$gt': 0}}, {'$inc': {'claims': -1}})
+            try:
+                os.remove(pending.path)
+            except OSError:
+                pass
+
+    def discard_if_unused(self, digest):
+        # Stored covers are shared by every book with the same image, so only remove one nobody uses.
+        if self.books.find_one({'cover_hash': digest}, {'_id': 1}) is not None:
+            return False
+        # Only delete the record if no upload claimed it meanwhile; that upload re-stores the image.
+        record = self.covers.find_one_and_delete({'_id': digest, '$or': [
+            {'claims': {'$not': {'$gt': 0}}},
+            {'claimed_at': {'$lt': datetime.utcnow() - CLAIM_TIMEOUT}},
+        ]})
+        if record is None:
+            return False
+        for name in COVER_SIZES:
+            self.store.delete(f"{record.get('key', digest)}-{name}")
+        return True
+
+    def discard_url_if_unused(self, url):
+        # A cover from before hashing: no record, possibly copied to other books by an import.
+        if self.books.find_one({'cover_image': url}, {'_id': 1}) is not None:
+            return False
+        if self.covers.find_one({'$or': [{'urls.detail': url}, {'urls.thumb': url}]}, {'_id': 1}) is not None:
+            # Actually a hashed cover whose book lost its hash; discard_if_unused owns it.
+            return False
+        return self.store.delete_url(url)
+
+    def _resize(self, path):
+        variants = {}
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for name, size in COVER_SIZES.items():
+                variant = image.copy()
+                variant.thumbnail(size, Image.LANCZOS)
+                buffer = io.BytesIO()
+                variant.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+                variants[name] = buffer.getvalue()
+        return variants
@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class EventBroker:
+    """Fans library changes out to the /events streams open in this process.
+
+    Changes made through the Library are published directly. With
+    EVENTS_CHANGE_STREAM enabled (needs a replica set), inserts and updates
+    are instead read from a MongoDB change stream, so tabs connected to a
+    different worker process see them too.
+    """
+
+    def __init__(self, app=None, library=None, collection=None):
+        self._streams = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        if app is not None:
+            self.init_app(app, library, collection)
+
+    def init_app(self, app, library, collection):
+        self.app = app
+        self.collection = collection
+        app.config.setdefault('EVENTS_ENABLED', True)
+        app.config.setdefault('EVENTS_MAX_STREAMS', 16)
+        app.config.setdefault('EVENTS_STREAM_TIMEOUT', 300)
+        app.config.setdefault('EVENTS_HEARTBEAT', 15)
+        app.config.setdefault('EVENTS_QUEUE_SIZE', 100)
+        app.config.setdefault('EVENTS_CHANGE_STREAM', False)
+        library.subscribe(self._library_changed)
+
+    def _library_changed(self, user_id, changed, deleted):
+        if not self.app.config['EVENTS_CHANGE_STREAM']:
+            for book in changed:
+                self.publish(user_id, {'type': 'upsert', 'book': book})
+        # Delete events in a change stream carry only the _id, so deletes are always published locally.
+        for book_id in deleted:
+            self.publish(user_id, {'type': 'delete', 'id': book_id})
+
+    def publish(self, user_id, event):
+        with self._lock:
+            streams = list(self._streams.get(user_id, ()))
+        for stream in streams:
+            try:
+                stream.put_nowait(event)
+            except queue.Full:
+                # A stalled client; tell it to reload rather than letting the queue grow.
+                stream.queue.clear()
+                stream.put_nowait({'type': 'reset'})
+
+    def listen(self, user_id):
+        """Register a stream and return it; iterate it for events and close it when done.
+
+        Iterating yields None as a heartbeat and ends after
+        EVENTS_STREAM_TIMEOUT seconds; browsers reconnect on their own, which
+        keeps long-lived streams from pinning worker threads forever. Closing
+        gives the slot back, whether or not the stream was ever iterated.
+        """
+        stream = EventStream(self, user_id)
+        with self._lock:
+            if self._count >= self.app.config['EVENTS_MAX_STREAMS']:
+                raise TooManyStreams()
+            self._streams[user_id].add(stream.queue)
+            self._count += 1
+        self._start_watcher()
+        return stream
+
+    def _release(self, user_id, stream):
+        with self._lock:
+            self._streams[user_id].discard(stream)
+            if not self._streams[user_id]:
+                del self._streams[user_id]
+            self._count -= 1
+
+    def _start_watcher(self):
+        if not self.app.config['EVENTS_CHANGE_STREAM']:
+            return
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, name='book-events', daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace']}}}]
+        while True:
+            try:
+                with self.collection.watch(pipeline, full_document='updateLookup') as changes:
+                    for change in changes:
+                        book = change.get('fullDocument')
+                        if book:
+                            self.publish(book['user_id'], {'type': 'upsert', 'book': book})
+            except Exception:
+                log.exception("Book change stream failed; reconnecting shortly.")
+                time.sleep(5)
+
+
+class EventStream:
+    # One /events connection's queue; holds a slot in the broker until closed.
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = queue.Queue(broker.app.config['EVENTS_QUEUE_SIZE'])
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def __iter__(self):
+        config = self.broker.app.config
+        deadline = time.monotonic() + config['EVENTS_STREAM_TIMEOUT']
+        try:
+            while time.monotonic() < deadline and not self._closed:
+                try:
+                    yield self.queue.get(timeout=config['EVENTS_HEARTBEAT'])
+                except queue.Empty:
+                    yield None
+        finally:
+            self.close()
+
+    def close(self):
+        # Called from the response body and from the response's close; only the first counts.
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.broker._release(self.user_id, self.queue)
@@ -1,4 +1,4 @@
-from wtforms import StringField, EmailField, PasswordField, TextAreaField, FileField, DecimalField, DateField, SubmitField, ValidationError
+from wtforms import StringField, EmailField, PasswordField, TextAreaField, FileField, DecimalField, DateField, SubmitField, BooleanField, ValidationError
 from wtforms.validators import DataRequired, Email, EqualTo, Length, NumberRange, Optional
 from flask_wtf.file import FileAllowed, FileRequired
 from flask_wtf import FlaskForm
@@ -44,10 +44,12 @@ class Book(FlaskForm):
 
 
 class Data(FlaskForm):
-    json_file = FileField('Choose JSON File', validators=[
+    json_file = FileField('Choose File', validators=[
         FileRequired(),
-        FileAllowed(['json'], 'JSON files only!')
+        FileAllowed(['json', 'ndjson', 'csv'], 'JSON, NDJSON or CSV files only!')
     ])
+    skip_duplicates = BooleanField('Skip books already in my library')
+    apply_changes = BooleanField('Apply as a sync: update books by _id and apply deletions')
     submit = SubmitField('Upload')
 
 
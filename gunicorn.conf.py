@@ -0,0 +1,17 @@
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+
+# 'gthread' serves each worker's requests from a thread pool. Waiting on MongoDB,
+# SMTP or Cloudinary releases the GIL, so one process keeps GUNICORN_THREADS
+# requests in flight instead of one. Set GUNICORN_WORKER_CLASS=sync for the old
+# one-request-per-worker behaviour. Keep MONGO_MAX_POOL_SIZE >= GUNICORN_THREADS
+# or requests queue for a connection.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# gunicorn silently upgrades 'sync' to 'gthread' when threads > 1.
+threads = int(os.environ.get('GUNICORN_THREADS', 32)) if worker_class == 'gthread' else 1
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
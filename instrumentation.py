@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, abort, before_render_template, g, has_app_context, request, template_rendered
+from pymongo import monitoring
+
+log = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# --- Metrics ---
+
+def _label_string(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _float(value):
+    # Full precision; `:g` would turn a sum of 1234567.8 into 1.23457e+06.
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_label_string(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [per-bucket counts, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.setdefault(label_values, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((key, (list(counts), total, n)) for key, (counts, total, n) in self._series.items())
+        for label_values, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _label_string(self.labels + ('le',), label_values + (_float(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_bucket{_label_string(self.labels + ('le',), label_values + ('+Inf',))} {n}"
+            yield f"{self.name}_sum{_label_string(self.labels, label_values)} {_float(total)}"
+            yield f"{self.name}_count{_label_string(self.labels, label_values)} {n}"
+
+
+# --- Request tracking ---
+
+class RequestMetrics:
+    # Everything measured while handling one request.
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.render_depth = 0
+        self.render_started = None
+
+
+def current_request_metrics():
+    if not has_app_context():
+        return None
+    return g.get('_request_metrics')
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.instrumentation.record_command(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.instrumentation.record_command(event.command_name, event.duration_micros / 1e6, failed=True)
+
+
+class Instrumentation:
+    """Per-request timing of database commands, template rendering and slow calls.
+
+    Each response gets a Server-Timing header with the breakdown, requests
+    slower than SLOW_REQUEST_MS are logged with it, and process-wide
+    histograms are served in the Prometheus text format on /metrics.
+    """
+
+    def __init__(self, app=None):
+        self.command_listener = MongoCommandListener(self)
+        self.request_duration = Histogram('http_request_duration_seconds', "Time spent handling a request.", ('endpoint', 'method'))
+        self.requests = Counter('http_requests_total', "Requests handled, by endpoint and status.", ('endpoint', 'method', 'status'))
+        self.request_commands = Histogram('http_request_mongo_commands', "MongoDB commands issued per request.", ('endpoint',), COUNT_BUCKETS)
+        self.command_duration = Histogram('mongo_command_duration_seconds', "MongoDB command latency.", ('command',))
+        self.command_failures = Counter('mongo_command_failures_total', "MongoDB commands that failed.", ('command',))
+        self.operation_duration = Histogram('app_operation_duration_seconds', "Time spent in timed operations (render, hash, smtp, ...).", ('operation',))
+        self.metrics = [self.request_duration, self.requests, self.request_commands, self.command_duration,
+                        self.command_failures, self.operation_duration]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('SLOW_REQUEST_MS', 500)
+        app.config.setdefault('SERVER_TIMING', True)
+        # When set, /metrics requires "Authorization: Bearer <token>".
+        app.config.setdefault('METRICS_TOKEN', None)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    @contextmanager
+    def timer(self, operation):
+        # Usable anywhere; inside a request the time also shows up in its breakdown.
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.operation_duration.observe(elapsed, operation)
+            metrics = current_request_metrics()
+            if metrics is not None:
+                metrics.durations[operation] += elapsed
+                metrics.counts[operation] += 1
+
+    def timed(self, operation):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(operation):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_command(self, command, duration, failed=False):
+        self.command_duration.observe(duration, command)
+        if failed:
+            self.command_failures.inc(command)
+        metrics = current_request_metrics()
+        if metrics is not None:
+            metrics.durations['mongo'] += duration
+            metrics.counts['mongo'] += 1
+
+    def _start_request(self):
+        g._request_metrics = RequestMetrics()
+
+    def _render_started(self, sender, template, context, **extra):
+        metrics = current_request_metrics()
+        if metrics is None:
+            return
+        # Templates rendered from inside another template (book cards) are part of the outer render.
+        if metrics.render_depth == 0:
+            metrics.render_started = time.perf_counter()
+        metrics.render_depth += 1
+
+    def _render_finished(self, sender, template, context, **extra):
+        metrics = current_request_metrics()
+        if metrics is None or not metrics.render_depth:
+            return
+        metrics.render_depth -= 1
+        if metrics.render_depth == 0:
+            elapsed = time.perf_counter() - metrics.render_started
+            metrics.durations['render'] += elapsed
+            metrics.counts['render'] += 1
+            self.operation_duration.observe(elapsed, 'render')
+
+    def _finish_request(self, response):
+        metrics = g.pop('_request_metrics', None)
+        if metrics is None:
+            return response
+        total = time.perf_counter() - metrics.started
+        endpoint = request.endpoint or 'unmatched'
+
+        self.request_duration.observe(total, endpoint, request.method)
+        self.requests.inc(endpoint, request.method, response.status_code)
+        self.request_commands.observe(metrics.counts['mongo'], endpoint)
+
+        breakdown = [(name, metrics.durations[name], metrics.counts[name]) for name in sorted(metrics.durations)]
+        if self.app.config['SERVER_TIMING']:
+            entries = [f'{name};dur={duration * 1000:.1f};desc="{count}x"' for name, duration, count in breakdown]
+            entries.append(f"total;dur={total * 1000:.1f}")
+            response.headers.add('Server-Timing', ', '.join(entries))
+
+        if total * 1000 >= self.app.config['SLOW_REQUEST_MS']:
+            details = ', '.join(f"{name} {duration * 1000:.0f} ms/{count}x" for name, duration, count in breakdown) or 'no breakdown'
+            log.warning("Slow request: %s %s -> %s in %.0f ms (%s)", request.method, request.full_path.rstrip('?'),
+                        response.status_code, total * 1000, details)
+        return response
+
+    def metrics_view(self):
+        token = self.app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            abort(401)
+        lines = [line for metric in self.metrics for line in metric.render()]
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,188 @@
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from itsdangerous import URLSafeTimedSerializer, BadData
+from pymongo.errors import BulkWriteError
+
+from book_io import normalize_isbn
+
+# Sort modes offered by the dropdown on the home page and the API: field, direction.
+SORT_MODES = {
+    'date-asc': ('reading_started', 1),
+    'date-desc': ('reading_started', -1),
+    'title-asc': ('title', 1),
+    'title-desc': ('title', -1),
+    'author-asc': ('author', 1),
+    'author-desc': ('author', -1),
+}
+DEFAULT_SORT = 'date-asc'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _with_isbn_key(fields):
+    # Duplicate checks match on this rather than the ISBN as typed ("0-441-17271-7" vs "9780441172719").
+    if 'isbn' in fields:
+        fields['isbn_key'] = normalize_isbn(fields['isbn'])
+    return fields
+
+
+class Library:
+    """Paging through a user's books, and every book mutation with its side effects.
+
+    The HTML views and the JSON API both write through here so `updated_at`,
+    the sync revision and the per-user stats stay in step however a book is
+    changed.
+    """
+
+    def __init__(self, books, stats, secret_key, changes):
+        self.books = books
+        self.stats = stats
+        self.changes = changes
+        self._cursors = URLSafeTimedSerializer(secret_key, salt='shelf-cursor')
+        self._listeners = []
+
+    def subscribe(self, callback):
+        # Called as callback(user_id, changed, deleted) after every mutation: the books
+        # as now stored, and the ids of removed ones. Only this process is notified.
+        self._listeners.append(callback)
+
+    def notify(self, user_id, changed=(), deleted=()):
+        for callback in self._listeners:
+            callback(user_id, changed, deleted)
+
+    # --- Reading ---
+
+    def page(self, user_id, sort_mode, limit, after=None, projection=None):
+        field, direction = SORT_MODES[sort_mode]
+        position = self.decode_cursor(after, sort_mode) if after else None
+        if projection:
+            # The cursor is built from the sort field, so it has to come back too.
+            projection = {**projection, field: 1}
+        books = self.books.page(user_id, field, direction, limit + 1, position, projection)
+        next_cursor = None
+        if len(books) > limit:
+            books = books[:limit]
+            next_cursor = self.encode_cursor(books[-1], sort_mode)
+        return books, next_cursor
+
+    def get(self, user_id, book_id, projection=None):
+        book = self.books.get(book_id, projection and {**projection, 'user_id': 1})
+        if book is None or book.get('user_id') != user_id:
+            return None
+        return book
+
+    def encode_cursor(self, book, sort_mode):
+        value = book.get(SORT_MODES[sort_mode][0])
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        return self._cursors.dumps([sort_mode, value, str(book['_id'])])
+
+    def decode_cursor(self, token, sort_mode):
+        try:
+            token_sort, value, book_id = self._cursors.loads(token)
+            if token_sort != sort_mode:
+                raise InvalidCursor("Cursor belongs to a different sort order.")
+            if SORT_MODES[sort_mode][0] == 'reading_started' and value is not None:
+                value = datetime.fromisoformat(value)
+            return value, ObjectId(book_id)
+        except (BadData, ValueError, TypeError) as e:
+            raise InvalidCursor(str(e))
+
+    # --- Writing ---
+
+    def add(self, book):
+        book['updated_at'] = datetime.utcnow()
+        _with_isbn_key(book)
+        self.changes.stamp(book['user_id'], [book])
+        self.books.insert(book)
+        self.stats.apply(book['user_id'], added=[book])
+        self.notify(book['user_id'], changed=[book])
+        return book
+
+    def add_many(self, user_id, books):
+        now = datetime.utcnow()
+        for book in books:
+            book['updated_at'] = now
+            _with_isbn_key(book)
+        self.changes.stamp(user_id, books)
+        self.books.insert_many(books)
+        self.stats.apply(user_id, added=books)
+        self.notify(user_id, changed=books)
+
+    def update(self, book, fields):
+        fields = _with_isbn_key({**fields, 'updated_at': datetime.utcnow(), 'rev': self.changes.allocate(book['user_id'])})
+        self.books.update(book['_id'], fields)
+        updated = {**book, **fields}
+        self.stats.apply(book['user_id'], added=[updated], removed=[book])
+        self.notify(book['user_id'], changed=[updated])
+        return updated
+
+    def remove(self, book):
+        self.books.delete(book['_id'])
+        self.changes.deleted(book['user_id'], [book['_id']])
+        self.stats.apply(book['user_id'], removed=[book])
+        self.notify(book['user_id'], deleted=[book['_id']])
+
+    def touched(self, book):
+        # Written elsewhere (e.g. a cover finishing in the background) without counters changing.
+        book['rev'] = self.changes.allocate(book['user_id'])
+        self.books.update(book['_id'], {'rev': book['rev']})
+        self.stats.touch(book['user_id'])
+        self.notify(book['user_id'], changed=[book])
+
+    def bulk(self, user_id, creates=(), updates=(), deletes=()):
+        """Apply many changes in one bulk write.
+
+        `updates` are (book_id, fields) pairs and `deletes` book ids; ids that
+        aren't this user's books are reported back in `missing`. Creates keep
+        an `_id` they already have, so a synced delta can restore a book.
+        """
+        now = datetime.utcnow()
+        existing = {book['_id']: book for book in self.books.find_by_ids(user_id, [book_id for book_id, _ in updates] + list(deletes))}
+
+        changes, deletions, added, removed, missing = [], [], [], [], []
+        created = []
+        for book in creates:
+            book.setdefault('_id', ObjectId())
+            book.update(user_id=user_id, updated_at=now)
+            _with_isbn_key(book)
+            created.append(book)
+            added.append(book)
+        updated = []
+        for book_id, fields in updates:
+            book = existing.get(book_id)
+            if book is None:
+                missing.append(book_id)
+                continue
+            fields = _with_isbn_key({**fields, 'updated_at': now})
+            changes.append(({'_id': book_id, 'user_id': user_id}, fields))
+            updated.append({**book, **fields})
+            added.append(updated[-1])
+            removed.append(book)
+        deleted = []
+        for book_id in deletes:
+            book = existing.get(book_id)
+            if book is None:
+                missing.append(book_id)
+                continue
+            deletions.append({'_id': book_id, 'user_id': user_id})
+            deleted.append(book_id)
+            removed.append(book)
+
+        if created or changes or deletions:
+            self.changes.stamp(user_id, created + [fields for _, fields in changes])
+            for book, (_, fields) in zip(updated, changes):
+                book['rev'] = fields['rev']
+            try:
+                self.books.bulk_write(created, changes, deletions)
+            except BulkWriteError:
+                # Part of the batch went through; recount rather than guess which part.
+                self.stats.rebuild(user_id)
+                raise
+            self.changes.deleted(user_id, deleted)
+            self.stats.apply(user_id, added=added, removed=removed)
+            self.notify(user_id, changed=created + updated, deleted=deleted)
+        return {'created': created, 'updated': updated, 'deleted': deleted, 'missing': missing}
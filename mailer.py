@@ -0,0 +1,162 @@
+import logging
+import os
+import smtplib
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+from pymongo import ASCENDING, ReturnDocument
+
+log = logging.getLogger(__name__)
+
+
+class Outbox:
+    """Mongo-backed email queue drained by a background thread.
+
+    Request handlers only insert a document; the worker claims pending
+    messages in batches, sends each batch over a single SMTP connection and
+    retries failures with exponential backoff. Because the queue lives in
+    MongoDB, messages survive a worker restart and any process can send them.
+    """
+
+    def __init__(self, app=None, mail=None, collection=None, timer=None):
+        self.mail = mail
+        self.collection = collection
+        self.timer = timer or (lambda operation: nullcontext())
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app, mail, collection, timer)
+
+    def init_app(self, app, mail, collection, timer=None):
+        self.app = app
+        self.mail = mail
+        self.collection = collection
+        if timer is not None:
+            self.timer = timer
+        app.config.setdefault('MAIL_OUTBOX_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_OUTBOX_MAX_ATTEMPTS', 6)
+        app.config.setdefault('MAIL_OUTBOX_RETRY_DELAY', 30)
+        app.config.setdefault('MAIL_OUTBOX_POLL_INTERVAL', 10)
+        app.config.setdefault('MAIL_OUTBOX_LOCK_TIMEOUT', 300)
+        # Start (or restart after a fork) lazily, so leftovers are drained once the worker serves traffic.
+        app.before_request(self.start)
+
+    def create_indexes(self):
+        self.collection.create_index([('status', ASCENDING), ('next_attempt_at', ASCENDING)])
+        self.collection.create_index('sent_at', expireAfterSeconds=7 * 24 * 3600)
+
+    def enqueue(self, subject, recipients, html=None, body=None, sender=None):
+        sender = sender or self.app.config['MAIL_DEFAULT_SENDER']
+        if self.collection is None:
+            # No queue available; fall back to sending inline.
+            with self.timer('smtp'):
+                self.mail.send(Message(subject, sender=sender, recipients=recipients, html=html, body=body))
+            return
+
+        now = datetime.utcnow()
+        self.collection.insert_one({
+            'subject': subject,
+            'sender': sender,
+            'recipients': list(recipients),
+            'html': html,
+            'body': body,
+            'status': 'pending',
+            'attempts': 0,
+            'created_at': now,
+            'next_attempt_at': now,
+        })
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        if self.collection is None:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='mail-outbox', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._claim_batch()
+                if batch:
+                    self._send_batch(batch)
+                    continue
+            except Exception:
+                log.exception("Mail outbox worker failed; retrying shortly.")
+            self._wake.wait(self.app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+            self._wake.clear()
+
+    def _claim_batch(self):
+        now = datetime.utcnow()
+        lock_until = now + timedelta(seconds=self.app.config['MAIL_OUTBOX_LOCK_TIMEOUT'])
+        # A 'sending' message whose lock expired belonged to a worker that died mid-batch.
+        ready = {'$or': [
+            {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+            {'status': 'sending', 'locked_until': {'$lte': now}},
+        ]}
+        batch = []
+        for _ in range(self.app.config['MAIL_OUTBOX_BATCH_SIZE']):
+            doc = self.collection.find_one_and_update(
+                ready,
+                {'$set': {'status': 'sending', 'locked_until': lock_until}},
+                sort=[('next_attempt_at', ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                break
+            batch.append(doc)
+        return batch
+
+    def _send_batch(self, batch):
+        pending = list(batch)
+        with self.app.app_context():
+            try:
+                with self.mail.connect() as connection:
+                    while pending:
+                        doc = pending[0]
+                        try:
+                            with self.timer('smtp'):
+                                connection.send(Message(
+                                    doc['subject'], sender=doc['sender'], recipients=doc['recipients'],
+                                    html=doc.get('html'), body=doc.get('body'),
+                                ))
+                        except smtplib.SMTPRecipientsRefused as e:
+                            # Only this message is bad; keep using the connection for the rest.
+                            self._failed(pending.pop(0), e)
+                            continue
+                        except (smtplib.SMTPException, OSError):
+                            # The connection is broken; everything still pending fails below.
+                            raise
+                        except Exception as e:
+                            # A message that can't be built or encoded (e.g. no sender) mustn't hold up the batch.
+                            self._failed(pending.pop(0), e)
+                            continue
+                        self.collection.update_one(
+                            {'_id': doc['_id']},
+                            {'$set': {'status': 'sent', 'sent_at': datetime.utcnow()}, '$unset': {'locked_until': ''}},
+                        )
+                        pending.pop(0)
+            except Exception as e:
+                # Anything left unsent goes back to pending with backoff rather than sitting claimed.
+                for doc in pending:
+                    self._failed(doc, e)
+
+    def _failed(self, doc, error):
+        attempts = doc.get('attempts', 0) + 1
+        update = {'attempts': attempts, 'last_error': str(error)}
+        if attempts >= self.app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+            update['status'] = 'failed'
+            log.error("Giving up on email %s to %s: %s", doc['_id'], doc['recipients'], error)
+        else:
+            delay = self.app.config['MAIL_OUTBOX_RETRY_DELAY'] * 2 ** (attempts - 1)
+            update['status'] = 'pending'
+            update['next_attempt_at'] = datetime.utcnow() + timedelta(seconds=delay)
+        self.collection.update_one({'_id': doc['_id']}, {'$set': update, '$unset': {'locked_until': ''}})
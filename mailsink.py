@@ -0,0 +1,81 @@
+import socket
+import threading
+from email import message_from_bytes, policy
+
+
+class MailSink:
+    """A local SMTP server that keeps what it receives instead of delivering it.
+
+    Stands in for the real server in tests and during development: point
+    MAIL_SERVER/MAIL_PORT at it with MAIL_USE_TLS off. Recipients listed in
+    `refuse` are rejected, to exercise the outbox's failure handling.
+    Needs the 'aiosmtpd' package.
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, refuse=(), on_message=None):
+        self.host = host
+        self.port = port or _free_port(host)
+        self.refuse = set(refuse)
+        self.on_message = on_message
+        self.messages = []
+        self.connections = 0
+        self._received = threading.Condition()
+        self._controller = None
+
+    def start(self):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise RuntimeError("MailSink requires the 'aiosmtpd' package.")
+        self._controller = Controller(self, hostname=self.host, port=self.port)
+        self._controller.start()
+        return self
+
+    def stop(self):
+        if self._controller is not None:
+            self._controller.stop()
+            self._controller = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def wait_for(self, count, timeout=5):
+        """Block until at least `count` messages have arrived; returns whether they did."""
+        with self._received:
+            return self._received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    # --- aiosmtpd handler hooks ---
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        # Called once per SMTP session, so this counts connections.
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 No such user here'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        message = {
+            'sender': envelope.mail_from,
+            'recipients': list(envelope.rcpt_tos),
+            'message': message_from_bytes(envelope.content, policy=policy.default),
+        }
+        with self._received:
+            self.messages.append(message)
+            self._received.notify_all()
+        if self.on_message:
+            self.on_message(message)
+        return '250 Message accepted for delivery'
+
+
+def _free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are already running or queued."""
+
+
+class PasswordHasher:
+    """Password hashing with a configurable method, run on a bounded process pool.
+
+    Hashing is deliberately slow; doing it in worker processes keeps the GIL
+    free for other requests, and the semaphore caps how many hashes a process
+    will queue so a login burst is turned away early instead of stalling
+    every worker thread.
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stored_method = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        # Any werkzeug method string, e.g. 'scrypt', 'scrypt:65536:8:1' or 'pbkdf2:sha256:600000'.
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 16)
+        # 0 hashes inline in the request thread (handy for tests and the debugger).
+        app.config.setdefault('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', max(1, app.config['PASSWORD_HASH_WORKERS']) * 4)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_TIMEOUT', 1.0)
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.app.config['PASSWORD_HASH_METHOD'],
+                         self.app.config['PASSWORD_SALT_LENGTH'])
+
+    def verify(self, hashed, password):
+        return self._run(check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        # Stored hashes look like "<method>$<salt>$<hash>" with the method's parameters spelled out.
+        return hashed.split('$', 1)[0] != self.stored_method()
+
+    def stored_method(self):
+        if self._stored_method is None:
+            # A throwaway hash shows how werkzeug spells the configured method, defaults included.
+            self._stored_method = self.hash('').split('$', 1)[0]
+        return self._stored_method
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.app.config['PASSWORD_HASH_QUEUE_TIMEOUT']):
+            raise HashingBusy()
+        try:
+            if not self.app.config['PASSWORD_HASH_WORKERS']:
+                return func(*args)
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                # Never fork: the parent is a threaded worker, and a child forked while another
+                # thread holds a lock (logging, the Mongo pool) inherits it locked forever.
+                self._executor = ProcessPoolExecutor(self.app.config['PASSWORD_HASH_WORKERS'], mp_context=_pool_context())
+            return self._executor
+
+
+def _pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
@@ -0,0 +1,154 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import request
+from pymongo import ReturnDocument
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded; retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+
+def parse_rule(rule):
+    """'5/minute' or '100/hour' -> (5, 60)."""
+    count, _, period = rule.partition('/')
+    if period not in PERIODS:
+        raise ValueError(f"Unknown rate limit period in {rule!r}.")
+    return int(count), PERIODS[period]
+
+
+def client_ip():
+    # Behind a proxy this is only the client's address once ProxyFix (or the like) is configured.
+    return request.remote_addr
+
+
+def form_value(*fields):
+    """Key function for the first non-empty form field, e.g. the account being signed in to."""
+    def key():
+        for field in fields:
+            value = request.form.get(field, '').strip().lower()
+            if value:
+                return value
+        return None
+    key.__name__ = 'form_' + '_'.join(fields)
+    return key
+
+
+class MemoryStore:
+    """Token buckets kept in this process: `limit` tokens, refilled evenly over `period`."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (limit, now))
+            tokens = min(limit, tokens + (now - stamp) * limit / period)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) * period / limit
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                # Forgetting the least recently seen key only ever gives it a fresh bucket.
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def create_indexes(self):
+        pass
+
+
+class MongoStore:
+    """Sliding-window counters in MongoDB, shared by every worker process.
+
+    Each key counts hits in fixed windows of `period`; the estimate weights
+    the previous window by how much of it still overlaps the sliding one.
+    Rejected hits are counted too, so hammering doesn't shorten the wait.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def create_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        elapsed = now / period - window
+        current = self.collection.find_one_and_update(
+            {'_id': f"{key}:{window}"},
+            {'$inc': {'count': 1},
+             '$setOnInsert': {'expires_at': datetime.fromtimestamp((window + 2) * period, timezone.utc)}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )['count']
+        previous = self.collection.find_one({'_id': f"{key}:{window - 1}"}, {'count': 1})
+        previous = previous['count'] if previous else 0
+
+        if previous * (1 - elapsed) + current <= limit:
+            return 0
+        if current >= limit or not previous:
+            return (1 - elapsed) * period
+        # Wait until enough of the previous window has slid out.
+        return (1 - (limit - current) / previous - elapsed) * period
+
+
+class Limiter:
+    """Per-IP and per-account request limits, checked before the view runs.
+
+    Views are wrapped with `limit` so an over-limit request is turned away
+    before any database lookup, password hash or email is attempted. Limits
+    only count the methods they're given (POST by default), so the pages
+    holding the forms stay reachable.
+    """
+
+    def __init__(self, app=None, collection=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app, collection)
+
+    def init_app(self, app, collection=None):
+        self.app = app
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        # 'mongo' shares counters across workers; 'memory' is per process but costs no round trip.
+        app.config.setdefault('RATELIMIT_STORAGE', 'memory')
+        app.config.setdefault('RATELIMIT_MEMORY_KEYS', 10000)
+        if app.config['RATELIMIT_STORAGE'] == 'mongo' and collection is not None:
+            self.store = MongoStore(collection)
+        else:
+            self.store = MemoryStore(app.config['RATELIMIT_MEMORY_KEYS'])
+
+    def create_indexes(self):
+        self.store.create_indexes()
+
+    def check(self, scope, rule, key):
+        if not self.app.config['RATELIMIT_ENABLED'] or key is None:
+            return
+        limit, period = parse_rule(rule)
+        retry_after = self.store.hit(f"{scope}:{key}", limit, period)
+        if retry_after:
+            raise RateLimited(max(1, math.ceil(retry_after)))
+
+    def limit(self, rule, key=client_ip, scope=None, methods=('POST',)):
+        def decorator(view):
+            name = scope or view.__name__
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method in methods:
+                    self.check(f"{name}:{key.__name__}", rule, key())
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
@@ -0,0 +1,323 @@
+import logging
+import math
+import os
+import threading
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from cache import TTLCache
+from book_io import normalize_isbn
+from catalog import tokenize
+
+log = logging.getLogger(__name__)
+
+# Hashed feature space; collisions at this size are rare enough not to matter for ranking.
+DIMENSIONS = 1 << 20
+FIELD_WEIGHTS = {'title': 1.0, 'author': 2.0, 'genre': 1.5, 'description': 0.5}
+# Long descriptions would swamp the other fields and bloat the matrix.
+MAX_DESCRIPTION_WORDS = 200
+VECTOR_PROJECTION = {'title': 1, 'author': 1, 'genre': 1, 'description': 1, 'isbn': 1}
+# Change-feed page size when building a library's vectors in the background.
+BUILD_PAGE_SIZE = 1000
+MIN_SIMILARITY = 0.05
+
+np = None
+
+
+def _numpy():
+    # Imported on first use; numpy would otherwise add to every worker's boot.
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def features(book):
+    """Sparse feature vector of a book: sorted hashed indices and their weights.
+
+    Word unigrams and bigrams from each field, prefixed with the field so a
+    word in a title and the same word in a description count separately.
+    Term counts are dampened (1 + log tf) and scaled by the field weight.
+    """
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        words = tokenize(book.get(field))
+        if field == 'description':
+            words = words[:MAX_DESCRIPTION_WORDS]
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        if field in ('title', 'author') and book.get(field):
+            # The whole value too, so exact title/author matches stand out.
+            grams.append('=' + book[field].strip().lower())
+        for gram, count in Counter(grams).items():
+            counts[zlib.crc32(f"{field}:{gram}".encode()) % DIMENSIONS] += (1 + math.log(count)) * weight
+    if not counts:
+        # Rows can't be empty (reduceat needs every row to own a slot); one shared feature for blank books.
+        counts[0] = 1.0
+    indices = np.fromiter(sorted(counts), dtype=np.int64, count=len(counts))
+    values = np.array([counts[index] for index in indices.tolist()], dtype=np.float64)
+    return indices, values
+
+
+def stack(rows):
+    """(indices, values) rows -> CSR arrays (indptr, indices, data)."""
+    lengths = np.array([len(indices) for indices, _ in rows])
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    return indptr, np.concatenate([indices for indices, _ in rows]), np.concatenate([values for _, values in rows])
+
+
+def normalize(indptr, data):
+    norms = np.sqrt(np.add.reduceat(data * data, indptr[:-1]))
+    return data / np.repeat(norms, np.diff(indptr))
+
+
+def scores(indptr, indices, data, query_indices, query_weights):
+    """Dot product of one sorted sparse vector with every CSR row, without densifying either."""
+    position = np.searchsorted(query_indices, indices).clip(max=len(query_indices) - 1)
+    hit = query_indices[position] == indices
+    return np.add.reduceat(np.where(hit, data * query_weights[position], 0), indptr[:-1])
+
+
+def _owned_key(book):
+    return (book.get('title') or '').strip().lower(), (book.get('author') or '').strip().lower()
+
+
+class LibraryVectors:
+    """TF-IDF vectors for one user's books, stacked as a CSR matrix.
+
+    Rows are kept per book, so a mutation only re-featurises the books it
+    touched; the matrix and IDF weights are re-stacked from them, in a few
+    vectorised passes, the next time they're needed.
+    """
+
+    def __init__(self):
+        # Stats version last caught up to (None until a view has checked), and the change-feed token read up to.
+        self.version = None
+        self.token = None
+        self.rows = {}
+        self.owned = {}
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def set(self, book):
+        with self._lock:
+            self.rows[book['_id']] = features(book)
+            self.owned[book['_id']] = (normalize_isbn(book.get('isbn')), _owned_key(book))
+            self._matrix = None
+
+    def remove(self, book_id):
+        with self._lock:
+            self.owned.pop(book_id, None)
+            if self.rows.pop(book_id, None) is not None:
+                self._matrix = None
+
+    def matrix(self):
+        with self._lock:
+            if self._matrix is None and self.rows:
+                self._matrix = self._stack()
+            return self._matrix
+
+    def _stack(self):
+        ids = list(self.rows)
+        indptr, indices, data = stack([self.rows[book_id] for book_id in ids])
+        # Smoothed IDF over this library: features shared by many books say little.
+        vocabulary, columns, df = np.unique(indices, return_inverse=True, return_counts=True)
+        idf = np.log((1 + len(ids)) / (1 + df)) + 1
+        data = normalize(indptr, data * idf[columns])
+        # `columns` renumbers features densely, so a query over the shelf is a gather rather than a search.
+        return {'ids': ids, 'rows': {book_id: row for row, book_id in enumerate(ids)},
+                'indptr': indptr, 'columns': columns, 'data': data,
+                'vocabulary': vocabulary, 'idf': idf, 'max_idf': math.log(1 + len(ids)) + 1}
+
+    @staticmethod
+    def idf(matrix, indices):
+        # This library's IDF for outside features; ones it has never seen count as the rarest.
+        position = np.searchsorted(matrix['vocabulary'], indices).clip(max=len(matrix['vocabulary']) - 1)
+        return np.where(matrix['vocabulary'][position] == indices, matrix['idf'][position], matrix['max_idf'])
+
+
+class Recommender:
+    """Similar books from the reader's own shelf and, when built, the offline catalog.
+
+    Each user's vectors are built once, in the background, and kept in a
+    process-wide cache. Mutations made through the Library update the cached
+    rows in place. A library version the cache doesn't know (a change made
+    by another worker) is caught up from the sync change feed, re-featurising
+    only the books changed since. Pages never wait for a full build: until
+    one finishes, they simply show no suggestions.
+    """
+
+    def __init__(self, app=None, library=None, catalog=None):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, library, catalog)
+
+    def init_app(self, app, library, catalog=None):
+        self.app = app
+        self.changes = library.changes
+        self.catalog = catalog
+        app.config.setdefault('RECOMMEND_LIMIT', 6)
+        app.config.setdefault('RECOMMEND_CACHE_SIZE', 256)
+        # The change feed keeps cached vectors current, so they only expire to free memory.
+        app.config.setdefault('RECOMMEND_CACHE_TTL', 24 * 3600)
+        # Changes caught up within a page view; a bigger backlog is left to a background build.
+        app.config.setdefault('RECOMMEND_CATCHUP_LIMIT', 200)
+        # 0 builds inline (handy for tests and the debugger).
+        app.config.setdefault('RECOMMEND_BUILD_WORKERS', 1)
+        # Catalog editions scored per view; they're shortlisted by shared title/author words first.
+        app.config.setdefault('RECOMMEND_CATALOG_CANDIDATES', 300)
+        self._cache = TTLCache(maxsize=app.config['RECOMMEND_CACHE_SIZE'], ttl=app.config['RECOMMEND_CACHE_TTL'])
+        # user_id -> [lock, threads holding or waiting on it]; one reader's build doesn't hold up another's.
+        self._building = {}
+        self._building_lock = threading.Lock()
+        self._scheduled = set()
+        library.subscribe(self._library_changed)
+
+    def configure(self, config):
+        self._cache.resize(config['RECOMMEND_CACHE_SIZE'], config['RECOMMEND_CACHE_TTL'])
+
+    def _library_changed(self, user_id, changed, deleted):
+        vectors = self._cache.get(user_id)
+        if vectors is None:
+            return
+        for book in changed:
+            vectors.set(book)
+        for book_id in deleted:
+            vectors.remove(book_id)
+        # Every notified mutation bumped the stats version by one; a gap means another worker wrote too.
+        if vectors.version is not None:
+            vectors.version += 1
+
+    def vectors(self, user_id, version):
+        """This user's vectors, caught up to `version` where that's quick; None while they're being built."""
+        _numpy()
+        vectors = self._cache.get(user_id)
+        if vectors is None:
+            self._schedule(user_id)
+            return self._cache.get(user_id)
+        if vectors.version != version:
+            with self._build_lock(user_id):
+                if vectors.version != version:
+                    if self._catch_up(user_id, vectors, self.app.config['RECOMMEND_CATCHUP_LIMIT']):
+                        vectors.version = version
+                    else:
+                        # Too much changed to redo on a page view; serve these and finish in the background.
+                        self._schedule(user_id)
+        return vectors
+
+    def _catch_up(self, user_id, vectors, limit):
+        # Re-reading entries already applied is harmless: set() and remove() are idempotent.
+        entries, vectors.token, more = self.changes.changes(user_id, vectors.token, limit, VECTOR_PROJECTION)
+        for entry in entries:
+            if entry.get('deleted'):
+                vectors.remove(entry['_id'])
+            else:
+                vectors.set(entry)
+        return not more
+
+    def _schedule(self, user_id):
+        if not self.app.config['RECOMMEND_BUILD_WORKERS']:
+            return self._build(user_id)
+        with self._building_lock:
+            if user_id in self._scheduled:
+                return
+            self._scheduled.add(user_id)
+        self._get_executor().submit(self._build, user_id)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(self.app.config['RECOMMEND_BUILD_WORKERS'],
+                                                    thread_name_prefix='recommend')
+            return self._executor
+
+    def _build(self, user_id):
+        try:
+            with self._build_lock(user_id):
+                vectors = self._cache.get(user_id) or LibraryVectors()
+                # A first build is a full sync of the feed: every book, and the token to continue from.
+                while not self._catch_up(user_id, vectors, BUILD_PAGE_SIZE):
+                    pass
+                self._cache.set(user_id, vectors)
+        except Exception:
+            log.exception("Building recommendation vectors for %s failed.", user_id)
+        finally:
+            with self._building_lock:
+                self._scheduled.discard(user_id)
+
+    @contextmanager
+    def _build_lock(self, user_id):
+        # Concurrent views of one library build its vectors once; the entry goes when nobody needs it.
+        with self._building_lock:
+            entry = self._building.setdefault(user_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._building_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._building[user_id]
+
+    def similar(self, user_id, book_id, version, limit=None):
+        """Ids of the books on the shelf most like `book_id`, best first."""
+        limit = limit or self.app.config['RECOMMEND_LIMIT']
+        vectors = self.vectors(user_id, version)
+        matrix = vectors and vectors.matrix()
+        row = matrix['rows'].get(book_id) if matrix else None
+        if row is None or len(matrix['ids']) < 2:
+            return []
+        start, end = matrix['indptr'][row], matrix['indptr'][row + 1]
+        query = np.zeros(len(matrix['vocabulary']))
+        query[matrix['columns'][start:end]] = matrix['data'][start:end]
+        similarity = np.add.reduceat(matrix['data'] * query[matrix['columns']], matrix['indptr'][:-1])
+        similarity[row] = 0
+        limit = min(limit, len(similarity) - 1)
+        top = np.argpartition(-similarity, limit - 1)[:limit]
+        top = top[np.argsort(-similarity[top], kind='stable')]
+        return [matrix['ids'][i] for i in top.tolist() if similarity[i] >= MIN_SIMILARITY]
+
+    def from_catalog(self, user_id, book, version, limit=None):
+        """Catalog editions most like `book` that aren't already on the shelf."""
+        if self.catalog is None:
+            return []
+        limit = limit or self.app.config['RECOMMEND_LIMIT']
+        words = tokenize(book.get('author')) + tokenize(book.get('title'))
+        candidates = self.catalog.related(words, self.app.config['RECOMMEND_CATALOG_CANDIDATES'])
+        vectors = self.vectors(user_id, version)
+        matrix = vectors and vectors.matrix()
+        if not candidates or matrix is None:
+            return []
+
+        owned = list(vectors.owned.values())
+        isbns = {isbn for isbn, _ in owned if isbn}
+        keys = {key for _, key in owned}
+        candidates = [record for record in candidates
+                      if record.get('isbn') not in isbns and _owned_key(record) not in keys]
+        if not candidates:
+            return []
+
+        # Weight the book and all candidates with the shelf's IDF, then score them in one pass.
+        query_indices, query_values = features(book)
+        query = query_values * LibraryVectors.idf(matrix, query_indices)
+        query /= np.sqrt((query * query).sum())
+        indptr, indices, data = stack([features(record) for record in candidates])
+        data = normalize(indptr, data * LibraryVectors.idf(matrix, indices))
+        similarity = scores(indptr, indices, data, query_indices, query)
+
+        results, seen = [], set()
+        for i in np.argsort(-similarity, kind='stable').tolist():
+            if similarity[i] < MIN_SIMILARITY or len(results) == limit:
+                break
+            # Editions of the same book differ only by ISBN; show each title/author once.
+            key = _owned_key(candidates[i])
+            if key not in seen:
+                seen.add(key)
+                results.append(candidates[i])
+        return results
@@ -0,0 +1,120 @@
+// Suggests books from the offline catalog while the title or ISBN is typed, and prefills the form.
+document.addEventListener('DOMContentLoaded', function () {
+    const form = document.querySelector('form[data-suggest-url]');
+    const list = document.getElementById('catalogSuggestions');
+    if (!form || !list) return;
+
+    const titleInput = form.querySelector('[name="title"]');
+    const isbnInput = form.querySelector('[name="isbn"]');
+    const fields = ['title', 'author', 'genre', 'description', 'isbn'];
+    let results = [];
+    let active = -1;
+    let timer = null;
+    let controller = null;
+
+    function fetchSuggestions(query, onResults) {
+        if (controller) controller.abort();
+        controller = new AbortController();
+        fetch(`${form.dataset.suggestUrl}?q=${encodeURIComponent(query)}`, {
+            headers: { 'Accept': 'application/json' },
+            credentials: 'same-origin',
+            signal: controller.signal
+        })
+            .then(response => response.ok ? response.json() : { results: [] })
+            .then(data => onResults(data.results))
+            .catch(() => {});
+    }
+
+    function setField(name, value, overwrite) {
+        const input = form.querySelector(`[name="${name}"]`);
+        if (!input || !value || (input.value.trim() && !overwrite)) return;
+        input.value = value;
+        // Keeps the floating labels in books.js in step.
+        input.dispatchEvent(new Event('input'));
+    }
+
+    function prefill(book, overwriteTitle) {
+        // Only fill what the reader hasn't typed themselves.
+        fields.forEach(name => setField(name, book[name], overwriteTitle && name === 'title'));
+    }
+
+    function hide() {
+        list.hidden = true;
+        list.innerHTML = '';
+        results = [];
+        active = -1;
+    }
+
+    function show(books) {
+        results = books;
+        active = -1;
+        list.innerHTML = '';
+        books.forEach((book, index) => {
+            const item = document.createElement('li');
+            item.textContent = book.title;
+            if (book.author) {
+                const author = document.createElement('small');
+                author.textContent = book.author;
+                item.appendChild(author);
+            }
+            item.addEventListener('mousedown', event => {
+                event.preventDefault();
+                choose(index);
+            });
+            list.appendChild(item);
+        });
+        list.hidden = books.length === 0;
+    }
+
+    function choose(index) {
+        if (results[index]) prefill(results[index], true);
+        hide();
+    }
+
+    function highlight(index) {
+        const items = list.querySelectorAll('li');
+        items.forEach(item => item.classList.remove('active'));
+        if (items[index]) {
+            items[index].classList.add('active');
+            active = index;
+        }
+    }
+
+    titleInput.addEventListener('input', function () {
+        clearTimeout(timer);
+        const query = this.value.trim();
+        if (query.length < 2) {
+            hide();
+            return;
+        }
+        timer = setTimeout(() => fetchSuggestions(query, show), 150);
+    });
+
+    titleInput.addEventListener('keydown', function (event) {
+        if (list.hidden) return;
+        if (event.key === 'ArrowDown') {
+            event.preventDefault();
+            highlight(Math.min(active + 1, results.length - 1));
+        } else if (event.key === 'ArrowUp') {
+            event.preventDefault();
+            highlight(Math.max(active - 1, 0));
+        } else if (event.key === 'Enter' && active >= 0) {
+            event.preventDefault();
+            choose(active);
+        } else if (event.key === 'Escape') {
+            hide();
+        }
+    });
+
+    titleInput.addEventListener('blur', hide);
+
+    if (isbnInput) {
+        isbnInput.addEventListener('input', function () {
+            const digits = this.value.replace(/[^0-9Xx]/g, '');
+            if (digits.length !== 10 && digits.length !== 13) return;
+            fetchSuggestions(digits, books => {
+                if (books.length) prefill(books[0], false);
+            });
+        });
+    }
+});
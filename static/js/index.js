@@ -27,4 +27,86 @@ window.onclick = function(event) {
     if (event.target == modal) {
         closeDeleteModal();
     }
-}
\ No newline at end of file
+}
+function updateStats(summary) {
+    if(!summary) {
+        return;
+    }
+    document.querySelectorAll('[data-stat]').forEach(function(element) {
+        const value = summary[element.dataset.stat];
+        if(element.dataset.stat === 'avg_rating') {
+            element.textContent = value === null ? '---' : value.toFixed(1);
+        } else {
+            element.textContent = value;
+        }
+    });
+}
+
+function removeCard(bookId) {
+    const card = document.querySelector(`[data-book-id="${bookId}"]`);
+    if(card) {
+        card.remove();
+    }
+}
+
+function upsertCard(bookId, html) {
+    const grid = document.getElementById('bookGrid');
+    const template = document.createElement('template');
+    template.innerHTML = html.trim();
+    const card = template.content.firstElementChild;
+    const existing = document.querySelector(`[data-book-id="${bookId}"]`);
+    if(existing) {
+        existing.replaceWith(card);
+    } else if(grid) {
+        grid.prepend(card);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    // Delete in place instead of reloading the whole shelf.
+    const deleteForm = document.getElementById('deleteForm');
+    if(deleteForm) {
+        deleteForm.addEventListener('submit', function(event) {
+            event.preventDefault();
+            fetch(deleteForm.action, {
+                method: 'POST',
+                body: new FormData(deleteForm),
+                headers: {'Accept': 'application/json'},
+                credentials: 'same-origin'
+            }).then(function(response) {
+                if(!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                return response.json();
+            }).then(function(data) {
+                removeCard(data.deleted);
+                updateStats(data.summary);
+                closeDeleteModal();
+            }).catch(function() {
+                deleteForm.submit();
+            });
+        });
+    }
+
+    // Live updates from other tabs and background work (e.g. a cover finishing).
+    const grid = document.getElementById('bookGrid');
+    if(grid && grid.dataset.eventsUrl && window.EventSource) {
+        const source = new EventSource(grid.dataset.eventsUrl);
+        source.addEventListener('upsert', function(event) {
+            const data = JSON.parse(event.data);
+            upsertCard(data.id, data.html);
+            updateStats(data.summary);
+        });
+        source.addEventListener('delete', function(event) {
+            const data = JSON.parse(event.data);
+            removeCard(data.id);
+            updateStats(data.summary);
+        });
+        source.addEventListener('reset', function() {
+            window.location.reload();
+        });
+        window.addEventListener('beforeunload', function() {
+            source.close();
+        });
+    }
+});
@@ -119,28 +119,63 @@ function initializeBookSearch() {
     if (sortSelect) {
         sortSelect.addEventListener('change', sortBooks);
     }
+    const searchMoreBtn = document.getElementById('searchMoreBtn');
+    if (searchMoreBtn) {
+        searchMoreBtn.addEventListener('click', () => {
+            if (searchNextPage) runSearch(parseInt(searchNextPage, 10));
+        });
+    }
 }
 
+// Searches run on the server against the whole library, so the current
+// page of cards is kept aside and restored when the search box is cleared.
+let searchTimer = null;
+let shelfGridHtml = null;
+let searchNextPage = null;
+
 function filterBooks() {
-    const searchTerm = document.getElementById('searchBar').value.toLowerCase().trim();
-    const bookCards = document.querySelectorAll('.book-card');
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => runSearch(1), 250);
+}
+
+async function runSearch(page) {
+    const searchBar = document.getElementById('searchBar');
+    const bookGrid = document.getElementById('bookGrid');
+    if (!searchBar || !bookGrid) return;
+
+    const searchTerm = searchBar.value.trim();
     const noResults = document.getElementById('noResults');
-    let visibleCount = 0;
-
-    bookCards.forEach(card => {
-        const title = card.getAttribute('data-title') || '';
-        const author = card.getAttribute('data-author') || '';
-        const isMatch = title.includes(searchTerm) || author.includes(searchTerm);
-        if (isMatch) {
-            card.style.display = 'block';
-            visibleCount++;
-        } else {
-            card.style.display = 'none';
-        }
-    });
+    const pagination = document.getElementById('shelfPagination');
+    const searchMore = document.getElementById('searchMore');
+
+    if (shelfGridHtml === null) {
+        shelfGridHtml = bookGrid.innerHTML;
+    }
+
+    if (!searchTerm) {
+        bookGrid.innerHTML = shelfGridHtml;
+        if (pagination) pagination.style.display = '';
+        if (searchMore) searchMore.style.display = 'none';
+        if (noResults) noResults.style.display = 'none';
+        return;
+    }
+
+    const params = new URLSearchParams({ q: searchTerm, page: page });
+    const response = await fetch(`/search?${params}`, { headers: { 'Accept': 'text/html' } });
+    if (!response.ok || searchBar.value.trim() !== searchTerm) return;
+
+    const html = await response.text();
+    if (page === 1) {
+        bookGrid.innerHTML = html;
+    } else {
+        bookGrid.insertAdjacentHTML('beforeend', html);
+    }
+    searchNextPage = response.headers.get('X-Next-Page');
 
+    if (pagination) pagination.style.display = 'none';
+    if (searchMore) searchMore.style.display = searchNextPage ? '' : 'none';
     if (noResults) {
-        noResults.style.display = visibleCount === 0 ? 'block' : 'none';
+        noResults.style.display = bookGrid.querySelector('.book-card') ? 'none' : 'block';
     }
 }
 
@@ -148,21 +183,11 @@ function sortBooks() {
     const sortValue = document.getElementById('sortBy').value;
     if (!sortValue) return;
 
-    const bookGrid = document.getElementById('bookGrid');
-    if (!bookGrid) return;
-
-    const bookCards = Array.from(bookGrid.querySelectorAll('.book-card'));
-    const [field, direction] = sortValue.split('-');
-
-    bookCards.sort((a, b) => {
-        const valueA = a.getAttribute(`data-${field}`) || '';
-        const valueB = b.getAttribute(`data-${field}`) || '';
-
-        const comparison = valueA.localeCompare(valueB, undefined, { numeric: true });
-        return direction === 'desc' ? -comparison : comparison;
-    });
-
-    bookCards.forEach(card => bookGrid.appendChild(card));
+    // Sorting is done by the server so it covers the whole library, not just the current page
+    const params = new URLSearchParams(window.location.search);
+    params.set('sort', sortValue);
+    params.delete('after');
+    window.location.search = params.toString();
 }
 
 
@@ -202,7 +227,7 @@ function initializeUploadModal() {
             if (fileInput.files.length > 0) {
                 uploadText.textContent = fileInput.files[0].name;
             } else {
-                uploadText.textContent = 'Choose your JSON file';
+                uploadText.textContent = 'Choose your JSON, NDJSON or CSV file';
             }
         });
 
@@ -211,7 +236,7 @@ function initializeUploadModal() {
             if (fileInput.files.length > 0) {
                 uploadForm.submit();
             } else {
-                alert("Please select a JSON file to upload.");
+                alert("Please select a file to upload.");
             }
         });
     }
@@ -0,0 +1,162 @@
+from collections import Counter
+from datetime import datetime
+
+
+# Counters kept on every per-user stats document.
+COUNTERS = ('count', 'rated', 'rating_sum', 'finished', 'duration_days', 'duration_count')
+HISTOGRAMS = ('by_year', 'by_month', 'genres')
+
+
+def genre_key(genre):
+    # Genres become field names inside the stats document, so '.' and '$' are dropped.
+    if not genre:
+        return None
+    return genre.strip().lower().replace('.', '').replace('$', '') or None
+
+
+# The book fields book_contribution reads; enough to take a book back out of the counters.
+STATS_PROJECTION = {'rating': 1, 'reading_started': 1, 'reading_finished': 1, 'genre': 1}
+
+
+def book_contribution(book, sign=1):
+    inc = Counter({'count': sign})
+    rating = book.get('rating') or 0
+    if rating > 0:
+        inc['rated'] += sign
+        inc['rating_sum'] += sign * rating
+
+    started, finished = book.get('reading_started'), book.get('reading_finished')
+    if finished:
+        inc['finished'] += sign
+        inc[f'by_year.{finished.year}'] += sign
+        inc[f'by_month.{finished:%Y-%m}'] += sign
+        if started and finished >= started:
+            inc['duration_days'] += sign * (finished - started).days
+            inc['duration_count'] += sign
+
+    genre = genre_key(book.get('genre'))
+    if genre:
+        inc[f'genres.{genre}'] += sign
+    return inc
+
+
+def month_streaks(by_month, today=None):
+    # A streak is a run of consecutive months with at least one finished book.
+    today = today or datetime.utcnow()
+    months = sorted(
+        (int(year), int(month)) for year, month in (key.split('-') for key, n in by_month.items() if n > 0)
+    )
+    longest, run, previous = 0, 0, None
+    for year, month in months:
+        index = year * 12 + month - 1
+        run = run + 1 if previous is not None and index == previous + 1 else 1
+        longest = max(longest, run)
+        previous = index
+
+    # The current streak may end this month or last month (this month isn't over yet).
+    current_index = today.year * 12 + today.month - 1
+    current = run if previous is not None and current_index - previous <= 1 else 0
+    return current, longest
+
+
+class LibraryStats:
+    """Per-user reading statistics kept up to date by the book mutation paths."""
+
+    def __init__(self, collection, books):
+        self.collection = collection
+        self.books = books
+
+    def apply(self, user_id, added=(), removed=()):
+        inc = Counter()
+        for book in added:
+            inc.update(book_contribution(book))
+        for book in removed:
+            inc.update(book_contribution(book, -1))
+        # Counter.update keeps zero entries; they are harmless but pointless to send.
+        inc = {key: value for key, value in inc.items() if value}
+        # `version` changes on every mutation and drives the HTTP validators for library pages.
+        inc['version'] = 1
+
+        result = self.collection.update_one({'_id': user_id}, {'$inc': inc, '$set': {'updated_at': datetime.utcnow()}})
+        if not result.matched_count:
+            # First change for a user whose stats were never built; the write is already in books.
+            self.rebuild(user_id)
+
+    def touch(self, user_id):
+        # For changes that don't affect any counter (e.g. a cover finishing upload).
+        self.apply(user_id)
+
+    def delete(self, user_id):
+        self.collection.delete_one({'_id': user_id})
+
+    def get(self, user_id):
+        doc = self.collection.find_one({'_id': user_id})
+        if doc is None:
+            doc = self.rebuild(user_id)
+        return doc
+
+    def summary(self, user_id, doc=None):
+        doc = doc or self.get(user_id)
+        rated, durations = doc.get('rated', 0), doc.get('duration_count', 0)
+        current_streak, longest_streak = month_streaks(doc.get('by_month', {}))
+        return {
+            'total': doc.get('count', 0),
+            'finished': doc.get('finished', 0),
+            'avg_rating': doc.get('rating_sum', 0) / rated if rated else None,
+            'avg_days': doc.get('duration_days', 0) / durations if durations else None,
+            'by_year': sorted((year, n) for year, n in doc.get('by_year', {}).items() if n > 0),
+            'by_month': sorted((month, n) for month, n in doc.get('by_month', {}).items() if n > 0),
+            'genres': sorted(((genre, n) for genre, n in doc.get('genres', {}).items() if n > 0), key=lambda item: (-item[1], item[0])),
+            'current_streak': current_streak,
+            'longest_streak': longest_streak,
+        }
+
+    def rebuild(self, user_id):
+        finished = {'$ifNull': ['$reading_finished', False]}
+        has_duration = {'$and': [
+            finished,
+            {'$ifNull': ['$reading_started', False]},
+            {'$gte': ['$reading_finished', '$reading_started']},
+        ]}
+        days = {'$floor': {'$divide': [{'$subtract': ['$reading_finished', '$reading_started']}, 24 * 3600 * 1000]}}
+        with_finished = {'$match': {'reading_finished': {'$ne': None}}}
+
+        pipeline = [
+            {'$match': {'user_id': user_id}},
+            {'$facet': {
+                'totals': [{'$group': {
+                    '_id': None,
+                    'count': {'$sum': 1},
+                    'rated': {'$sum': {'$cond': [{'$gt': ['$rating', 0]}, 1, 0]}},
+                    'rating_sum': {'$sum': {'$cond': [{'$gt': ['$rating', 0]}, '$rating', 0]}},
+                    'finished': {'$sum': {'$cond': [finished, 1, 0]}},
+                    'duration_days': {'$sum': {'$cond': [has_duration, days, 0]}},
+                    'duration_count': {'$sum': {'$cond': [has_duration, 1, 0]}},
+                }}],
+                'by_year': [with_finished, {'$group': {'_id': {'$toString': {'$year': '$reading_finished'}}, 'n': {'$sum': 1}}}],
+                'by_month': [with_finished, {'$group': {
+                    '_id': {'$dateToString': {'format': '%Y-%m', 'date': '$reading_finished'}}, 'n': {'$sum': 1},
+                }}],
+                'genres': [
+                    {'$match': {'genre': {'$nin': [None, '']}}},
+                    {'$group': {'_id': '$genre', 'n': {'$sum': 1}}},
+                ],
+            }},
+        ]
+        result = next(self.books.aggregate(pipeline))
+
+        totals = result['totals'][0] if result['totals'] else {}
+        doc = {counter: totals.get(counter, 0) for counter in COUNTERS}
+        for histogram in HISTOGRAMS:
+            doc[histogram] = {row['_id']: row['n'] for row in result[histogram] if row['_id']}
+        # Raw genre spellings are merged here so the keys match genre_key() exactly.
+        genres = Counter()
+        for genre, n in doc['genres'].items():
+            if genre_key(genre):
+                genres[genre_key(genre)] += n
+        doc['genres'] = dict(genres)
+        doc['updated_at'] = datetime.utcnow()
+
+        self.collection.update_one({'_id': user_id}, {'$set': doc}, upsert=True)
+        doc['_id'] = user_id
+        return doc
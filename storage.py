@@ -0,0 +1,319 @@
+import re
+import threading
+from datetime import datetime
+
+from pymongo import MongoClient, ASCENDING, DESCENDING, InsertOne, UpdateOne, DeleteOne
+
+from book_io import normalize_isbn
+
+# Case-insensitive ordering for title/author, matching the old client-side sort.
+TEXT_COLLATION = {'locale': 'en', 'strength': 2}
+# Relative weight of each field in library search ranking.
+SEARCH_WEIGHTS = {'title': 10, 'author': 5, 'genre': 3, 'description': 1}
+
+
+class Storage:
+    """Owns the database client and hands out the repositories.
+
+    The client is only created on first use, so importing the app or booting a
+    worker never waits on the network. `backend='memory'` swaps MongoDB for an
+    in-process mongomock database for local benchmarking and load tests.
+    """
+
+    def __init__(self, uri=None, backend='mongo', database='myreadingjourney', **client_options):
+        self.uri = uri
+        self.backend = backend
+        self.database = database
+        self.client_options = client_options
+        self._client = None
+        self._lock = threading.Lock()
+
+        self.users = UserRepo(self.collection('users'))
+        self.books = BookRepo(self.collection('books'), in_memory=backend == 'memory')
+
+    @classmethod
+    def from_config(cls, config, **client_options):
+        storage = cls(**client_options)
+        storage.configure(config)
+        return storage
+
+    def configure(self, config):
+        # Settings can change until the client exists (e.g. create_app() overrides in tests).
+        if self._client is not None:
+            raise RuntimeError("Storage is already connected; configure it before first use.")
+        self.uri = config.get('MONGO_URI')
+        self.backend = config.get('STORAGE_BACKEND', 'mongo')
+        self.books.in_memory = self.backend == 'memory'
+        self.client_options.update(
+            maxPoolSize=config.get('MONGO_MAX_POOL_SIZE', 50),
+            minPoolSize=config.get('MONGO_MIN_POOL_SIZE', 0),
+            maxIdleTimeMS=config.get('MONGO_MAX_IDLE_TIME_MS', 60000),
+            connectTimeoutMS=config.get('MONGO_CONNECT_TIMEOUT_MS', 5000),
+            serverSelectionTimeoutMS=config.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+            socketTimeoutMS=config.get('MONGO_SOCKET_TIMEOUT_MS', 20000),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _create_client(self):
+        if self.backend == 'memory':
+            try:
+                import mongomock
+            except ImportError:
+                raise RuntimeError("STORAGE_BACKEND=memory requires the 'mongomock' package.")
+            return mongomock.MongoClient()
+        if not self.uri:
+            raise RuntimeError("MONGO_URI environment variable is not set!")
+        import certifi
+        return MongoClient(self.uri, tlsCAFile=certifi.where(), connect=False, **self.client_options)
+
+    @property
+    def db(self):
+        return self.client[self.database]
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+    def create_indexes(self):
+        self.users.create_indexes()
+        self.books.create_indexes()
+
+    def ping(self):
+        self.client.admin.command('ping')
+
+
+class LazyCollection:
+    # Stands in for a collection and resolves it (creating the client) on first use.
+    def __init__(self, storage, name):
+        self._storage = storage
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._storage.db[self._name], attr)
+
+
+# --- Summaries ---
+
+class Summary:
+    """A few fields of a document, for templates and list views.
+
+    Slotted, so a page of them holds far less than the full documents would;
+    item access and get() let code that reads documents like dicts use them
+    unchanged. Fields missing from the document read as None.
+    """
+    __slots__ = ()
+
+    def __init__(self, doc):
+        for field in self.__slots__:
+            setattr(self, field, doc.get(field))
+
+    @classmethod
+    def projection(cls):
+        return dict.fromkeys(cls.__slots__, 1)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._id!r})"
+
+
+class BookSummary(Summary):
+    # What a shelf card shows; the description and other long fields only load on the book's own page.
+    __slots__ = ('_id', 'user_id', 'title', 'author', 'rating', 'reading_started', 'cover_image', 'cover_thumb', 'updated_at')
+
+
+class UserSummary(Summary):
+    # Enough for the navbar, settings and session checks; never the password hash.
+    __slots__ = ('_id', 'name', 'userid', 'email', 'is_verified')
+
+
+# --- Repositories ---
+
+class UserRepo:
+    # Accounts being deleted in the background are invisible to every lookup except is_taken.
+    ACTIVE = {'deletion_pending': {'$ne': True}}
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def create_indexes(self):
+        self.collection.create_index("email", unique=True)
+        self.collection.create_index("userid", unique=True)
+
+    def get(self, user_id, projection=None):
+        return self.collection.find_one({'_id': user_id, **self.ACTIVE}, projection)
+
+    def by_email(self, email):
+        return self.collection.find_one({'email': email, **self.ACTIVE})
+
+    def by_userid(self, userid):
+        return self.collection.find_one({'userid': userid, **self.ACTIVE})
+
+    def is_taken(self, field, value, exclude_id=None):
+        query = {field: value}
+        if exclude_id is not None:
+            query['_id'] = {'$ne': exclude_id}
+        return self.collection.find_one(query, {'_id': 1}) is not None
+
+    def insert(self, user):
+        self.collection.insert_one(user)
+        return user['_id']
+
+    def update(self, user_id, fields):
+        self.collection.update_one({'_id': user_id}, {'$set': fields})
+
+    def mark_for_deletion(self, user_id):
+        self.collection.update_one({'_id': user_id}, {'$set': {'deletion_pending': True, 'deletion_requested_at': datetime.utcnow()}})
+
+    def delete(self, user_id):
+        self.collection.delete_one({'_id': user_id})
+
+    def ids(self, userid=None):
+        query = {'userid': userid} if userid else {}
+        return [user['_id'] for user in self.collection.find(query, {'_id': 1})]
+
+
+def keyset_filter(field, direction, value, book_id):
+    # Missing/null values sort before everything else in MongoDB, so they
+    # need their own branch on either side of the cursor.
+    op = '$gt' if direction == 1 else '$lt'
+    if value is None:
+        tie = {field: None, '_id': {op: book_id}}
+        return {'$or': [tie, {field: {'$ne': None}}]} if direction == 1 else tie
+    clauses = [{field: {op: value}}, {field: value, '_id': {op: book_id}}]
+    if direction == -1:
+        clauses.append({field: None})
+    return {'$or': clauses}
+
+
+class BookRepo:
+    def __init__(self, collection, in_memory=False):
+        self.collection = collection
+        # mongomock has no $text and can't take pymongo's bulk operation objects; both get fallbacks.
+        self.in_memory = in_memory
+
+    def create_indexes(self):
+        self.collection.create_index([("user_id", ASCENDING), ("reading_started", ASCENDING), ("_id", ASCENDING)])
+        self.collection.create_index([("user_id", ASCENDING), ("title", ASCENDING), ("_id", ASCENDING)], collation=TEXT_COLLATION)
+        self.collection.create_index([("user_id", ASCENDING), ("author", ASCENDING), ("_id", ASCENDING)], collation=TEXT_COLLATION)
+        self.collection.create_index([("user_id", ASCENDING), ("isbn", ASCENDING)])
+        self.collection.create_index([("user_id", ASCENDING), ("isbn_key", ASCENDING)])
+        self.collection.create_index("cover_hash", sparse=True)
+        # Covers uploaded before hashing are only known by URL; account deletion checks who else uses one.
+        self.collection.create_index("cover_image", partialFilterExpression={"cover_image": {"$type": "string"}})
+        self.collection.create_index([("user_id", ASCENDING), ("rev", ASCENDING)])
+        self.collection.create_index(
+            [("user_id", ASCENDING), ("title", "text"), ("author", "text"), ("genre", "text"), ("description", "text")],
+            weights=SEARCH_WEIGHTS, name="book_search"
+        )
+
+    def get(self, book_id, projection=None):
+        return self.collection.find_one({'_id': book_id}, projection)
+
+    def find_by_ids(self, user_id, book_ids, projection=None):
+        return self.collection.find({'_id': {'$in': list(book_ids)}, 'user_id': user_id}, projection)
+
+    def page(self, user_id, field, direction, limit, position=None, projection=None):
+        query = {'user_id': user_id}
+        if position:
+            query = {'$and': [query, keyset_filter(field, direction, *position)]}
+        collation = TEXT_COLLATION if field != 'reading_started' else None
+        cursor = self.collection.find(query, projection, collation=collation)
+        return list(cursor.sort([(field, direction), ('_id', direction)]).limit(limit))
+
+    def search(self, user_id, text, skip, limit, projection=None):
+        if not self.in_memory:
+            # The text index is prefixed by user_id, so each search only walks that user's entries.
+            cursor = self.collection.find(
+                {'user_id': user_id, '$text': {'$search': text}},
+                {**(projection or {}), 'score': {'$meta': 'textScore'}}
+            ).sort([('score', {'$meta': 'textScore'})])
+        else:
+            pattern = {'$regex': re.escape(text), '$options': 'i'}
+            cursor = self.collection.find(
+                {'user_id': user_id, '$or': [{field: pattern} for field in SEARCH_WEIGHTS]}, projection
+            ).sort([('title', ASCENDING), ('_id', ASCENDING)])
+        return list(cursor.skip(skip).limit(limit))
+
+    def has_books(self, user_id):
+        return self.collection.find_one({'user_id': user_id}, {'_id': 1}) is not None
+
+    def iter_for_user(self, user_id, projection=None, batch_size=500):
+        return self.collection.find({'user_id': user_id}, projection, batch_size=batch_size)
+
+    def changed_since(self, user_id, rev, limit, projection=None, until=None):
+        # Books with `rev` < revision <= `until` (or no upper bound), oldest first; a limit of 0 means all.
+        revs = {'$gt': rev} if until is None else {'$gt': rev, '$lte': until}
+        cursor = self.collection.find({'user_id': user_id, 'rev': revs}, projection and {**projection, 'rev': 1})
+        return list(cursor.sort('rev', ASCENDING).limit(limit))
+
+    def last_written_before(self, user_id, when, after_rev):
+        # The highest-revision book above `after_rev` last written before `when`; walks the rev index down.
+        return self.collection.find_one({'user_id': user_id, 'rev': {'$gt': after_rev}, 'updated_at': {'$lt': when}},
+                                        {'rev': 1}, sort=[('rev', DESCENDING)])
+
+    def unstamped(self, user_id, limit):
+        return list(self.collection.find({'user_id': user_id, 'rev': None}, {'_id': 1}).limit(limit))
+
+    def taken_ids(self, user_id, book_ids):
+        # Ids among `book_ids` that belong to some other user's books.
+        cursor = self.collection.find({'_id': {'$in': list(book_ids)}, 'user_id': {'$ne': user_id}}, {'_id': 1})
+        return {book['_id'] for book in cursor}
+
+    def find_matches(self, user_id, titles, isbns, projection=None):
+        # Books already on the shelf with one of these titles (case-insensitively) or ISBNs (normalized).
+        query = {'user_id': user_id, '$or': [{'title': {'$in': list(titles)}}]}
+        if isbns:
+            query['$or'].append({'isbn_key': {'$in': list(isbns)}})
+        return self.collection.find(query, projection, collation=TEXT_COLLATION)
+
+    def backfill_isbn_keys(self, batch_size=1000):
+        # Books written before isbn_key existed; each gets one (None for no valid ISBN), so this ends.
+        total = 0
+        while True:
+            batch = list(self.collection.find({'isbn_key': {'$exists': False}}, {'isbn': 1}).limit(batch_size))
+            if not batch:
+                return total
+            self.bulk_write(updates=[({'_id': book['_id']}, {'isbn_key': normalize_isbn(book.get('isbn'))}) for book in batch])
+            total += len(batch)
+
+    def insert(self, book):
+        self.collection.insert_one(book)
+        return book['_id']
+
+    def insert_many(self, books):
+        self.collection.insert_many(books, ordered=False)
+
+    def update(self, book_id, fields):
+        self.collection.update_one({'_id': book_id}, {'$set': fields})
+
+    def delete(self, book_id):
+        self.collection.delete_one({'_id': book_id})
+
+    def bulk_write(self, inserts=(), updates=(), deletes=()):
+        # `updates` are (filter, fields) pairs and `deletes` filters; one round trip on MongoDB.
+        if self.in_memory:
+            for book in inserts:
+                self.collection.insert_one(book)
+            for query, fields in updates:
+                self.collection.update_one(query, {'$set': fields})
+            for query in deletes:
+                self.collection.delete_one(query)
+            return
+        operations = [InsertOne(book) for book in inserts]
+        operations += [UpdateOne(query, {'$set': fields}) for query, fields in updates]
+        operations += [DeleteOne(query) for query in deletes]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
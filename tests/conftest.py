@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+from bson.objectid import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Everything runs in-process: mongomock instead of MongoDB, no mail leaves the machine.
+os.environ.update(STORAGE_BACKEND='memory', SECRET_KEY='tests', MAIL_SUPPRESS_SEND='true', COVER_STORE='local')
+
+import app as appmod  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    return appmod.create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': False,
+        # Tests drive the outbox themselves; keep its thread from polling underneath them.
+        'MAIL_OUTBOX_POLL_INTERVAL': 3600,
+    })
+
+
+@pytest.fixture
+def user(app):
+    return appmod.user_repo.collection.insert_one({
+        'name': 'Reader', 'userid': f"reader-{ObjectId()}", 'email': f"{ObjectId()}@example.com",
+        'password': '', 'theme': 'light', 'is_verified': True,
+    }).inserted_id
+
+
+@pytest.fixture
+def client(app, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = str(user)
+    return client
@@ -0,0 +1,54 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+import app as appmod
+
+
+@pytest.fixture
+def legacy_cover(app):
+    def upload(name):
+        store = appmod.cover_store
+        with open(os.path.join(store.root, name), 'wb') as f:
+            f.write(b'jpeg')
+        return f"{store.url_prefix}/{name}", os.path.join(store.root, name)
+    return upload
+
+
+def purge(app, user_id):
+    app.config['ACCOUNT_DELETE_BATCH_PAUSE'] = 0
+    jobs = appmod.account_deletion.jobs
+    jobs.insert_one({'_id': user_id, 'status': 'running', 'books_deleted': 0, 'covers': [], 'legacy_covers': []})
+    appmod.account_deletion._purge(jobs.find_one({'_id': user_id}))
+    return jobs.find_one({'_id': user_id})
+
+
+def test_covers_uploaded_before_hashing_are_released(app, user, legacy_cover):
+    own_url, own_path = legacy_cover(f"{ObjectId()}.jpg")
+    shared_url, shared_path = legacy_cover(f"{ObjectId()}.jpg")
+    books = appmod.book_repo.collection
+    books.insert_many([
+        {'title': 'Mine', 'user_id': user, 'cover_image': own_url},
+        {'title': 'Shared', 'user_id': user, 'cover_image': shared_url},
+        # Someone else imported an export that points at the same image.
+        {'title': 'Copy', 'user_id': ObjectId(), 'cover_image': shared_url},
+    ])
+
+    job = purge(app, user)
+
+    assert job['status'] == 'done' and job['books_deleted'] == 2
+    assert job['legacy_covers'] == []
+    assert not os.path.exists(own_path)
+    assert os.path.exists(shared_path)
+    os.remove(shared_path)
+
+
+def test_purge_waits_for_cached_users_to_expire(app, user):
+    appmod.account_deletion.schedule(user)
+
+    assert appmod.account_deletion._claim() is None
+    job = appmod.account_deletion.jobs.find_one({'_id': user})
+    assert job['next_attempt_at'] >= datetime.utcnow() + timedelta(seconds=app.config['USER_CACHE_TTL'])
+    assert appmod.user_repo.collection.find_one({'_id': user}) is not None
@@ -0,0 +1,13 @@
+from datetime import datetime
+
+from book_io import parse_book_entry
+from stats import book_contribution
+
+
+def test_dates_with_offsets_are_stored_as_naive_utc():
+    book = parse_book_entry({'title': 'Dune', 'reading_started': '2024-03-01T23:30:00-02:00',
+                             'reading_finished': '2024-03-05'}, 'u1')
+
+    assert book['reading_started'] == datetime(2024, 3, 2, 1, 30)
+    assert book['reading_finished'] == datetime(2024, 3, 5)
+    book_contribution(book)
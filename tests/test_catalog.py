@@ -0,0 +1,32 @@
+import json
+
+import catalog
+from catalog import Catalog, build_catalog
+
+
+def write_dump(path, docs):
+    with open(path, 'w') as f:
+        for doc in docs:
+            f.write(f"{doc['type']['key']}\t{doc['key']}\t1\t2024-01-01\t{json.dumps(doc)}\n")
+
+
+def test_build_spills_sorted_runs_and_resolves_authors(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'SORT_RUN_SIZE', 3)
+    author = {'type': {'key': '/type/author'}, 'key': '/authors/A1', 'name': 'Frank Herbert'}
+    editions = [
+        {'type': {'key': '/type/edition'}, 'key': f'/books/B{i}', 'title': title,
+         'isbn_10': [isbn], 'authors': [{'key': '/authors/A1'}]}
+        for i, (title, isbn) in enumerate([('Dune', '0-441-17271-7'), ('Dune Messiah', '0399128964'),
+                                           ('Children of Dune', '0399120009'), ('Dune', '0441172717')])
+    ]
+    write_dump(tmp_path / 'dump.txt', [author] + editions)
+
+    meta = build_catalog([str(tmp_path / 'dump.txt')], str(tmp_path / 'catalog'))
+
+    assert (meta['records'], meta['isbns']) == (4, 3)
+    assert sorted(p.name for p in (tmp_path / 'catalog').iterdir()) == ['isbn.idx', 'meta.json', 'prefix.idx', 'records.bin']
+    books = Catalog(str(tmp_path / 'catalog'))
+    assert books.lookup('9780441172719') == {'title': 'Dune', 'author': 'Frank Herbert', 'genre': None,
+                                             'description': None, 'isbn': '9780441172719'}
+    assert [record['title'] for record in books.suggest('dune mes')] == ['Dune Messiah']
+    assert {record['title'] for record in books.suggest('herb')} == {'Dune', 'Dune Messiah', 'Children of Dune'}
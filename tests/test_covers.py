@@ -0,0 +1,61 @@
+import io
+import os
+from datetime import datetime
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import app as appmod
+from covers import InvalidCover, PendingCover
+
+
+def png(size, color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def upload(app, user, color):
+    pipeline = appmod.cover_pipeline
+    path = os.path.join(app.config['COVER_TMP_DIR'], f"test-{color}")
+    with open(path, 'wb') as f:
+        f.write(png((40, 60), color))
+    book_id = appmod.book_repo.collection.insert_one({'title': 'Dune', 'user_id': user, 'cover_pending': color}).inserted_id
+    pipeline._process(PendingCover(color, path), book_id)
+    return appmod.book_repo.collection.find_one({'_id': book_id})
+
+
+def test_decompression_bombs_are_rejected_as_invalid(app, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+    upload = FileStorage(io.BytesIO(png((40, 60))), 'bomb.png')
+
+    with pytest.raises(InvalidCover):
+        appmod.cover_pipeline.stage(upload)
+
+
+def test_a_claimed_cover_is_not_discarded(app, user):
+    covers = appmod.cover_pipeline.covers
+    covers.insert_one({'_id': 'claimed', 'urls': {}, 'claims': 1, 'claimed_at': datetime.utcnow()})
+
+    assert appmod.cover_pipeline.discard_if_unused('claimed') is False
+    assert covers.find_one({'_id': 'claimed'}) is not None
+
+
+def test_a_discarded_cover_is_stored_again_on_upload(app, user):
+    pipeline = appmod.cover_pipeline
+    first = upload(app, user, 'red')
+    digest = first['cover_hash']
+    appmod.book_repo.collection.delete_one({'_id': first['_id']})
+    assert pipeline.covers.find_one({'_id': digest})['claims'] == 0
+    assert pipeline.discard_if_unused(digest) is True
+
+    second = upload(app, user, 'red')
+
+    record = pipeline.covers.find_one({'_id': digest})
+    assert second['cover_hash'] == digest and second['cover_thumb'] == record['urls']['thumb']
+    assert second['cover_thumb'] != first['cover_thumb']
+    assert os.path.exists(os.path.join(pipeline.store.root, f"{record['key']}-thumb.jpg"))
+    assert pipeline.discard_if_unused(digest) is False
+    appmod.book_repo.collection.delete_one({'_id': second['_id']})
+    assert pipeline.discard_if_unused(digest) is True
@@ -0,0 +1,46 @@
+import pytest
+
+import app as appmod
+
+
+@pytest.fixture
+def events_disabled(app):
+    app.config['EVENTS_ENABLED'] = False
+    yield
+    app.config['EVENTS_ENABLED'] = True
+
+
+def test_shelf_skips_live_updates_when_disabled(client, user, events_disabled):
+    appmod.library.add({'title': 'Dune', 'user_id': user})
+
+    assert b'data-events-url' not in client.get('/').data
+    assert client.get('/events').status_code == 204
+
+
+def test_shelf_offers_live_updates_by_default(client, user):
+    appmod.library.add({'title': 'Dune', 'user_id': user})
+
+    assert b'data-events-url' in client.get('/').data
+
+
+def test_streams_closed_unread_give_their_slot_back(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_STREAMS', 2)
+
+    for _ in range(3):
+        response = client.get('/events', buffered=False)
+        assert response.status_code == 200
+        # The client goes away before a byte of the body is sent.
+        response.close()
+
+    assert appmod.events._count == 0
+
+
+def test_streams_read_and_closed_give_their_slot_back(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_STREAMS', 1)
+
+    response = client.get('/events', buffered=False)
+    assert next(response.response) == b"retry: 5000\n\n"
+    assert client.get('/events', buffered=False).status_code == 503
+    response.close()
+
+    assert appmod.events._count == 0
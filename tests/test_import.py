@@ -0,0 +1,19 @@
+import app as appmod
+from book_io import ImportRow
+
+
+def rows(*entries):
+    return [ImportRow(number, entry, None) for number, entry in enumerate(entries, 1)]
+
+
+def test_duplicates_match_isbns_however_they_are_written(user):
+    appmod.library.add({'title': 'Dune', 'author': 'Frank Herbert', 'isbn': '0-441-17271-7', 'user_id': user})
+
+    result = appmod.import_books(user, rows(
+        {'title': 'Dune (40th Anniversary)', 'isbn': '978-0441172719'},
+        {'title': 'Dune Messiah', 'isbn': '0399128964'},
+    ), skip_duplicates=True)
+
+    assert (result['inserted'], result['duplicates']) == (1, 1)
+    stored = appmod.book_repo.collection.find_one({'user_id': user, 'title': 'Dune'})
+    assert stored['isbn'] == '0-441-17271-7' and stored['isbn_key'] == '9780441172719'
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+
+import app as appmod
+from mailsink import MailSink
+
+
+@pytest.fixture
+def sink(app):
+    with MailSink(refuse={'nobody@example.com'}) as sink:
+        app.config.update(MAIL_SERVER=sink.host, MAIL_PORT=sink.port, MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+        appmod.mail.init_app(app)
+        yield sink
+    app.config['MAIL_SUPPRESS_SEND'] = True
+    appmod.mail.init_app(app)
+
+
+def queue(*messages):
+    outbox = appmod.outbox
+    now = datetime.utcnow()
+    ids = outbox.collection.insert_many([
+        {'subject': subject, 'sender': sender, 'recipients': [recipient], 'html': None, 'body': 'Hi',
+         'status': 'pending', 'attempts': 0, 'created_at': now, 'next_attempt_at': now}
+        for subject, sender, recipient in messages
+    ]).inserted_ids
+    outbox._send_batch(outbox._claim_batch())
+    return [outbox.collection.find_one({'_id': doc_id}) for doc_id in ids]
+
+
+def test_batch_is_sent_over_one_connection(sink):
+    docs = queue(('One', 'app@example.com', 'a@example.com'), ('Two', 'app@example.com', 'b@example.com'))
+
+    assert [doc['status'] for doc in docs] == ['sent', 'sent']
+    assert sink.wait_for(2)
+    assert sorted(m['message']['Subject'] for m in sink.messages) == ['One', 'Two']
+    assert sink.connections == 1
+
+
+def test_bad_messages_fail_alone_and_back_off(sink):
+    refused, unsendable, good = queue(
+        ('Refused', 'app@example.com', 'nobody@example.com'),
+        # Flask-Mail refuses to build a message without a sender.
+        ('No sender', None, 'c@example.com'),
+        ('Fine', 'app@example.com', 'd@example.com'),
+    )
+
+    assert good['status'] == 'sent'
+    for doc in (refused, unsendable):
+        assert doc['status'] == 'pending'
+        assert doc['attempts'] == 1
+        assert doc['next_attempt_at'] > datetime.utcnow()
+        assert 'locked_until' not in doc
@@ -0,0 +1,9 @@
+def test_a_new_csrf_token_invalidates_cached_pages(client):
+    first = client.get('/')
+    etag = first.headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+    with client.session_transaction() as session:
+        session['csrf_token'] = 'issued-after-a-new-sign-in'
+
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,18 @@
+import multiprocessing
+
+from flask import Flask
+
+from passwords import PasswordHasher
+
+
+def test_pool_hashes_without_forking():
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    hasher = PasswordHasher(app)
+
+    hashed = hasher.hash('secret')
+
+    assert hasher.verify(hashed, 'secret') and not hasher.verify(hashed, 'wrong')
+    assert hasher._executor._mp_context.get_start_method() != 'fork'
+    assert hasher._executor._mp_context.get_start_method() in multiprocessing.get_all_start_methods()
+    hasher._executor.shutdown()
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+import app as appmod
+import recommend
+
+
+@pytest.fixture
+def recommender(app, monkeypatch):
+    recommender = appmod.recommender
+    # Nothing settles late here; catch-ups then re-read only what actually changed.
+    monkeypatch.setattr(appmod.change_log, 'settle', appmod.change_log.settle * 0)
+    return recommender
+
+
+def version(user):
+    return appmod.library_stats.get(user).get('version', 0)
+
+
+def add(user, *titles):
+    return [appmod.library.add({'title': title, 'author': 'Frank Herbert', 'user_id': user}) for title in titles]
+
+
+def test_first_view_builds_in_the_background(recommender, user, monkeypatch):
+    add(user, 'Dune', 'Dune Messiah')
+    release = threading.Event()
+    changes = recommender.changes.changes
+
+    def slow_changes(*args):
+        release.wait(5)
+        return changes(*args)
+
+    monkeypatch.setattr(recommender.changes, 'changes', slow_changes)
+
+    assert recommender.vectors(user, version(user)) is None
+    release.set()
+    recommender._get_executor().submit(lambda: None).result()
+
+    assert len(recommender.vectors(user, version(user)).rows) == 2
+    assert recommender._building == {} and recommender._scheduled == set()
+
+
+def test_writes_from_other_workers_are_caught_up_incrementally(recommender, user, monkeypatch):
+    monkeypatch.setitem(recommender.app.config, 'RECOMMEND_BUILD_WORKERS', 0)
+    dune, messiah = add(user, 'Dune', 'Dune Messiah')
+    vectors = recommender.vectors(user, version(user))
+    assert recommender.similar(user, dune['_id'], version(user)) == [messiah['_id']]
+
+    # Another worker's writes: this process isn't notified of them.
+    monkeypatch.setattr(appmod.library, '_listeners', [])
+    children, = add(user, 'Children of Dune')
+    appmod.library.remove(messiah)
+    featurised, features = [], recommend.features
+    monkeypatch.setattr(recommend, 'features', lambda book: featurised.append(book['title']) or features(book))
+
+    assert recommender.similar(user, dune['_id'], version(user)) == [children['_id']]
+    assert recommender.vectors(user, version(user)) is vectors
+    assert featurised == ['Children of Dune']
+
+
+def test_a_large_backlog_is_left_to_the_background(recommender, user, monkeypatch):
+    monkeypatch.setitem(recommender.app.config, 'RECOMMEND_BUILD_WORKERS', 0)
+    add(user, 'Dune')
+    recommender.vectors(user, version(user))
+    monkeypatch.setattr(appmod.library, '_listeners', [])
+    add(user, 'Dune Messiah', 'Children of Dune', 'God Emperor of Dune')
+    monkeypatch.setitem(recommender.app.config, 'RECOMMEND_CATCHUP_LIMIT', 2)
+    scheduled = []
+    monkeypatch.setattr(recommender, '_schedule', scheduled.append)
+
+    vectors = recommender.vectors(user, version(user))
+
+    assert len(vectors.rows) == 3 and vectors.version != version(user)
+    assert scheduled == [user]
+
@@ -0,0 +1,100 @@
+import io
+from datetime import datetime
+
+import app as appmod
+from book_io import ImportRow, book_to_json, read_json_array
+
+
+def rows(entries):
+    return [ImportRow(number, entry, None) for number, entry in enumerate(entries, 1)]
+
+
+def shelf(user):
+    return sorted((book['title'], book['rev']) for book in appmod.book_repo.collection.find({'user_id': user}))
+
+
+def test_reapplying_a_delta_changes_nothing(user):
+    dune = appmod.library.add({'title': 'Dune', 'user_id': user})
+    gone = appmod.library.add({'title': 'Gone', 'user_id': user})
+    appmod.library.remove(gone)
+    entries, _, _ = appmod.change_log.changes(user)
+    delta = [book_to_json(entry) for entry in entries]
+    delta.append({'title': 'No id', 'author': 'Nobody'})
+    delta.append({'_id': None, 'title': 'Null id'})
+    appmod.library.remove(dune)
+
+    first = appmod.import_changes(user, rows(delta))
+    after_first = shelf(user)
+    second = appmod.import_changes(user, rows(delta))
+
+    assert (first['inserted'], first['error_count']) == (1, 2)
+    assert (second['inserted'], second['updated'], second['deleted'], second['unchanged']) == (0, 0, 0, 2)
+    assert second['error_count'] == 2 and 'Missing or invalid _id' in second['errors'][0]
+    assert shelf(user) == after_first
+    assert [title for title, _ in after_first] == ['Dune']
+
+
+def test_a_saved_changes_response_imports_as_is(client, user):
+    appmod.library.add({'title': 'Dune', 'user_id': user})
+    gone = appmod.library.add({'title': 'Gone', 'user_id': user})
+    saved = client.get('/api/v1/changes').get_data(as_text=True)
+    appmod.library.remove(gone)
+
+    result = appmod.import_changes(user, read_json_array(io.StringIO(saved), chunk_size=16))
+
+    assert (result['inserted'], result['error_count']) == (1, 0)
+    assert [title for title, _ in shelf(user)] == ['Dune', 'Gone']
+
+
+def test_writes_landing_late_are_sent_on_the_next_sync(user, monkeypatch):
+    log = appmod.change_log
+    appmod.library.add({'title': 'First', 'user_id': user})
+    in_flight = log.allocate(user)
+    appmod.library.add({'title': 'Third', 'user_id': user})
+
+    entries, token, _ = log.changes(user)
+    assert [entry['title'] for entry in entries] == ['First', 'Third']
+
+    # The slow write lands behind the revision the client has read up to.
+    appmod.book_repo.collection.insert_one({'title': 'Second', 'user_id': user, 'rev': in_flight})
+    entries, token, _ = log.changes(user, token)
+    # Everything here is younger than the settle margin, so the whole window is re-sent.
+    assert [entry['title'] for entry in entries] == ['First', 'Second', 'Third']
+
+    # Once everything has settled, the overlap goes away.
+    monkeypatch.setattr(log, 'settle', log.settle * 0)
+    _, token, _ = log.changes(user, token)
+    entries, _, _ = log.changes(user, token)
+    assert entries == []
+
+
+def test_single_revision_tokens_still_work(user):
+    appmod.library.add({'title': 'Old', 'user_id': user})
+    rev = appmod.library.add({'title': 'New', 'user_id': user})['rev']
+
+    entries, _, _ = appmod.change_log.changes(user, appmod.change_log._tokens.dumps(rev - 1))
+
+    assert [entry['title'] for entry in entries] == ['New']
+
+
+def test_overlap_stays_bounded_after_a_burst(user):
+    log = appmod.change_log
+    for i in range(150):
+        appmod.library.add({'title': f"Book {i}", 'user_id': user})
+
+    token, sent = None, []
+    while True:
+        entries, token, more = log.changes(user, token, limit=50)
+        sent.append(len(entries))
+        if not more:
+            break
+    # Read while still unsettled, so earlier pages come round again.
+    assert sent == [50, 100, 150]
+
+    # Some seconds later every write has landed: one last re-send, then only new changes.
+    appmod.book_repo.collection.update_many({'user_id': user}, {'$set': {'updated_at': datetime(2020, 1, 1)}})
+    entries, token, _ = log.changes(user, token, limit=50)
+    assert len(entries) == 150
+    appmod.library.add({'title': 'Latest', 'user_id': user})
+    entries, token, _ = log.changes(user, token, limit=50)
+    assert [entry['title'] for entry in entries] == ['Latest']